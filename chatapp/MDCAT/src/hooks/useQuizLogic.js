@@ -54,12 +54,17 @@ const useQuizLogic = ({ navigation, subject, user, API_BASE_URL }) => {
           ? { user_id: user._id, current_subject: subject }
           : { user_id: user._id }
       );
-      {
-        console.log(nextQuestion);
+
+      // The RL service returns an unseen question for its pick when its
+      // question bank covers that subject and difficulty; otherwise fetch one
+      let q = nextQuestion.question;
+      if (!q) {
+        const res = await client.get(
+          `/mcqs/getQuestionByDifficulty/${nextQuestion.difficulty}/${nextQuestion.subject}`
+        );
+        q = res.data;
       }
-      
 
-      const q = res.data;
       const question = {
         id: q._id,
         question: q.question,
@@ -9,6 +9,8 @@ const useSocket = (chatId) => {
   const [messages, setMessages] = useState([]);
   const [isWaitingForReply, setIsWaitingForReply] = useState(false);
   const socket = useRef(null);
+  // Set when the server lost this chat's session; the next message resends history
+  const resendHistory = useRef(false);
 
   const getWebSocketUrl = () => {
     const host = PYTHON;
@@ -58,6 +60,21 @@ const useSocket = (chatId) => {
               break;
 
             case "answer":
+              if (data.pending) {
+                // Extractive stand-in while the full answer is generated; it
+                // arrives as answer_update and only that one is saved
+                setMessages((prevMessages) => [
+                  ...prevMessages,
+                  {
+                    sender: "bot",
+                    content: data.answer.trim(),
+                    timestamp: new Date().toISOString(),
+                    pendingSeq: data.seq,
+                  },
+                ]);
+                setIsWaitingForReply(false);
+                break;
+              }
               // Save bot response to database
               try {
                 await client.post("/chat/message", {
@@ -81,6 +98,42 @@ const useSocket = (chatId) => {
               setIsWaitingForReply(false);
               break;
 
+            case "answer_update":
+              try {
+                await client.post("/chat/message", {
+                  chatId,
+                  sender: "bot",
+                  content: data.answer.trim(),
+                });
+
+                setMessages((prevMessages) =>
+                  prevMessages.map((m) =>
+                    m.pendingSeq === data.seq
+                      ? { sender: "bot", content: data.answer.trim(), timestamp: m.timestamp }
+                      : m
+                  )
+                );
+              } catch (error) {
+                console.error("Error saving bot message:", error);
+                setError("Failed to save bot response");
+              }
+              break;
+
+            case "session_reset":
+              resendHistory.current = true;
+              break;
+
+            case "duplicate":
+              setIsWaitingForReply(false);
+              break;
+
+            case "busy":
+              // Nothing was answered; the same message can be sent again
+              // after data.retryAfter seconds
+              setError(data.message);
+              setIsWaitingForReply(false);
+              break;
+
             case "error":
               setError(data.message);
               console.error(data.message);
@@ -134,14 +187,16 @@ const useSocket = (chatId) => {
           // Add the message to the local state
           setMessages((prevMessages) => [...prevMessages, response.data.data]);
 
-          // Prepare the last 10 messages
-          const lastTenMessages = messages.slice(-10);
+          // The server keeps the chat history; seq counts user messages
+          // including this one so it can spot resends and lost sessions
+          const seq = messages.filter((m) => m.sender === "user").length + 1;
+          const message = { chatId, question: content.trim(), seq };
+          if (resendHistory.current) {
+            message.chatHistory = messages.slice(-10);
+            resendHistory.current = false;
+          }
           // Send message through WebSocket
-          const payload = JSON.stringify({
-            chatId,
-            question: content.trim(),
-            chatHistory: lastTenMessages,
-          });
+          const payload = JSON.stringify(message);
 
           socket.current.send(payload);
           setIsWaitingForReply(true);
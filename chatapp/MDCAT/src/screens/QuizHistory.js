@@ -21,6 +21,9 @@ import Loader from "../components/Loader";
 
 const { width, height } = Dimensions.get("window");
 
+const FEEDBACK_POLL_MS = 3000;
+const FEEDBACK_MAX_POLLS = 40;
+
 const QuizHistory = ({ navigation }) => {
   const { user } = useAuth();
   const [quizzes, setQuizzes] = useState([]);
@@ -53,8 +56,19 @@ const QuizHistory = ({ navigation }) => {
   const fetchFeedback = async (quizId) => {
     try {
       setLoading(true);
-      const response = await client.post(`/quiz/feedback`, { quizId });
-      setFeedbackText(response.data.feedback || "No feedback available.");
+      // 202 means the feedback is still being generated; posting the same
+      // quiz again joins that job and returns the feedback once it's ready
+      let response = await client.post(`/quiz/feedback`, { quizId });
+      for (let polls = 0; response.status === 202 && polls < FEEDBACK_MAX_POLLS; polls++) {
+        await new Promise((resolve) => setTimeout(resolve, FEEDBACK_POLL_MS));
+        response = await client.post(`/quiz/feedback`, { quizId });
+      }
+      setFeedbackText(
+        response.data.feedback ||
+          (response.status === 202
+            ? "Feedback is still being generated. Please check back shortly."
+            : "No feedback available.")
+      );
       setSelectedQuizId(quizId);
       setFeedbackVisible(true);
       setLoading(false);
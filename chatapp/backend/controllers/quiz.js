@@ -123,14 +123,32 @@ exports.generateFeedback = async (req, res) => {
       q.question.correctOption = correctOpt;
     });
 
-    // If no feedback exists, call the LLM endpoint
+    // If no feedback exists, ask the LLM service. It answers 202 with a
+    // jobId while the feedback is generated in the background; posting the
+    // same quiz again returns the finished feedback, so clients just retry.
     const llmResponse = await axios.post(
       `${process.env.URL}/llm/feedback`,
       {
         modified,
-      }
+      },
+      { validateStatus: () => true }
     );
 
+    if (llmResponse.status === 202) {
+      return res.status(202).json({
+        status: llmResponse.data.status,
+        jobId: llmResponse.data.jobId,
+        message: "Feedback is being generated, please check back shortly.",
+      });
+    }
+
+    if (llmResponse.status === 503) {
+      res.set("Retry-After", llmResponse.headers["retry-after"] || "10");
+      return res
+        .status(503)
+        .json({ message: "Feedback service is busy, please try again shortly." });
+    }
+
     if (llmResponse.status !== 200 || !llmResponse.data.feedback) {
       return res
         .status(500)
@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import Dict, FrozenSet, List, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Reuses answers for near-duplicate questions
+
+    An entry is (query embedding, retrieved context ids, answer). A lookup
+    hits when a stored embedding is within ``threshold`` cosine similarity
+    of the new query and was answered from the same set of context chunks,
+    so the cached answer was generated from identical evidence. Embeddings
+    live in a preallocated float32 matrix and are scanned with one
+    matrix-vector product. Entries expire after ``ttl`` seconds; when full,
+    the least recently used entry is replaced.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_size: int = 2000,
+        ttl: float = 3600.0,
+        enabled: bool = True,
+    ):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._created = np.zeros(max_size)
+        self._last_used = np.zeros(max_size)
+        self._used = np.zeros(max_size, dtype=bool)
+        self._context_ids: List[Optional[FrozenSet[str]]] = [None] * max_size
+        self._answers: List[Optional[str]] = [None] * max_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, context_ids: FrozenSet[str]) -> Optional[str]:
+        if not self.enabled:
+            return None
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None or not self._used.any():
+                self.misses += 1
+                return None
+
+            live = self._used & (now - self._created < self.ttl)
+            similarities = self._vectors @ query
+            candidates = np.flatnonzero(live & (similarities >= self.threshold))
+            for slot in candidates[np.argsort(-similarities[candidates])]:
+                if self._context_ids[slot] == context_ids:
+                    self._last_used[slot] = now
+                    self.hits += 1
+                    return self._answers[slot]
+
+            self.misses += 1
+            return None
+
+    def store(self, embedding, context_ids: FrozenSet[str], answer: str):
+        if not self.enabled:
+            return
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+
+            expired = self._used & (now - self._created >= self.ttl)
+            free = np.flatnonzero(~self._used | expired)
+            slot = free[0] if len(free) else int(np.argmin(self._last_used))
+
+            self._vectors[slot] = vector
+            self._created[slot] = now
+            self._last_used[slot] = now
+            self._used[slot] = True
+            self._context_ids[slot] = context_ids
+            self._answers[slot] = answer
+
+    def clear(self):
+        with self._lock:
+            self._used[:] = False
+            self._context_ids = [None] * self.max_size
+            self._answers = [None] * self.max_size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": int(self._used.sum()),
+            }
@@ -0,0 +1,212 @@
+import asyncio
+import fcntl
+import json
+import os
+import uuid
+from typing import Callable, List, Optional
+
+# Called with (chat_id, message) for messages published by other workers
+Deliver = Callable[[str, dict], None]
+
+# Frames are single JSON lines; answers with sources can exceed asyncio's 64 KiB default
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+
+class InMemoryBroadcast:
+    """Fan-out within one process
+
+    With the default private hub there is nobody else to tell, which is the
+    single-worker setup. Passing the same ``hub`` list to several instances
+    links their ConnectionManagers as if they were separate workers.
+    """
+
+    def __init__(self, hub: Optional[List["InMemoryBroadcast"]] = None):
+        self.hub = hub if hub is not None else []
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self.hub.append(self)
+
+    async def publish(self, chat_id: str, message: dict):
+        for peer in self.hub:
+            if peer is not self and peer._deliver is not None:
+                peer._deliver(chat_id, message)
+
+    async def close(self):
+        if self in self.hub:
+            self.hub.remove(self)
+
+
+class UnixSocketBroadcast:
+    """Fan-out between uvicorn workers on one machine over a Unix socket
+
+    The first worker to take ``<path>.lock`` becomes the hub: it listens on
+    ``path`` and relays every frame it receives to all other workers. The
+    rest connect to it. If the hub exits, its lock is released and the
+    remaining workers race to replace it; messages published while there is
+    no hub are dropped. A worker that stops reading is disconnected once
+    ``max_buffer`` bytes are waiting for it.
+    """
+
+    def __init__(self, path: str, max_buffer: int = 8 * 1024 * 1024, retry_delay: float = 0.2):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.retry_delay = retry_delay
+        self._deliver: Optional[Deliver] = None
+        self._lock_file = None
+        self._server = None
+        self._peers = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def is_hub(self) -> bool:
+        return self._server is not None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self._task = asyncio.create_task(self._run())
+        # Give the first connection a moment so early messages aren't dropped
+        try:
+            await asyncio.wait_for(self._connected.wait(), 5.0)
+        except asyncio.TimeoutError:
+            print(f"Broadcast: no hub on {self.path} yet, retrying in the background")
+
+    def _try_lock(self) -> bool:
+        lock_file = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _run(self):
+        while not self._closing:
+            if self._try_lock():
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                self._server = await asyncio.start_unix_server(self._serve_peer, self.path, limit=MAX_FRAME_BYTES)
+                self._connected.set()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME_BYTES)
+            except OSError:
+                await asyncio.sleep(self.retry_delay)
+                continue
+            self._writer = writer
+            self._connected.set()
+            await self._read(reader)
+            self._writer = None
+            self._connected.clear()
+
+    async def _read(self, reader: asyncio.StreamReader, peer: Optional[asyncio.StreamWriter] = None):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if peer is not None:
+                    self._relay(line, exclude=peer)
+                frame = json.loads(line)
+                self._deliver(frame["chat_id"], frame["message"])
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            return
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            await self._read(reader, peer=writer)
+        except asyncio.CancelledError:
+            # Hub shutting down
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    def _relay(self, line: bytes, exclude=None):
+        for peer in list(self._peers):
+            if peer is exclude:
+                continue
+            if peer.transport.get_write_buffer_size() > self.max_buffer:
+                print("Broadcast: dropping a worker that stopped reading")
+                self._peers.discard(peer)
+                peer.close()
+                continue
+            peer.write(line)
+
+    async def publish(self, chat_id: str, message: dict):
+        line = (json.dumps({"chat_id": chat_id, "message": message}) + "\n").encode("utf-8")
+        if self.is_hub:
+            self._relay(line)
+        elif self._writer is not None:
+            self._writer.write(line)
+            await self._writer.drain()
+
+    async def close(self):
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+
+class RedisBroadcast:
+    """Fan-out across machines through a Redis pub/sub channel (needs the redis package)"""
+
+    def __init__(self, url: str, channel: str = "mdcat:chat"):
+        self.url = url
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._redis = None
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(self.url)
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._task = asyncio.create_task(self._listen(deliver))
+
+    async def _listen(self, deliver: Deliver):
+        async for item in self._pubsub.listen():
+            if item.get("type") != "message":
+                continue
+            frame = json.loads(item["data"])
+            if frame["origin"] != self.origin:
+                deliver(frame["chat_id"], frame["message"])
+
+    async def publish(self, chat_id: str, message: dict):
+        frame = {"origin": self.origin, "chat_id": chat_id, "message": message}
+        await self._redis.publish(self.channel, json.dumps(frame))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+        if self._redis is not None:
+            await self._redis.close()
+
+
+def broadcast_from_env(backend: str, socket_path: str = "", redis_url: str = ""):
+    """Build a backend for BROADCAST_BACKEND=memory|unix|redis"""
+    if backend == "unix":
+        return UnixSocketBroadcast(socket_path)
+    if backend == "redis":
+        return RedisBroadcast(redis_url)
+    return InMemoryBroadcast()
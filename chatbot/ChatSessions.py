@@ -0,0 +1,166 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+
+@dataclass
+class ChatSession:
+    """Recent turns of one chat plus a summary of the turns that fell out
+
+    ``turns`` is a ring buffer of {"sender", "content"} dicts. When it is
+    full, the oldest user message is folded into ``summary`` so follow-ups
+    still have some memory of where the conversation started. ``last_seq``
+    is the highest sequence number taken, including questions still in
+    ``pending`` (seq -> question) while their answers are generated;
+    ``answered_seq`` is the last one recorded.
+    """
+
+    chat_id: str
+    max_turns: int = 20
+    summary_chars: int = 600
+    turns: Deque[dict] = field(default_factory=deque)
+    summary: str = ""
+    last_seq: int = 0
+    answered_seq: int = 0
+    pending: Dict[int, str] = field(default_factory=dict)
+    last_active: float = field(default_factory=time.time)
+
+    def append(self, sender: str, content: str):
+        if len(self.turns) >= self.max_turns:
+            dropped = self.turns.popleft()
+            if dropped["sender"] == "user":
+                self.summary = f"{self.summary}; {dropped['content']}" if self.summary else dropped["content"]
+                # Keep the most recent part when the summary outgrows its budget
+                self.summary = self.summary[-self.summary_chars:]
+        self.turns.append({"sender": sender, "content": content})
+
+    def replace(self, chat_history: List[dict]):
+        """Reseed from a client-sent chatHistory"""
+        self.turns.clear()
+        self.summary = ""
+        for msg in chat_history:
+            if isinstance(msg, dict) and msg.get("content"):
+                self.append(str(msg.get("sender", "user")), str(msg["content"]))
+
+    def last_question(self) -> Optional[str]:
+        return next((t["content"] for t in reversed(self.turns) if t["sender"] == "user"), None)
+
+    def history(self) -> List[dict]:
+        """Turns in the client's chatHistory shape, led by the summary if any
+
+        ContextBudget.ContextBudgeter treats sender "summary" as prior summary.
+        """
+        prefix = [{"sender": "summary", "content": self.summary}] if self.summary else []
+        return prefix + list(self.turns)
+
+    def to_json(self) -> str:
+        return json.dumps({"turns": list(self.turns), "summary": self.summary, "last_seq": self.last_seq})
+
+    @classmethod
+    def from_json(cls, chat_id: str, data: str, max_turns: int = 20, summary_chars: int = 600) -> "ChatSession":
+        state = json.loads(data)
+        last_seq = state.get("last_seq", 0)
+        session = cls(chat_id, max_turns, summary_chars, summary=state.get("summary", ""), last_seq=last_seq, answered_seq=last_seq)
+        session.turns = deque(state.get("turns", [])[-max_turns:])
+        return session
+
+
+class ChatSessionStore:
+    """Per-chat_id sessions with idle eviction and optional SQLite persistence
+
+    Sessions live in an OrderedDict kept in last-used order, so eviction of
+    idle sessions (and of the least recently used ones beyond
+    ``max_sessions``) only ever looks at the front. With ``path`` set every
+    change is written through to SQLite, and a chat that was evicted or
+    survived a restart is reloaded on its next message.
+    """
+
+    def __init__(
+        self,
+        max_turns: int = 20,
+        idle_timeout: float = 1800.0,
+        max_sessions: int = 10000,
+        path: Optional[str] = None,
+    ):
+        self.max_turns = max_turns
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions (chat_id TEXT PRIMARY KEY, state TEXT, updated REAL)"
+            )
+            self._db.commit()
+
+    def _evict(self, now: float):
+        while self._sessions:
+            chat_id, session = next(iter(self._sessions.items()))
+            if now - session.last_active < self.idle_timeout and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[chat_id]
+
+    def get(self, chat_id: str) -> ChatSession:
+        """Session for chat_id, loaded from disk or created empty"""
+        now = time.time()
+        self._evict(now)
+        session = self._sessions.get(chat_id)
+        if session is None:
+            session = self._load(chat_id) or ChatSession(chat_id, self.max_turns)
+            self._sessions[chat_id] = session
+        self._sessions.move_to_end(chat_id)
+        session.last_active = now
+        return session
+
+    def _load(self, chat_id: str) -> Optional[ChatSession]:
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT state FROM chat_sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+        return ChatSession.from_json(chat_id, row[0], self.max_turns) if row else None
+
+    def save(self, session: ChatSession):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO chat_sessions (chat_id, state, updated) VALUES (?, ?, ?)",
+            (session.chat_id, session.to_json(), time.time()),
+        )
+        self._db.commit()
+
+    def reserve(self, session: ChatSession, seq: int, question: str):
+        """Take seq for a question before answering it, so a resend in the meantime is a duplicate"""
+        session.pending[seq] = question
+        session.last_seq = max(session.last_seq, seq)
+
+    def release(self, session: ChatSession, seq: int):
+        """Give back a reserved seq that won't be answered, so the client can send it again"""
+        session.pending.pop(seq, None)
+        if session.last_seq == seq:
+            session.last_seq = max([session.answered_seq, *session.pending])
+
+    def record(self, session: ChatSession, seq: int, question: str, answer: str):
+        """Add an answered question to the session"""
+        session.pending.pop(seq, None)
+        session.append("user", question)
+        session.append("bot", answer)
+        session.last_seq = max(session.last_seq, seq)
+        session.answered_seq = seq
+        self.save(session)
+
+    def revise(self, session: ChatSession, seq: int, answer: str) -> bool:
+        """Replace the answer recorded for seq, if it is still the latest turn"""
+        if seq != session.answered_seq or not session.turns or session.turns[-1]["sender"] != "bot":
+            return False
+        session.turns[-1] = {"sender": "bot", "content": answer}
+        self.save(session)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self._sessions)}
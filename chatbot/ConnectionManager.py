@@ -1,22 +1,113 @@
+import asyncio
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict
+from typing import Dict, Optional, Set
+from ChatSessions import ChatSession, ChatSessionStore
+from Broadcast import InMemoryBroadcast
+
+class Connection:
+    """One websocket with its own bounded outgoing queue and sender task"""
+
+    def __init__(self, websocket: WebSocket, chat_id: str, max_queue: int = 256):
+        self.websocket = websocket
+        self.chat_id = chat_id
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._send_loop())
+
+    async def _send_loop(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send_json(message)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Client went away; the receive loop sees the disconnect
+            self.closed = True
+
+    def offer(self, message: dict) -> bool:
+        """Queue a message without waiting; False if this client is too far behind"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    def __init__(self, sessions: Optional[ChatSessionStore] = None, broadcast=None, max_queue: int = 256):
+        # A chat can be open in several tabs or devices at once
+        self.active_connections: Dict[str, Set[Connection]] = {}
+        # Chat history is kept server-side so clients only send new questions
+        self.sessions = sessions or ChatSessionStore()
+        # Carries messages to sockets held by other workers (see Broadcast.py)
+        self.broadcast = broadcast or InMemoryBroadcast()
+        self.max_queue = max_queue
+        self.dropped_connections = 0
 
-    async def connect(self, websocket: WebSocket, chat_id: str):
+    async def start(self):
+        await self.broadcast.start(self._deliver)
+
+    async def close(self):
+        await self.broadcast.close()
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                await connection.close(code=1001)
+        self.active_connections.clear()
+
+    async def connect(self, websocket: WebSocket, chat_id: str) -> Connection:
         await websocket.accept()
-        self.active_connections[chat_id] = websocket
+        connection = Connection(websocket, chat_id, self.max_queue)
+        connection.start()
+        self.active_connections.setdefault(chat_id, set()).add(connection)
+        return connection
 
-    def disconnect(self, chat_id: str):
-        if chat_id in self.active_connections:
+    def disconnect(self, chat_id: str, connection: Optional[Connection] = None):
+        """Forget one connection of a chat, or all of them if none is given"""
+        connections = self.active_connections.get(chat_id)
+        if connections is None:
+            return
+        for conn in [connection] if connection is not None else list(connections):
+            connections.discard(conn)
+            conn.closed = True
+            if conn._task is not None:
+                conn._task.cancel()
+        if not connections:
             del self.active_connections[chat_id]
 
+    def session(self, chat_id: str) -> ChatSession:
+        return self.sessions.get(chat_id)
+
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+    def _deliver(self, chat_id: str, message: dict):
+        """Queue a message on every local socket of a chat without blocking"""
+        for connection in list(self.active_connections.get(chat_id, ())):
+            if not connection.offer(message):
+                # A client this far behind would hold everyone's messages in
+                # memory; close it (1013: try again later) and let it reconnect
+                print(f"Dropping slow connection for chat {chat_id}")
+                self.dropped_connections += 1
+                self.disconnect(chat_id, connection)
+                asyncio.create_task(connection.close(code=1013))
+
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         await websocket.send_json(message)
 
     async def send_message_to_chat(self, chat_id: str, message: dict):
-        if chat_id in self.active_connections:
-            websocket = self.active_connections[chat_id]
-            await self.send_personal_message(message, websocket)
+        self._deliver(chat_id, message)
+        await self.broadcast.publish(chat_id, message)
@@ -0,0 +1,196 @@
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+from QAChatbot import SearchResult
+
+_WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English)"""
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, on a word boundary where possible"""
+    max_chars = max(max_tokens, 0) * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[: cut if cut > 0 else max_chars].rstrip() + " ..."
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def dedupe_results(search_results: Sequence[SearchResult], overlap: float = 0.8) -> List[SearchResult]:
+    """Drop results repeating an earlier (higher ranked) one's id or most of its text
+
+    overlap is the fraction of a result's 5-word shingles already present
+    in a kept result, so chunks contained in another chunk are removed too.
+    """
+    kept, kept_shingles, seen_ids = [], [], set()
+    for result in search_results:
+        if result.id and result.id in seen_ids:
+            continue
+        shingles = _shingles(result.content)
+        if any(len(shingles & other) >= overlap * len(shingles) for other in kept_shingles):
+            continue
+        kept.append(result)
+        kept_shingles.append(shingles)
+        if result.id:
+            seen_ids.add(result.id)
+    return kept
+
+
+@dataclass
+class Turn:
+    sender: str
+    content: str
+
+
+class ContextBudgeter:
+    """Bounds the size of every QA prompt regardless of conversation length
+
+    The client sends the whole visible chat. Only the standalone question is
+    used for retrieval; the prompt gets the last ``max_turns`` turns
+    verbatim, a short rolling summary of the turns before them, and as many
+    deduplicated context chunks as fit in what is left of
+    ``max_prompt_tokens``. Each turn and the question itself are capped so
+    a single pasted wall of text can't take over the budget.
+    """
+
+    def __init__(
+        self,
+        max_prompt_tokens: int = 3000,
+        max_turns: int = 6,
+        max_turn_tokens: int = 200,
+        max_question_tokens: int = 500,
+        summary_tokens: int = 150,
+    ):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_turns = max_turns
+        self.max_turn_tokens = max_turn_tokens
+        self.max_question_tokens = max_question_tokens
+        self.summary_tokens = summary_tokens
+
+    @staticmethod
+    def parse_history(chat_history, question: Optional[str] = None) -> List[Turn]:
+        """Accept the client's [{"sender", "content"}, ...] list
+
+        A trailing copy of the current question is dropped so it isn't
+        repeated in the prompt. Entries with sender "summary" (from
+        ChatSessions) are left out; see prior_summary.
+        """
+        turns = [
+            Turn(sender=str(msg.get("sender", "user")), content=str(msg.get("content", "")).strip())
+            for msg in chat_history or []
+            if isinstance(msg, dict) and str(msg.get("content", "")).strip() and msg.get("sender") != "summary"
+        ]
+        if turns and question is not None and turns[-1].sender == "user" and turns[-1].content == question.strip():
+            turns.pop()
+        return turns
+
+    @staticmethod
+    def prior_summary(chat_history) -> str:
+        """Summary of turns the session store no longer keeps"""
+        return next(
+            (str(msg.get("content", "")) for msg in chat_history or [] if isinstance(msg, dict) and msg.get("sender") == "summary"),
+            "",
+        )
+
+    def retrieval_query(self, question: str, chat_history) -> str:
+        """Standalone question for embedding and search
+
+        Short follow-ups ("why?", "explain more") carry no topic of their
+        own, so they are prefixed with the previous user message.
+        """
+        turns = self.parse_history(chat_history, question)
+        question = truncate_to_tokens(question, self.max_question_tokens)
+        if len(_WORD.findall(question)) > 6:
+            return question
+        previous = next((t.content for t in reversed(turns) if t.sender == "user"), None)
+        if previous is None:
+            return question
+        return f"{truncate_to_tokens(previous, self.max_turn_tokens)}\n{question}"
+
+    def summarize(self, turns: List[Turn], prior: str = "") -> str:
+        """Rolling summary of older turns: their user questions, newest first, within summary_tokens
+
+        prior (already summarized earlier turns) fills whatever budget is left,
+        keeping its most recent end.
+        """
+        summary, used = [], 0
+        for turn in reversed(turns):
+            if turn.sender != "user":
+                continue
+            line = truncate_to_tokens(turn.content, 40)
+            cost = estimate_tokens(line) + 1
+            if used + cost > self.summary_tokens:
+                break
+            summary.append(line)
+            used += cost
+        remaining_chars = (self.summary_tokens - used) * 4
+        if prior and remaining_chars > 40:
+            summary.append(prior[-remaining_chars:])
+        if not summary:
+            return ""
+        return "Earlier the student asked about: " + "; ".join(reversed(summary))
+
+    def conversation(
+        self, question: str, turns: List[Turn], max_turns: Optional[int] = None, prior_summary: str = ""
+    ) -> str:
+        """Question block for the prompt: summary, recent turns, current message"""
+        max_turns = self.max_turns if max_turns is None else max_turns
+        recent = turns[-max_turns:] if max_turns else []
+        older = turns[: len(turns) - len(recent)]
+        lines = []
+        summary = self.summarize(older, prior_summary)
+        if summary:
+            lines.append(summary)
+        lines.extend(f"{t.sender}: {truncate_to_tokens(t.content, self.max_turn_tokens)}" for t in recent)
+        lines.append(f"Current User Message: {truncate_to_tokens(question, self.max_question_tokens)}")
+        return "\n".join(lines)
+
+    def fit_context(self, search_results: Sequence[SearchResult], budget: int) -> List[SearchResult]:
+        """Deduplicated results in rank order, the last one trimmed to fit budget tokens"""
+        fitted, used = [], 0
+        for result in dedupe_results(search_results):
+            remaining = budget - used
+            if remaining <= 0:
+                break
+            cost = estimate_tokens(result.content) + 1
+            if cost > remaining:
+                if remaining < 50:
+                    break
+                result = SearchResult(
+                    content=truncate_to_tokens(result.content, remaining - 1),
+                    metadata=result.metadata,
+                    score=result.score,
+                    id=result.id,
+                )
+                cost = remaining
+            fitted.append(result)
+            used += cost
+        return fitted
+
+    def build(self, prompt, question: str, chat_history, search_results: Sequence[SearchResult]) -> str:
+        """Format prompt (a PromptTemplate with context and question) within max_prompt_tokens"""
+        turns = self.parse_history(chat_history, question)
+        prior = self.prior_summary(chat_history)
+        fixed = estimate_tokens(prompt.format(context="", question=""))
+
+        # History gives way first: drop the oldest verbatim turns (they move
+        # into the summary) until the question block leaves room for context
+        max_turns = self.max_turns
+        question_block = self.conversation(question, turns, max_turns, prior)
+        while max_turns and fixed + estimate_tokens(question_block) > self.max_prompt_tokens // 2:
+            max_turns -= 1
+            question_block = self.conversation(question, turns, max_turns, prior)
+
+        budget = self.max_prompt_tokens - fixed - estimate_tokens(question_block)
+        context = self.fit_context(search_results, budget)
+        return prompt.format(context="\n\n".join(r.content for r in context), question=question_block)
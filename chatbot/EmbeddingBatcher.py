@@ -0,0 +1,130 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Tuple
+
+from Metrics import metrics
+
+
+def query_batch_function(embeddings) -> Callable[[List[str]], List[List[float]]]:
+    """A batch call that embeds texts the way embed_query would
+
+    Models like multilingual-e5 and bge embed queries and passages with
+    different parameters, which PineconeEmbeddings keeps in query_params
+    and document_params. Batching queries through embed_documents therefore
+    goes through a copy whose document_params are the query ones.
+    Embedders without that split (e.g. FakeEmbeddings) are used as they are.
+    """
+    if hasattr(embeddings, "query_params") and hasattr(embeddings, "model_copy"):
+        embeddings = embeddings.model_copy(update={"document_params": dict(embeddings.query_params)})
+    return embeddings.embed_documents
+
+
+class EmbeddingBatcher:
+    """Turns concurrent single-query embedding calls into batched calls
+
+    embed() runs on executor threads: it queues the text and blocks until
+    its vector is ready. Once one of ``concurrency`` workers is free, a
+    dispatcher thread takes the waiting texts and keeps collecting for up
+    to ``max_wait`` seconds or ``max_batch`` texts, then has that worker
+    make a single upstream call. At low load a query waits at most
+    ``max_wait`` extra; while every worker is busy, new queries pile up
+    into the next batch instead of queueing as separate calls. Duplicate
+    texts within a batch are embedded once. A caller gives up after
+    ``timeout`` seconds rather than holding its thread on a stuck batch.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        max_batch: int = 32,
+        max_wait: float = 0.005,
+        concurrency: int = 4,
+        timeout: float = 30.0,
+    ):
+        self.embed_batch = embed_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._pending: List[Tuple[str, Future]] = []
+        self._changed = threading.Condition()
+        self._closed = False
+        self._workers = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed-batch")
+        self._free_workers = threading.Semaphore(concurrency)
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="embed-batcher", daemon=True)
+        self._dispatcher.start()
+        self.batches = 0
+        self.texts = 0
+
+    def embed(self, text: str) -> List[float]:
+        future: Future = Future()
+        with self._changed:
+            if self._closed:
+                raise RuntimeError("EmbeddingBatcher is closed")
+            self._pending.append((text, future))
+            self._changed.notify()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._changed:
+                # Not sent yet; no one is waiting for it any more
+                self._pending = [(t, f) for t, f in self._pending if f is not future]
+            raise
+
+    def _next_batch(self) -> List[Tuple[str, Future]]:
+        with self._changed:
+            while not self._pending and not self._closed:
+                self._changed.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            self._pending = self._pending[self.max_batch:]
+            return batch
+
+    def _dispatch_loop(self):
+        while True:
+            self._free_workers.acquire()
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._workers.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[Tuple[str, Future]]):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            with metrics.time("stage", stage="embed_batch"):
+                vectors = self.embed_batch(texts)
+            if len(vectors) != len(texts):
+                # zip would silently leave some callers without a vector
+                raise ValueError(f"Embedded {len(texts)} texts but got {len(vectors)} vectors")
+            by_text: Dict[str, List[float]] = dict(zip(texts, vectors))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            self._free_workers.release()
+        self.batches += 1
+        self.texts += len(texts)
+        for text, future in batch:
+            future.set_result(by_text[text])
+
+    def close(self):
+        """Embed what is already queued, then stop"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self._dispatcher.join()
+        self._workers.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch": self.texts / self.batches if self.batches else 0.0,
+            "pending": len(self._pending),
+        }
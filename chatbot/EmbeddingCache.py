@@ -0,0 +1,107 @@
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:]+$")
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a question for cache keys.
+
+    Case, repeated whitespace and trailing punctuation don't change what is
+    being asked, so "What is osmosis?" and "what is  osmosis" share a key.
+    """
+    text = _WHITESPACE.sub(" ", text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+class EmbeddingCache:
+    """Query embedding cache with an in-memory LRU tier and optional SQLite tier
+
+    Keys combine the embedding model name with the normalized query text.
+    Vectors are kept as float32. Safe to use from executor threads.
+    """
+
+    def __init__(self, max_size: int = 10000, path: Optional[str] = None):
+        self.max_size = max_size
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model: str, query: str) -> str:
+        return hashlib.sha1(f"{model}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        key = self.make_key(model, query)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector.tolist()
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vector.tolist()
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, query: str, embedding: List[float]):
+        key = self.make_key(model, query)
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                    (key, model, vector.tobytes()),
+                )
+                self._db.commit()
+
+    def get_or_compute(self, model: str, query: str, compute: Callable[[str], List[float]]) -> List[float]:
+        """Return the cached embedding, calling compute(query) only on a miss"""
+        embedding = self.get(model, query)
+        if embedding is None:
+            embedding = compute(query)
+            self.put(model, query, embedding)
+        return embedding
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._memory),
+            }
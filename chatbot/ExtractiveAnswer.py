@@ -0,0 +1,79 @@
+import math
+import re
+from typing import Callable, List, Optional, Sequence
+
+from LexicalIndex import tokenize
+
+# Shown above the extracted sentences so students know it isn't the full answer
+EXTRACTIVE_PREFIX = "The full answer isn't available right now. Here is what the study material says:"
+SLOW_ANSWER = "Sorry, I can't answer that right now. Please try again in a moment."
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\"'])|\n\s*\n|\n\s*(?=[-*•]|\d+[.)]\s)")
+_SPACES = re.compile(r"\s+")
+_MARKUP = re.compile(r"\*\*|__|^#+\s*|^\d+[.)]\s+")
+# MCQ chunks ("Question: ... A) ... B) ...") are matched but read poorly as an answer
+_MCQ = re.compile(r"\bA\)\s.*\bB\)\s")
+MCQ_WEIGHT = 0.5
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split chunk text into sentences, also breaking at blank lines and list items"""
+    sentences = (_MARKUP.sub("", _SPACES.sub(" ", part).strip(" -*•")) for part in _SENTENCE_END.split(text))
+    return [sentence.strip() for sentence in sentences if sentence.strip()]
+
+
+def extractive_answer(
+    question: str,
+    search_results: Sequence,
+    document_frequency: Optional[Callable[[str], int]] = None,
+    max_sentences: int = 3,
+    max_chars: int = 700,
+    min_words: int = 4,
+) -> Optional[str]:
+    """The retrieved sentences that best match the question, or None if none do
+
+    ``search_results`` are QAChatbot.SearchResult-like objects in rank
+    order. A sentence scores the summed weight of the question terms it
+    contains, 1 / log(2 + document frequency) with a frequency lookup and 1
+    without, so rare terms ("ribosome") count for more than common ones
+    ("cell"); sentences from lower-ranked chunks and MCQ text are
+    discounted. The chosen
+    sentences are put back in chunk and reading order.
+    """
+    terms = set(tokenize(question))
+    if not terms:
+        return None
+    weights = {
+        term: 1.0 / math.log(2 + document_frequency(term)) if document_frequency else 1.0
+        for term in terms
+    }
+
+    candidates = []
+    for rank, result in enumerate(search_results):
+        for position, sentence in enumerate(split_sentences(result.content)):
+            # Headings ("Covalent Bond:") and fragments say too little on their own
+            if len(sentence.split()) < min_words or sentence.endswith(":"):
+                continue
+            matched = terms.intersection(tokenize(sentence))
+            if matched:
+                score = sum(weights[term] for term in matched) / (1.0 + 0.25 * rank)
+                if _MCQ.search(sentence):
+                    score *= MCQ_WEIGHT
+                candidates.append((score, rank, position, sentence))
+    if not candidates:
+        return None
+
+    chosen, seen, length = [], set(), 0
+    for score, rank, position, sentence in sorted(candidates, key=lambda c: (-c[0], c[1], c[2])):
+        if sentence.lower() in seen or (chosen and length + len(sentence) > max_chars):
+            continue
+        if len(sentence) > max_chars:
+            # Text extracted without punctuation can run on for a whole chunk
+            cut = sentence.rfind(" ", 0, max_chars)
+            sentence = sentence[:cut if cut > 0 else max_chars] + " ..."
+        chosen.append((rank, position, sentence))
+        seen.add(sentence.lower())
+        length += len(sentence)
+        if len(chosen) >= max_sentences:
+            break
+    return "\n\n".join([EXTRACTIVE_PREFIX] + [f"- {sentence}" for _, _, sentence in sorted(chosen)])
@@ -0,0 +1,78 @@
+import hashlib
+import time
+from typing import List
+
+import numpy as np
+
+# Local stand-ins for PineconeEmbeddings, a Pinecone index and the LLM so the
+# chat pipeline can be load tested without network access or API keys. Each
+# one sleeps for a configurable latency to mimic the real service.
+
+
+class FakeEmbeddings:
+    """Deterministic pseudo-random unit vectors derived from the text hash"""
+
+    def __init__(self, dimension: int = 1024, latency: float = 0.05):
+        self.dimension = dimension
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+
+class FakeIndex:
+    """Returns the same canned passages for every query, Pinecone response shaped"""
+
+    def __init__(self, latency: float = 0.03, passages: List[str] = None):
+        self.latency = latency
+        self.passages = passages or [
+            "Osmosis is the movement of water across a semi-permeable membrane "
+            "from a region of lower solute concentration to higher solute concentration.",
+            "Mitosis is cell division that produces two genetically identical daughter cells.",
+            "Newton's second law states that force equals mass times acceleration.",
+            "An ionic bond forms by the transfer of electrons from a metal to a non-metal.",
+        ]
+
+    def query(self, vector, top_k: int = 4, include_metadata: bool = True, **kwargs):
+        time.sleep(self.latency)
+        return {
+            "matches": [
+                {
+                    "id": f"fake-{i}",
+                    "score": 1.0 - i * 0.1,
+                    "metadata": {"text": text, "source": "fake"},
+                }
+                for i, text in enumerate(self.passages[:top_k])
+            ]
+        }
+
+
+class FakeLLM:
+    """Returns a fixed answer after a fixed delay"""
+
+    def __init__(self, latency: float = 0.5, answer: str = None):
+        self.latency = latency
+        self.answer = answer or (
+            "This is a placeholder answer from the fake LLM used for load testing."
+        )
+
+    def invoke(self, prompt, **kwargs) -> str:
+        time.sleep(self.latency)
+        return self.answer
+
+    def stream(self, prompt, **kwargs):
+        """Yield the answer word by word, spreading the latency across tokens"""
+        words = self.answer.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.latency / len(words))
+            yield word if i == 0 else " " + word
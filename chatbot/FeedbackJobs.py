@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from LLMScheduler import LLMBusy
+from Metrics import metrics
+
+# Ids and bookkeeping that differ between two attempts at the same quiz
+VOLATILE_FIELDS = {"_id", "__v", "id", "userId", "createdAt", "updatedAt", "feedBack", "Score"}
+
+
+def _strip_volatile(value):
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+
+def quiz_content(body) -> list:
+    """The (question, options, correct answer, user answer) tuples of a quiz payload
+
+    The Node backend posts ``{"modified": quiz}`` with each question
+    populated; anything else is used whole, minus ids and timestamps.
+    """
+    quiz = body.get("modified", body) if isinstance(body, dict) else body
+    questions = quiz.get("questions") if isinstance(quiz, dict) else None
+    if not isinstance(questions, list):
+        return _strip_volatile(quiz)
+    content = []
+    for entry in questions:
+        question = entry.get("question") if isinstance(entry, dict) else entry
+        if isinstance(question, dict):
+            content.append([
+                question.get("question"),
+                question.get("options"),
+                question.get("correctOption"),
+                entry.get("userAnswer"),
+            ])
+        else:
+            content.append(_strip_volatile(entry))
+    return content
+
+
+def feedback_user(body) -> Optional[str]:
+    """The quiz owner, for per-user rate limits"""
+    quiz = body.get("modified", body) if isinstance(body, dict) else None
+    user = quiz.get("userId") if isinstance(quiz, dict) else None
+    return str(user) if user else None
+
+
+def feedback_key(body) -> str:
+    payload = json.dumps(quiz_content(body), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class FeedbackQueueFull(Exception):
+    """Raised when too many feedback jobs are waiting to start"""
+
+
+@dataclass
+class FeedbackJob:
+    id: str
+    key: str
+    prompt: str
+    user: Optional[str] = None
+    status: str = "queued"  # queued -> running -> done | failed
+    feedback: Optional[str] = None
+    error: Optional[str] = None
+    # Set when the job failed because the LLM scheduler was busy
+    retry_after: Optional[int] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def finish(self, feedback: Optional[str] = None, error: Optional[str] = None):
+        self.status = "failed" if error else "done"
+        self.feedback = feedback
+        self.error = error
+        self.finished = time.time()
+        self.done.set()
+
+    def to_dict(self) -> dict:
+        result = {"jobId": self.id, "status": self.status}
+        if self.status == "done":
+            result["feedback"] = self.feedback
+        elif self.status == "failed":
+            result["error"] = self.error
+            if self.retry_after is not None:
+                result["retryAfter"] = self.retry_after
+        return result
+
+
+class FeedbackJobs:
+    """Quiz feedback generated in the background, deduplicated by quiz content
+
+    submit() returns at once: a finished job for a quiz seen before, the
+    in-flight job when the same quiz is already being generated, or a new
+    queued job. ``workers`` tasks take jobs off a bounded queue and run the
+    blocking LLM call on their own threads, so feedback never competes with
+    chat answers for QAChatbot's executor. When the LLM has a
+    ``batch(prompts)`` method (LangChain runnables do) up to ``batch_size``
+    queued jobs go out in one call. Failed jobs are forgotten so the next
+    submit retries; finished ones are kept for ``ttl`` seconds, up to
+    ``max_jobs``.
+
+    With an LLMScheduler, new quizzes are admitted against the quiz
+    owner's "feedback" bucket (submit raises LLMBusy) and every prompt
+    holds a "feedback" slot: a batch only grows to as many prompts as
+    there are free slots.
+    """
+
+    def __init__(
+        self,
+        llm,
+        prompt: str,
+        workers: int = 4,
+        max_queue: int = 500,
+        timeout: float = 60.0,
+        batch_size: int = 8,
+        max_jobs: int = 5000,
+        ttl: float = 86400.0,
+        scheduler=None,
+    ):
+        self.llm = llm
+        self.prompt = prompt
+        self.workers = workers
+        self.timeout = timeout
+        self.batch_size = batch_size if hasattr(llm, "batch") else 1
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.scheduler = scheduler
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._jobs: "OrderedDict[str, FeedbackJob]" = OrderedDict()
+        self._by_key: Dict[str, FeedbackJob] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="feedback")
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _evict(self, now: float):
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job.finished is None:
+                break
+            if now - job.finished < self.ttl and len(self._jobs) <= self.max_jobs:
+                break
+            self._forget(job)
+
+    def _forget(self, job: FeedbackJob):
+        self._jobs.pop(job.id, None)
+        if self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def submit(self, body) -> FeedbackJob:
+        self._evict(time.time())
+        key = feedback_key(body)
+        job = self._by_key.get(key)
+        if job is not None:
+            self.hits += 1
+            return job
+        if self.queue.full():
+            raise FeedbackQueueFull(f"{self.queue.qsize()} feedback jobs already waiting")
+        user = feedback_user(body)
+        if self.scheduler is not None:
+            self.scheduler.admit(user, "feedback")
+        self.misses += 1
+        job = FeedbackJob(id=uuid.uuid4().hex, key=key, prompt=self.prompt.format(body=body), user=user)
+        self._jobs[job.id] = job
+        self._by_key[key] = job
+        self.queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[FeedbackJob]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: FeedbackJob, timeout: float) -> FeedbackJob:
+        """Give a job up to timeout seconds to finish; returns it either way"""
+        if timeout > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def _generate(self, prompts: List[str]) -> List[str]:
+        with metrics.time("stage", stage="feedback"):
+            if len(prompts) == 1:
+                return [self.llm.invoke(prompts[0])]
+            return list(self.llm.batch(prompts))
+
+    async def _run(self, batch: List[FeedbackJob]) -> List[str]:
+        for job in batch:
+            job.status = "running"
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._generate, [job.prompt for job in batch])
+        return await asyncio.wait_for(future, self.timeout)
+
+    def _fill(self, batch: List[FeedbackJob], size: int):
+        """Add queued jobs to the batch, up to size"""
+        while len(batch) < size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+
+    async def _work(self):
+        while True:
+            batch = [await self.queue.get()]
+            try:
+                if self.scheduler is None:
+                    self._fill(batch, self.batch_size)
+                    answers = await self._run(batch)
+                else:
+                    async with self.scheduler.slots("feedback", batch[0].user, self.batch_size) as slots:
+                        self._fill(batch, slots)
+                        answers = await self._run(batch)
+            except LLMBusy as e:
+                self._fail(batch, str(e), e.retry_after)
+                continue
+            except asyncio.TimeoutError:
+                metrics.inc("timeouts", {"stage": "feedback"})
+                # The thread finishes in the background; its result is dropped
+                self._fail(batch, f"feedback timed out after {self.timeout:.1f}s")
+                continue
+            except Exception as e:
+                metrics.inc("errors", {"where": "feedback"})
+                self._fail(batch, f"Error generating feedback: {e}")
+                continue
+
+            for job, answer in zip(batch, answers):
+                job.finish(feedback=getattr(answer, "content", answer))
+
+    def _fail(self, batch: List[FeedbackJob], error: str, retry_after: Optional[int] = None):
+        for job in batch:
+            job.retry_after = retry_after
+            job.finish(error=error)
+            # Keep the job pollable by id, but let the next submit retry
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+
+    def stats(self) -> Dict[str, int]:
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {**counts, "queue": self.queue.qsize(), "hits": self.hits, "misses": self.misses}
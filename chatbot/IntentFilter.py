@@ -0,0 +1,172 @@
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from corpus import DEFAULT_CORPUS_DIR, iter_index_chunks
+from LexicalIndex import tokenize
+
+# Whole-message patterns, matched after lowercasing and trimming punctuation
+PATTERNS = {
+    "greeting": re.compile(
+        r"^(hi+|hello+|hey+|hiya|yo|salam|sala?am|as+alam+[ ou]*alaikum|aoa|good (morning|afternoon|evening))"
+        r"( there| bot| sir| maam| madam)?$"
+    ),
+    "thanks": re.compile(
+        # A bare "ok" or "great" is often a follow-up to the last answer, not thanks
+        r"^((ok(ay)?|great|nice|cool|got it)[ ,]*)?(thanks|thank (you|u)|thx|ty|jazakallah( khair)?)( so much| a lot)?$"
+    ),
+    "goodbye": re.compile(r"^(bye+|goodbye|good ?night|see (you|ya)( later)?|take care|allah hafiz|khuda hafiz)$"),
+    "identity": re.compile(
+        r"^(who|what) (are|r) (you|u)|^what is your name$|^what can (you|u) do|^how can (you|u) help|^help$"
+    ),
+}
+
+CANNED_RESPONSES = {
+    "greeting": "Hello! I'm your MDCAT study assistant. Ask me anything about biology, chemistry, "
+                "physics, English or logical reasoning.",
+    "thanks": "You're welcome! Let me know if you have another MDCAT question.",
+    "goodbye": "Good luck with your preparation! Come back any time you have a question.",
+    "identity": "I'm an MDCAT study assistant. I answer questions on biology, chemistry, physics, "
+                "English and logical reasoning using the MDCAT syllabus.",
+    "unclear": "Please rephrase your question. Try asking about a specific MDCAT topic.",
+    "off_topic": "Are you sure it is related to academic subjects? I can only help with the MDCAT "
+                 "syllabus, so please check the spelling or rephrase your question.",
+}
+
+# Words that carry no topic on their own, on top of LexicalIndex.STOPWORDS
+FILLER_WORDS = frozenset(
+    "i me my we us our you your he she his her they them their am been being do does did can could "
+    "would will shall should may might must please tell give make get want need know help like just "
+    "also more much many very some any about under over into out up down now then than there here "
+    "so if not no yes ok okay all one when where whom whose because but only same other such each "
+    "both explain define describe list".split()
+)
+
+# Task words that make a message academic whatever else it contains; English
+# vocabulary questions can be about any word ("antonym of brave")
+ACADEMIC_CUES = frozenset(
+    "synonym synonyms antonym antonyms meaning opposite plural tense grammar sentence sentences idiom "
+    "spelling spell word words verb noun adjective adverb preposition pronoun punctuation analogy "
+    "calculate formula equation unit mcq mcqs mdcat syllabus".split()
+)
+
+
+def number_variants(term: str) -> Tuple[str, ...]:
+    """The term with its likely singular and plural forms
+
+    The corpus may only use one of them ("antibodies" but not "antibody",
+    "nephrons" but not "nephron"). Wrong guesses ("mitosi") just aren't found.
+    """
+    variants = [term, term + "s", term + "es"]
+    if term.endswith("y"):
+        variants.append(term[:-1] + "ies")
+    if term.endswith("ies"):
+        variants.append(term[:-3] + "y")
+    if term.endswith("es"):
+        variants.append(term[:-2])
+    if term.endswith("s"):
+        variants.append(term[:-1])
+    return tuple(variants)
+
+
+_EDGE_PUNCTUATION = re.compile(r"^[\s\W_]+|[\s\W_]+$")
+_SPACES = re.compile(r"\s+")
+
+
+@dataclass
+class Intent:
+    """Result of IntentFilter.classify
+
+    ``label`` is "academic" or a CANNED_RESPONSES key. ``confidence`` is
+    how sure the filter is that the message needs no retrieval.
+    """
+
+    label: str
+    confidence: float
+
+    @property
+    def response(self) -> Optional[str]:
+        return CANNED_RESPONSES.get(self.label)
+
+
+class IntentFilter:
+    """Answers small talk and clearly off-topic messages without retrieval or the LLM
+
+    Two checks, both in microseconds: whole-message patterns for
+    greetings, thanks, goodbyes and "who are you", and curriculum
+    coverage. A message is off topic only when none of its content words
+    appears in any curriculum or MCQ chunk, in singular or plural form.
+    Conservative by design: one syllabus term anywhere in the message
+    sends it to the LLM, however rare ("nephron", "alkyne").
+
+    Messages are only short-circuited when confidence reaches
+    ``threshold``. In ``shadow`` mode nothing is short-circuited but every
+    decision is still counted, to measure how often the filter would fire.
+    """
+
+    def __init__(
+        self,
+        document_frequency: Callable[[str], int],
+        threshold: float = 0.7,
+        shadow: bool = False,
+    ):
+        self.document_frequency = document_frequency
+        self.threshold = threshold
+        self.shadow = shadow
+        self.counts: Counter = Counter()
+
+    @classmethod
+    def from_lexical_index(cls, index, **kwargs) -> "IntentFilter":
+        return cls(index.document_frequency, **kwargs)
+
+    @classmethod
+    def from_corpus(cls, corpus_dir: str = DEFAULT_CORPUS_DIR, **kwargs) -> "IntentFilter":
+        """Count document frequencies over the lexical index's chunks, for when none is loaded"""
+        frequencies: Counter = Counter()
+        for chunk in iter_index_chunks(corpus_dir):
+            frequencies.update(set(tokenize(chunk["text"])))
+        return cls(lambda term: frequencies.get(term, 0), **kwargs)
+
+    def classify(self, message: str, context: Optional[str] = None) -> Intent:
+        """Label a message; ``context`` is what retrieval would search for (see QAChatbot.retrieval_query)
+
+        Follow-ups in a conversation ("why?", "and in plants?") are
+        checked with the context, so they count as on topic when the
+        conversation is.
+        """
+        text = _SPACES.sub(" ", _EDGE_PUNCTUATION.sub("", message.lower()))
+        for label, pattern in PATTERNS.items():
+            if text and pattern.search(text):
+                return Intent(label, 1.0)
+        if not text:
+            return Intent("unclear", 0.0 if context else 1.0)
+
+        terms = [t for t in tokenize(context or message) if t not in FILLER_WORDS]
+        if not terms:
+            # "can you help me", "ok so", ... ; in a conversation the LLM knows what is meant
+            return Intent("unclear", 0.0 if context else 0.8)
+
+        if any(term in ACADEMIC_CUES for term in terms):
+            return Intent("academic", 0.0)
+        if any(self.document_frequency(variant) for term in terms for variant in number_variants(term)):
+            return Intent("academic", 0.0)
+        return Intent("off_topic", 1.0)
+
+    def route(self, message: str, context: Optional[str] = None) -> Optional[str]:
+        """Canned reply for the message, or None to answer it normally"""
+        intent = self.classify(message, context)
+        if intent.label == "academic":
+            self.counts["academic"] += 1
+            return None
+        if intent.confidence < self.threshold:
+            self.counts["below_threshold"] += 1
+            return None
+        self.counts[intent.label] += 1
+        if self.shadow:
+            self.counts["shadowed"] += 1
+            return None
+        return intent.response
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counts)
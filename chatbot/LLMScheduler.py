@@ -0,0 +1,230 @@
+import asyncio
+import math
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+from Metrics import metrics
+
+
+class LLMBusy(Exception):
+    """Raised when the scheduler refuses or gives up on an LLM call
+
+    ``reason`` is "rate_limited" (the user's token bucket is empty),
+    "queue_full" or "timeout" (waited max_wait for a slot).
+    ``retry_after`` is a hint in seconds.
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"LLM busy ({reason}), retry after {self.retry_after}s")
+
+    @property
+    def message(self) -> str:
+        if self.reason == "rate_limited":
+            return f"You're sending requests very quickly. Please wait {self.retry_after} seconds and try again."
+        return f"Lots of students are studying right now. Please try again in {self.retry_after} seconds."
+
+
+@dataclass
+class PriorityClass:
+    """How one kind of LLM work is scheduled
+
+    Lower ``priority`` is served first. At most ``share`` of the slots run
+    this class at once, so long background calls can't fill every slot
+    while chat questions arrive. Beyond ``max_queue`` waiting calls new
+    ones are refused, and a call that waits ``max_wait`` seconds for a
+    slot gives up. Each user gets a bucket of ``burst`` calls refilled at
+    ``rate`` per second (0 disables the limit); who counts as a user is up
+    to the caller, e.g. a chat id for chat answers.
+    """
+
+    priority: int
+    share: float = 1.0
+    max_queue: int = 100
+    max_wait: float = 30.0
+    rate: float = 0.0
+    burst: int = 10
+
+
+DEFAULT_CLASSES = {
+    "chat": PriorityClass(priority=0, share=1.0, max_queue=200, max_wait=20.0, rate=0.2, burst=10),
+    "feedback": PriorityClass(priority=1, share=0.5, max_queue=50, max_wait=120.0, rate=0.05, burst=5),
+}
+
+
+@dataclass
+class TokenBucket:
+    tokens: float
+    updated: float
+
+    def take(self, now: float, rate: float, burst: int) -> float:
+        """Take a token; returns 0, or the seconds until one is available"""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class LLMScheduler:
+    """Admission control and a shared concurrency cap for every LLM call
+
+    Callers first admit() a request, which charges the user's token bucket
+    and sheds load when the class queue is full, then hold a slot() for
+    the duration of the call. Slots are handed out strictly by class
+    priority and round-robin between users within a class, so one user's
+    burst queues behind everyone else's next question rather than ahead
+    of it. Runs on the event loop; slot() must be used from coroutines.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 8,
+        classes: Optional[Dict[str, PriorityClass]] = None,
+        max_users: int = 100000,
+    ):
+        self.concurrency = concurrency
+        self.classes = {**DEFAULT_CLASSES, **(classes or {})}
+        self.max_users = max_users
+        self._order = sorted(self.classes, key=lambda name: self.classes[name].priority)
+        self._limits = {
+            name: max(1, int(concurrency * cls.share)) for name, cls in self.classes.items()
+        }
+        self.active: Counter = Counter()
+        self.queued: Counter = Counter()
+        # Per class, users with waiting calls in round-robin order
+        self._waiting: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            name: OrderedDict() for name in self.classes
+        }
+        self._buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        # Moving average of call duration, for retry hints
+        self._call_seconds = 2.0
+        self.rejected: Counter = Counter()
+
+    def _reject(self, name: str, reason: str, retry_after: float):
+        self.rejected[(name, reason)] += 1
+        metrics.inc("llm_rejections", {"class": name, "reason": reason})
+        raise LLMBusy(reason, retry_after)
+
+    def retry_hint(self, name: str) -> float:
+        """Rough seconds until a call queued now would start"""
+        ahead = sum(self.queued[other] for other in self._order[:self._order.index(name) + 1])
+        return self._call_seconds * (ahead + 1) / self._limits[name]
+
+    def admit(self, user: Optional[str], name: str):
+        """Charge one call to the user's bucket; raises LLMBusy instead of queueing hopeless work"""
+        cls = self.classes[name]
+        if self.queued[name] >= cls.max_queue:
+            self._reject(name, "queue_full", self.retry_hint(name))
+        if user is None or not cls.rate:
+            return
+        now = time.monotonic()
+        key = (name, user)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(tokens=cls.burst, updated=now)
+            # Forgetting the least recently seen user only refills their bucket early
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        wait = bucket.take(now, cls.rate, cls.burst)
+        if wait:
+            self._reject(name, "rate_limited", wait)
+
+    def _has_room(self, name: str) -> bool:
+        return sum(self.active.values()) < self.concurrency and self.active[name] < self._limits[name]
+
+    def _grant(self):
+        """Hand free slots to the highest-priority waiters"""
+        for name in self._order:
+            waiting = self._waiting[name]
+            while waiting and self._has_room(name):
+                user, futures = next(iter(waiting.items()))
+                future = futures.popleft()
+                if futures:
+                    waiting.move_to_end(user)
+                else:
+                    del waiting[user]
+                self.queued[name] -= 1
+                self.active[name] += 1
+                future.set_result(None)
+
+    def _withdraw(self, name: str, user: str, future: asyncio.Future):
+        futures = self._waiting[name].get(user)
+        if futures is not None and future in futures:
+            futures.remove(future)
+            if not futures:
+                del self._waiting[name][user]
+            self.queued[name] -= 1
+
+    async def _acquire(self, name: str, user: Optional[str]):
+        cls = self.classes[name]
+        # Waiters left over while there is room are held back by their class share
+        if self._has_room(name) and not self._waiting[name]:
+            self.active[name] += 1
+            metrics.observe("llm_wait", 0.0, {"class": name})
+            return
+        if self.queued[name] >= cls.max_queue:
+            self._reject(name, "queue_full", self.retry_hint(name))
+
+        future = asyncio.get_running_loop().create_future()
+        key = user or ""
+        self._waiting[name].setdefault(key, deque()).append(future)
+        self.queued[name] += 1
+        queued = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, cls.max_wait)
+        except asyncio.TimeoutError:
+            self._withdraw(name, key, future)
+            self._reject(name, "timeout", self.retry_hint(name))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller went away; pass the slot on
+                self._release(name)
+            else:
+                self._withdraw(name, key, future)
+            raise
+        finally:
+            metrics.observe("llm_wait", time.perf_counter() - queued, {"class": name})
+
+    def _release(self, name: str):
+        self.active[name] -= 1
+        self._grant()
+
+    @asynccontextmanager
+    async def slot(self, name: str, user: Optional[str] = None):
+        """Hold one of the concurrency slots for an LLM call of class ``name``"""
+        async with self.slots(name, user):
+            yield
+
+    @asynccontextmanager
+    async def slots(self, name: str, user: Optional[str] = None, count: int = 1):
+        """Wait for one slot, then also take up to count - 1 that are free right now; yields how many are held
+
+        For batched calls, which run one prompt per slot. Only the first
+        slot is waited for, so batches never hold some slots while
+        waiting for more.
+        """
+        await self._acquire(name, user)
+        held = 1
+        while held < count and self._has_room(name) and not self._waiting[name]:
+            self.active[name] += 1
+            held += 1
+        started = time.perf_counter()
+        try:
+            yield held
+        finally:
+            self._call_seconds = 0.9 * self._call_seconds + 0.1 * (time.perf_counter() - started)
+            self.active[name] -= held - 1
+            self._release(name)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"active": self.active[name], "queued": self.queued[name], "limit": self._limits[name]}
+            for name in self._order
+        }
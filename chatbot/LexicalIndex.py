@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import re
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from corpus import DEFAULT_CORPUS_DIR, iter_index_chunks
+from LocalVectorStore import subject_mask
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were what which who why how with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric terms, without stopwords and single characters"""
+    return [t for t in _TOKEN.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+class LexicalIndex:
+    """In-process BM25 index with a Pinecone-compatible query()
+
+    Postings are stored compressed-sparse-row style: for term t, documents
+    ``doc_ids[offsets[t]:offsets[t + 1]]`` with matching term frequencies
+    ``tfs``. That keeps the whole curriculum in a few flat numpy arrays
+    saved to ``lexical.npz``, with the vocabulary and chunk texts in
+    ``lexical.json``. Exact terms like enzyme names that dense embeddings
+    blur together score highly here.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadata: List[dict] = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.uint16)
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+        self._subjects = np.array([], dtype=object)
+        self._idf = np.zeros(0, dtype=np.float32)
+        self._length_norm = np.zeros(0, dtype=np.float32)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Dict], k1: float = 1.2, b: float = 0.75) -> "LexicalIndex":
+        """Build from {"id", "text", "metadata"} chunks as yielded by corpus.iter_chunks"""
+        index = cls(k1, b)
+        postings: Dict[str, List[tuple]] = {}
+        lengths = []
+        for doc, chunk in enumerate(chunks):
+            index.ids.append(chunk["id"])
+            index.texts.append(chunk["text"])
+            index.metadata.append(chunk["metadata"])
+            terms = tokenize(chunk["text"])
+            lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                postings.setdefault(term, []).append((doc, count))
+
+        terms = sorted(postings)
+        index.vocab = {term: i for i, term in enumerate(terms)}
+        index.offsets = np.cumsum([0] + [len(postings[t]) for t in terms]).astype(np.int64)
+        flat = list(chain.from_iterable(postings[t] for t in terms))
+        index.doc_ids = np.array([doc for doc, _ in flat], dtype=np.int32)
+        index.tfs = np.minimum([count for _, count in flat], np.iinfo(np.uint16).max).astype(np.uint16)
+        index.doc_lengths = np.array(lengths, dtype=np.int32)
+        index._prepare()
+        return index
+
+    def _prepare(self):
+        n_docs = len(self.ids)
+        doc_freq = np.diff(self.offsets)
+        self._idf = np.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        avg_length = self.doc_lengths.mean() if n_docs else 1.0
+        self._length_norm = (self.k1 * (1 - self.b + self.b * self.doc_lengths / max(avg_length, 1e-9))).astype(np.float32)
+        self._subjects = np.array([m.get("subject") for m in self.metadata], dtype=object)
+
+    @staticmethod
+    def _paths(index_dir: str):
+        return os.path.join(index_dir, "lexical.npz"), os.path.join(index_dir, "lexical.json")
+
+    @classmethod
+    def exists(cls, index_dir: str) -> bool:
+        return all(os.path.exists(path) for path in cls._paths(index_dir))
+
+    def save(self, index_dir: str):
+        os.makedirs(index_dir, exist_ok=True)
+        arrays_path, docs_path = self._paths(index_dir)
+        np.savez(arrays_path, offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs, doc_lengths=self.doc_lengths)
+        with open(docs_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "vocab": sorted(self.vocab, key=self.vocab.get),
+                "ids": self.ids,
+                "texts": self.texts,
+                "metadata": self.metadata,
+            }, f)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "LexicalIndex":
+        arrays_path, docs_path = cls._paths(index_dir)
+        with open(docs_path, encoding="utf-8") as f:
+            docs = json.load(f)
+        index = cls(docs["k1"], docs["b"])
+        index.vocab = {term: i for i, term in enumerate(docs["vocab"])}
+        index.ids, index.texts, index.metadata = docs["ids"], docs["texts"], docs["metadata"]
+        arrays = np.load(arrays_path)
+        index.offsets = arrays["offsets"]
+        index.doc_ids = arrays["doc_ids"]
+        index.tfs = arrays["tfs"]
+        index.doc_lengths = arrays["doc_lengths"]
+        index._prepare()
+        return index
+
+    def document_frequency(self, term: str) -> int:
+        """Number of chunks containing a term (already tokenized)"""
+        t = self.vocab.get(term)
+        return 0 if t is None else int(self.offsets[t + 1] - self.offsets[t])
+
+    def scores(self, text: str) -> np.ndarray:
+        """BM25 score of every document for a query"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(text)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            scores[docs] += self._idf[t] * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+        return scores
+
+    def query(self, text: str, top_k: int = 4, include_metadata: bool = True, filter: Optional[dict] = None, **kwargs):
+        if not self.ids:
+            return {"matches": []}
+        scores = self.scores(text)
+        mask = subject_mask(self._subjects, filter)
+        if mask is not None:
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores > 0)
+        k = min(top_k, len(candidates))
+        if k == 0:
+            return {"matches": []}
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+
+        matches = []
+        for position in top:
+            match = {"id": self.ids[position], "score": float(scores[position])}
+            if include_metadata:
+                match["metadata"] = {**self.metadata[position], "text": self.texts[position]}
+            matches.append(match)
+        return {"matches": matches}
+
+
+def build_from_corpus(index_dir: Optional[str] = None, corpus_dir: str = DEFAULT_CORPUS_DIR, mcqs: bool = True) -> LexicalIndex:
+    """Index the curriculum (and MCQ banks) with the same chunk ids as the vector store"""
+    index = LexicalIndex.from_chunks(iter_index_chunks(corpus_dir, mcqs))
+    if index_dir:
+        index.save(index_dir)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the BM25 index from *_content_data.json and *_mcqs_data.json")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--out", default="local_index")
+    parser.add_argument("--no-mcqs", action="store_true", help="Skip *_mcqs_data.json")
+    args = parser.parse_args()
+
+    index = build_from_corpus(args.out, args.corpus, mcqs=not args.no_mcqs)
+    print(f"Indexed {len(index.ids)} chunks, {len(index.vocab)} terms into {args.out}")
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from corpus import DEFAULT_CORPUS_DIR, iter_index_chunks
+
+
+def subject_mask(subjects: np.ndarray, filter: Optional[dict]) -> Optional[np.ndarray]:
+    """Support Pinecone-style {"subject": "biology"} or {"subject": {"$in": [...]}}"""
+    if not filter or "subject" not in filter:
+        return None
+    wanted = filter["subject"]
+    wanted = wanted.get("$in", []) if isinstance(wanted, dict) else [wanted]
+    return np.isin(subjects, wanted)
+
+
+class LocalVectorStore:
+    """In-process vector index with a Pinecone-compatible query()
+
+    Stores unit-normalized float32 embeddings in ``vectors.npy``, memory
+    mapped on load, next to ``chunks.jsonl`` holding each row's id, text and
+    metadata. Queries score every row with one matrix-vector product, or
+    only the rows of the ``nprobe`` nearest clusters once an IVF index has
+    been built with build_ivf().
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadata: List[dict] = []
+        self._positions: Dict[str, int] = {}
+        self._subjects = np.array([], dtype=object)
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: Optional[List[np.ndarray]] = None
+        self.nprobe = 0
+        self._lock = threading.Lock()
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.index_dir, "vectors.npy")
+
+    @property
+    def _chunks_path(self):
+        return os.path.join(self.index_dir, "chunks.jsonl")
+
+    @property
+    def _ivf_path(self):
+        return os.path.join(self.index_dir, "ivf.npz")
+
+    def exists(self) -> bool:
+        return os.path.exists(self._vectors_path) and os.path.exists(self._chunks_path)
+
+    def load(self, nprobe: int = 0) -> "LocalVectorStore":
+        """Load a saved index; nprobe > 0 enables IVF search if ivf.npz exists"""
+        self.vectors = np.load(self._vectors_path, mmap_mode="r")
+        ids, texts, metadata = [], [], []
+        with open(self._chunks_path, encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                ids.append(row["id"])
+                texts.append(row["text"])
+                metadata.append(row["metadata"])
+        self._set_rows(ids, texts, metadata)
+
+        if nprobe and os.path.exists(self._ivf_path):
+            ivf = np.load(self._ivf_path)
+            self.centroids = ivf["centroids"]
+            self.lists = np.split(ivf["rows"], ivf["offsets"][1:-1])
+            self.nprobe = nprobe
+        return self
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        np.save(self._vectors_path, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(self._chunks_path, "w", encoding="utf-8") as f:
+            for row in zip(self.ids, self.texts, self.metadata):
+                f.write(json.dumps(dict(zip(("id", "text", "metadata"), row))) + "\n")
+        if self.centroids is not None:
+            offsets = np.cumsum([0] + [len(rows) for rows in self.lists])
+            np.savez(self._ivf_path, centroids=self.centroids, rows=np.concatenate(self.lists), offsets=offsets)
+        elif os.path.exists(self._ivf_path):
+            os.remove(self._ivf_path)
+
+    def _set_rows(self, ids, texts, metadata):
+        self.ids, self.texts, self.metadata = ids, texts, metadata
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        self._subjects = np.array([m.get("subject") for m in metadata], dtype=object)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def upsert(self, ids: List[str], vectors, texts: List[str], metadata: List[dict]):
+        """Insert or replace rows by id. Invalidates any IVF index."""
+        new_vectors = self._normalize(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            matrix = np.array(self.vectors, dtype=np.float32)
+            if matrix.size == 0:
+                matrix = np.zeros((0, new_vectors.shape[1]), dtype=np.float32)
+            all_ids, all_texts, all_metadata = list(self.ids), list(self.texts), list(self.metadata)
+            appended = []
+            for chunk_id, vector, text, meta in zip(ids, new_vectors, texts, metadata):
+                position = self._positions.get(chunk_id)
+                if position is None:
+                    appended.append(vector)
+                    all_ids.append(chunk_id)
+                    all_texts.append(text)
+                    all_metadata.append(meta)
+                else:
+                    matrix[position] = vector
+                    all_texts[position] = text
+                    all_metadata[position] = meta
+            if appended:
+                matrix = np.vstack([matrix, np.stack(appended)])
+            self.vectors = matrix
+            self._set_rows(all_ids, all_texts, all_metadata)
+            self.centroids, self.lists, self.nprobe = None, None, 0
+
+    def delete(self, ids: Iterable[str]):
+        """Remove rows by id. Invalidates any IVF index."""
+        drop = {self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions}
+        if not drop:
+            return
+        with self._lock:
+            keep = [i for i in range(len(self.ids)) if i not in drop]
+            self.vectors = np.array(self.vectors, dtype=np.float32)[keep]
+            self._set_rows(
+                [self.ids[i] for i in keep],
+                [self.texts[i] for i in keep],
+                [self.metadata[i] for i in keep],
+            )
+            self.centroids, self.lists, self.nprobe = None, None, 0
+
+    def build_ivf(self, nlist: int = 32, iterations: int = 10, nprobe: int = 4, seed: int = 0):
+        """Cluster rows with spherical k-means so queries scan only nprobe lists"""
+        vectors = np.asarray(self.vectors)
+        nlist = min(nlist, len(vectors))
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = vectors[assignments == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = self._normalize(centroids)
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        self.centroids = centroids.astype(np.float32)
+        self.lists = [np.flatnonzero(assignments == c) for c in range(nlist)]
+        self.nprobe = nprobe
+
+    def query(self, vector, top_k: int = 4, include_metadata: bool = True, filter: Optional[dict] = None, **kwargs):
+        query = self._normalize(np.asarray(vector, dtype=np.float32))
+        vectors, ids = self.vectors, self.ids
+        if not ids:
+            return {"matches": []}
+
+        if self.centroids is not None and self.nprobe:
+            probes = np.argsort(-(self.centroids @ query))[: self.nprobe]
+            rows = np.concatenate([self.lists[c] for c in probes])
+        else:
+            rows = None
+
+        mask = subject_mask(self._subjects, filter)
+        if mask is not None:
+            rows = np.flatnonzero(mask) if rows is None else rows[mask[rows]]
+
+        scores = vectors @ query if rows is None else vectors[rows] @ query
+        k = min(top_k, len(scores))
+        if k == 0:
+            return {"matches": []}
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        positions = top if rows is None else rows[top]
+
+        matches = []
+        for position, score in zip(positions, scores[top]):
+            match = {"id": ids[position], "score": float(score)}
+            if include_metadata:
+                match["metadata"] = {**self.metadata[position], "text": self.texts[position]}
+            matches.append(match)
+        return {"matches": matches}
+
+
+def build_from_corpus(
+    index_dir: str, embeddings, corpus_dir: str = DEFAULT_CORPUS_DIR, batch_size: int = 64, mcqs: bool = True
+) -> LocalVectorStore:
+    """Chunk and embed the whole curriculum (and MCQ banks) into a fresh local index"""
+    store = LocalVectorStore(index_dir)
+    chunks = list(iter_index_chunks(corpus_dir, mcqs))
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        store.upsert(
+            [c["id"] for c in batch],
+            embeddings.embed_documents([c["text"] for c in batch]),
+            [c["text"] for c in batch],
+            [c["metadata"] for c in batch],
+        )
+    store.save()
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local vector index from *_content_data.json and *_mcqs_data.json")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--out", default="local_index")
+    parser.add_argument("--no-mcqs", action="store_true", help="Skip *_mcqs_data.json")
+    parser.add_argument("--embedding-model", default="BAAI/bge-m3")
+    parser.add_argument("--fake", action="store_true", help="Use FakeEmbeddings (no API key needed)")
+    parser.add_argument("--ivf", type=int, default=0, help="Number of IVF lists to build (0 = exact search)")
+    args = parser.parse_args()
+
+    if args.fake:
+        from FakeBackends import FakeEmbeddings
+        embeddings = FakeEmbeddings(latency=0.0)
+    else:
+        from dotenv import load_dotenv
+        from langchain_pinecone import PineconeEmbeddings
+        load_dotenv()
+        embeddings = PineconeEmbeddings(model=args.embedding_model)
+
+    store = build_from_corpus(args.out, embeddings, args.corpus, mcqs=not args.no_mcqs)
+    if args.ivf:
+        store.build_ivf(nlist=args.ivf)
+        store.save()
+    print(f"Indexed {len(store.ids)} chunks into {args.out}")
@@ -0,0 +1,223 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.routing import Mount
+
+# Seconds; spans everything from a cached embedding (sub-millisecond) to a slow LLM call
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect and two additions"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Estimate by linear interpolation inside the bucket holding rank q * count
+
+        Capped at the largest value seen, so sparse series don't report the
+        top of a wide bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return min(lower + (upper - lower) * (rank - cumulative) / count, self.max)
+            cumulative += count
+        return self.max
+
+
+class MetricsRegistry:
+    """Latency histograms and counters, rendered in Prometheus text format
+
+    Hot paths only touch in-memory counters under one lock. Values owned by
+    other components (cache stats, websocket counts, queue depths) are
+    pulled by gauge callbacks when /metrics is scraped, so they add nothing
+    per request.
+    """
+
+    def __init__(self, prefix: str = "mdcat"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._gauges: List[Tuple[str, str, str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]]] = []
+
+    def observe(self, name: str, seconds: float, labels: Optional[Dict[str, str]] = None):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, amount: float = 1.0):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """Record the duration of the with-block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, labels)
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def gauge(
+        self,
+        name: str,
+        help_text: str,
+        collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+        kind: str = "gauge",
+    ):
+        """Register a value read at scrape time; collect() yields (labels, value)
+
+        kind="counter" for monotonic counts kept elsewhere, e.g. cache hits.
+        """
+        self._gauges.append((name, help_text, kind, collect))
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """p50/p95/p99 (ms) and count per histogram series, for logs and benchmarks"""
+        with self._lock:
+            return {
+                name: {
+                    ",".join(f"{k}={v}" for k, v in key) or "all": {
+                        "count": h.count,
+                        **{f"p{int(q * 100)}_ms": round(h.quantile(q) * 1000, 3) for q in QUANTILES},
+                    }
+                    for key, h in series.items()
+                }
+                for name, series in self._histograms.items()
+            }
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            snapshots = {
+                name: {key: (list(h.counts), h.total, h.count, [h.quantile(q) for q in QUANTILES], h.bounds)
+                       for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+            counters = {name: dict(series) for name, series in self._counters.items()}
+
+        for name, series in sorted(snapshots.items()):
+            metric = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# HELP {metric} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {metric} histogram")
+            for key, (counts, total, count, _, bounds) in sorted(series.items()):
+                cumulative = 0
+                for bound, bucket in zip(bounds, counts):
+                    cumulative += bucket
+                    lines.append(f"{metric}_bucket{_format_labels(key, [('le', repr(bound))])} {cumulative}")
+                lines.append(f"{metric}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{metric}_sum{_format_labels(key)} {total}")
+                lines.append(f"{metric}_count{_format_labels(key)} {count}")
+
+            # Quantiles estimated from the buckets, for dashboards without histogram_quantile()
+            quantile_metric = f"{self.prefix}_{name}_quantile_seconds"
+            lines.append(f"# TYPE {quantile_metric} gauge")
+            for key, (_, _, _, quantiles, _) in sorted(series.items()):
+                for q, value in zip(QUANTILES, quantiles):
+                    lines.append(f"{quantile_metric}{_format_labels(key, [('quantile', str(q))])} {value}")
+
+        for name, series in sorted(counters.items()):
+            metric = f"{self.prefix}_{name}_total"
+            lines.append(f"# HELP {metric} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {metric} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{metric}{_format_labels(key)} {value}")
+
+        for name, help_text, kind, collect in self._gauges:
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            try:
+                for labels, value in collect():
+                    lines.append(f"{metric}{_format_labels(_labels(labels))} {value}")
+            except Exception as e:
+                print(f"Metrics: gauge {name} failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing HTTP requests by route template (e.g. /rl/{user_id}/stats)"""
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Routers (including mounted apps) record the matched route in the shared scope
+            route = scope.get("route")
+            path = getattr(route, "path", None)
+            matched = path is not None and not isinstance(route, Mount)
+            route_label = f"{scope.get('root_path', '')}{path}" if matched else "unmatched"
+            self.registry.observe(
+                "http_request",
+                time.perf_counter() - started,
+                {"method": scope["method"], "route": route_label, "status": str(status["code"])},
+            )
+
+
+# One registry per process, shared by the chat service and the mounted RL app
+metrics = MetricsRegistry()
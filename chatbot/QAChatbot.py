@@ -1,8 +1,23 @@
-from typing import List
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, FrozenSet, List, Optional, Tuple
 from dataclasses import dataclass
 from pinecone import Pinecone
 from langchain_pinecone import PineconeEmbeddings
 from langchain_core.output_parsers import StrOutputParser
+from EmbeddingCache import EmbeddingCache, normalize_query
+from AnswerCache import SemanticAnswerCache
+from LocalVectorStore import LocalVectorStore
+from LexicalIndex import LexicalIndex
+from SingleFlight import SingleFlight
+from EmbeddingBatcher import EmbeddingBatcher, query_batch_function
+from ExtractiveAnswer import extractive_answer, SLOW_ANSWER
+from LLMScheduler import LLMBusy
+from Metrics import metrics
 
 
 @dataclass
@@ -12,78 +27,625 @@ class SearchResult:
     content: str
     metadata: dict
     score: float
+    id: str = ""
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[SearchResult]], top_k: int, k: int = 60
+) -> List[SearchResult]:
+    """Merge ranked lists by summing 1 / (k + rank); score becomes the fused score"""
+    fused: Dict[str, float] = {}
+    results: Dict[str, SearchResult] = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            key = result.id or result.content
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            results.setdefault(key, result)
+    best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return [
+        SearchResult(content=results[key].content, metadata=results[key].metadata, score=fused[key], id=results[key].id)
+        for key in best
+    ]
+
+
+def context_ids(search_results: List[SearchResult]) -> FrozenSet[str]:
+    """Identify the set of retrieved chunks, hashing content when ids are missing"""
+    return frozenset(
+        result.id or hashlib.sha1(result.content.encode("utf-8")).hexdigest()
+        for result in search_results
+    )
+
+
+def answer_context(search_results: List[SearchResult], chat_history=None) -> FrozenSet[str]:
+    """What a cached answer depends on besides the query: the context chunks and the conversation
+
+    The prompt includes the chat history, so an answer is only reused for
+    the same history.
+    """
+    ids = context_ids(search_results)
+    if chat_history:
+        digest = hashlib.sha1(json.dumps(chat_history, sort_keys=True).encode("utf-8")).hexdigest()
+        ids = ids | {f"history:{digest}"}
+    return ids
+
+
+@dataclass
+class StageLimits:
+    """Concurrency cap and timeout (seconds) for one stage of the async pipeline"""
+
+    concurrency: int = 16
+    timeout: float = 30.0
+
+
+DEFAULT_STAGE_LIMITS = {
+    "embed": StageLimits(concurrency=16, timeout=10.0),
+    "search": StageLimits(concurrency=16, timeout=10.0),
+    "generate": StageLimits(concurrency=8, timeout=60.0),
+}
+
+
+class StageTimeoutError(Exception):
+    """Raised when a pipeline stage exceeds its timeout"""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} timed out after {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+@dataclass
+class Answer:
+    """Reply to one question, as returned by QAChatbot.aanswer
+
+    ``kind`` is "answer", "canned", "fallback" (extractive, the LLM missed
+    the deadline or failed), "busy" (refused by the LLM scheduler; retry
+    after ``retry_after`` seconds) or "error". For a deadline fallback
+    ``late`` resolves to the generated answer once it is done.
+    """
+
+    text: str
+    kind: str = "answer"
+    late: Optional[asyncio.Future] = None
+    retry_after: Optional[int] = None
+
+
+async def _next_chunk(chunks: AsyncIterator[str]) -> Optional[str]:
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _once(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def _chain(first: str, rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    yield first
+    async for chunk in rest:
+        yield chunk
+
+
+async def _collect(first: asyncio.Future, rest: AsyncIterator[str]) -> str:
+    chunk = await first
+    if chunk is None:
+        return ""
+    chunks = [chunk]
+    async for chunk in rest:
+        chunks.append(chunk)
+    return "".join(chunks).strip()
 
 
 class QAChatbot:
-    def __init__(self, llm, prompt, top_k: int = 4):
+    def __init__(
+        self,
+        llm,
+        prompt,
+        top_k: int = 4,
+        stage_limits: Optional[Dict[str, StageLimits]] = None,
+        max_workers: int = 32,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        answer_cache: Optional[SemanticAnswerCache] = None,
+        lexical_index: Optional[LexicalIndex] = None,
+        candidate_k: int = 20,
+        rrf_k: int = 60,
+        budgeter=None,
+        coalesce: bool = True,
+        embed_batch_size: int = 1,
+        embed_batch_wait: float = 0.005,
+        intent_filter=None,
+        answer_deadline: Optional[float] = None,
+        scheduler=None,
+    ):
         self.llm = llm
         self.prompt = prompt
         self.top_k = top_k
         self.embeddings = None
+        self.embedding_model = None
         self.index = None
+        self.embedding_cache = embedding_cache
+        self.answer_cache = answer_cache
+
+        # With a lexical index, candidate_k results from each retriever are
+        # fused with reciprocal-rank fusion down to top_k
+        self.lexical_index = lexical_index
+        self.candidate_k = candidate_k
+        self.rrf_k = rrf_k
+
+        # ContextBudget.ContextBudgeter; bounds prompt size as chats grow
+        self.budgeter = budgeter
+
+        # Identical questions asked at the same moment share one retrieval
+        # and one LLM call instead of each making their own
+        self.single_flight = SingleFlight() if coalesce else None
+
+        # With embed_batch_size > 1, query embeddings that miss the cache at
+        # about the same time go upstream as one batch (see EmbeddingBatcher)
+        self.embed_batch_size = embed_batch_size
+        self.embed_batch_wait = embed_batch_wait
+        self.embedding_batcher: Optional[EmbeddingBatcher] = None
+
+        # IntentFilter.IntentFilter; greetings and off-topic messages get a
+        # canned reply before any retrieval or generation
+        self.intent_filter = intent_filter
+
+        # Seconds from question to reply. Retrieval always runs; when the LLM
+        # hasn't answered by then an extractive answer built from the
+        # retrieved chunks is sent instead and generation carries on
+        self.answer_deadline = answer_deadline
+
+        # LLMScheduler.LLMScheduler shared with other LLM work (quiz
+        # feedback); with one, generation slots and per-user rate limits
+        # come from it instead of the "generate" stage semaphore
+        self.scheduler = scheduler
+
+        # Blocking embedding, vector search and LLM calls run on this pool so
+        # the event loop stays free to serve other sockets and requests
+        self.stage_limits = {**DEFAULT_STAGE_LIMITS, **(stage_limits or {})}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qa")
+        self._semaphores = {
+            stage: asyncio.Semaphore(limits.concurrency)
+            for stage, limits in self.stage_limits.items()
+        }
+        # Requests waiting for or running in each stage (semaphore + executor)
+        self.in_flight = {stage: 0 for stage in self.stage_limits}
 
     def setup(
         self,
         pinecone_api_key: str,
         index_name: str,
         embedding_model: str = "multilingual-e5-large",
+        local_index_dir: Optional[str] = None,
+        nprobe: int = 0,
     ):
-        """Initialize the chatbot with Pinecone and embeddings"""
+        """Initialize the chatbot with Pinecone and embeddings
+
+        With local_index_dir, retrieval uses an in-process LocalVectorStore
+        built from the curriculum instead of the remote Pinecone index.
+        """
         try:
             # Setup embeddings
             self.embeddings = PineconeEmbeddings(
                 model=embedding_model,
                 encode_kwargs={"normalize_embeddings": True},
             )
+            self.embedding_model = embedding_model
+            self._start_batcher()
 
-            # Setup Pinecone
-            pc = Pinecone(api_key=pinecone_api_key)
-            self.index = pc.Index(index_name)
+            if local_index_dir:
+                self.index = LocalVectorStore(local_index_dir).load(nprobe=nprobe)
+            else:
+                # Setup Pinecone
+                pc = Pinecone(api_key=pinecone_api_key)
+                self.index = pc.Index(index_name)
 
             return "Setup complete - ready to answer questions!"
         except Exception as e:
             return f"Setup failed: {str(e)}"
 
-    def search(self, query: str) -> List[SearchResult]:
-        """Search for relevant documents"""
+    def setup_backends(self, embeddings, index, embedding_model: str = "fake"):
+        """Use already constructed embeddings and index (e.g. FakeBackends)"""
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model
+        self.index = index
+        self._start_batcher()
+        return "Setup complete - ready to answer questions!"
+
+    def _start_batcher(self):
+        if self.embedding_batcher is not None:
+            self.embedding_batcher.close()
+            self.embedding_batcher = None
+        if self.embed_batch_size > 1:
+            self.embedding_batcher = EmbeddingBatcher(
+                query_batch_function(self.embeddings),
+                max_batch=self.embed_batch_size,
+                max_wait=self.embed_batch_wait,
+                timeout=self.stage_limits["embed"].timeout,
+            )
+
+    def close(self):
+        if self.embedding_batcher is not None:
+            self.embedding_batcher.close()
+        self._executor.shutdown(wait=False)
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query for vector search"""
         if not self.embeddings or not self.index:
             raise ValueError("Please run setup() first")
+        compute = self.embedding_batcher.embed if self.embedding_batcher else self.embeddings.embed_query
+        with metrics.time("stage", stage="embed"):
+            if self.embedding_cache is not None:
+                return self.embedding_cache.get_or_compute(self.embedding_model, query, compute)
+            return compute(query)
 
-        # Get query embedding and search
-        query_embedding = self.embeddings.embed_query(query)
-        results = self.index.query(
-            vector=query_embedding, top_k=self.top_k, include_metadata=True
-        )
-
-        # Format results
+    @staticmethod
+    def _to_results(results) -> List[SearchResult]:
         return [
             SearchResult(
                 content=match["metadata"]["text"],
                 metadata={k: v for k, v in match["metadata"].items() if k != "text"},
                 score=match["score"],
+                id=match.get("id", ""),
             )
             for match in results["matches"]
         ]
 
-    def get_answer(self, question: str) -> str:
-        """Get answer for a question using relevant context"""
-        try:
-            # Get relevant documents
-            search_results = self.search(question)
-            print(search_results)
-            # Combine context
-            context = "\n\n".join(result.content for result in search_results)
+    def query_index(
+        self, query_embedding: List[float], subject: Optional[str] = None, top_k: Optional[int] = None
+    ) -> List[SearchResult]:
+        """Find the top_k documents nearest to an embedding, optionally within one subject"""
+        kwargs = {"filter": {"subject": subject}} if subject else {}
+        with metrics.time("stage", stage="vector_search"):
+            results = self.index.query(
+                vector=query_embedding, top_k=top_k or self.top_k, include_metadata=True, **kwargs
+            )
+        return self._to_results(results)
+
+    def retrieve(
+        self, query: str, query_embedding: List[float], subject: Optional[str] = None
+    ) -> List[SearchResult]:
+        """Vector search, fused with BM25 over the same chunks when a lexical index is set"""
+        if self.lexical_index is None:
+            return self.query_index(query_embedding, subject)
+        dense = self.query_index(query_embedding, subject, self.candidate_k)
+        kwargs = {"filter": {"subject": subject}} if subject else {}
+        with metrics.time("stage", stage="lexical_search"):
+            lexical = self._to_results(self.lexical_index.query(query, top_k=self.candidate_k, **kwargs))
+        return reciprocal_rank_fusion([dense, lexical], self.top_k, self.rrf_k)
+
+    def retrieval_query(self, question: str, chat_history=None) -> str:
+        """The text to embed and search for a message in a conversation"""
+        if self.budgeter is None or not chat_history:
+            return question
+        return self.budgeter.retrieval_query(question, chat_history)
 
-            # Format prompt with context and question
-            formatted_prompt = self.prompt.format(context=context, question=question)
+    def canned_answer(self, question: str, chat_history=None) -> Optional[str]:
+        """Reply for small talk or off-topic messages, or None if the question needs answering"""
+        if self.intent_filter is None:
+            return None
+        context = self.retrieval_query(question, chat_history) if chat_history else None
+        return self.intent_filter.route(question, context)
 
-            # Get and parse response
+    def build_prompt(self, question: str, search_results: List[SearchResult], chat_history=None) -> str:
+        """Combine retrieved context, chat history and the question into the QA prompt"""
+        if self.budgeter is not None:
+            with metrics.time("stage", stage="prompt"):
+                return self.budgeter.build(self.prompt, question, chat_history, search_results)
+        if chat_history:
+            history = "\n".join(f"{msg['sender']}: {msg['content']}" for msg in chat_history)
+            question = f"{history}\nCurrent User Message: {question}"
+        context = "\n\n".join(result.content for result in search_results)
+        return self.prompt.format(context=context, question=question)
+
+    def generate(self, formatted_prompt: str) -> str:
+        """Run the LLM and parse its response"""
+        with metrics.time("stage", stage="generate"):
             response = self.llm.invoke(formatted_prompt)
-            parsed_response = StrOutputParser().invoke(response)
+        return StrOutputParser().invoke(response).strip()
+
+    def search(self, query: str, subject: Optional[str] = None) -> List[SearchResult]:
+        """Search for relevant documents"""
+        return self.retrieve(query, self.embed_query(query), subject)
+
+    def cached_answer(
+        self, query_embedding, search_results: List[SearchResult], bypass_cache: bool = False, chat_history=None
+    ) -> Optional[str]:
+        """Answer previously generated for a near-identical query, context and conversation"""
+        if self.answer_cache is None or bypass_cache:
+            return None
+        return self.answer_cache.lookup(query_embedding, answer_context(search_results, chat_history))
+
+    def remember_answer(self, query_embedding, search_results: List[SearchResult], answer: str, chat_history=None):
+        """Cache a generated answer; empty ones would be served to every similar question"""
+        if self.answer_cache is not None and answer and answer.strip():
+            self.answer_cache.store(query_embedding, answer_context(search_results, chat_history), answer)
+
+    def fallback_answer(self, question: str, search_results: List[SearchResult], reason: str) -> str:
+        """Extractive answer from the retrieved chunks, for when the LLM is too slow or failing"""
+        metrics.inc("answer_fallbacks", {"reason": reason})
+        document_frequency = self.lexical_index.document_frequency if self.lexical_index is not None else None
+        return extractive_answer(question, search_results, document_frequency) or SLOW_ANSWER
+
+    def _time_left(self, started: float) -> Optional[float]:
+        if not self.answer_deadline:
+            return None
+        return max(0.0, started + self.answer_deadline - time.perf_counter())
+
+    def _admit(self, user: Optional[str]):
+        if self.scheduler is not None:
+            self.scheduler.admit(user, "chat")
+
+    def _llm_slot(self, user: Optional[str]):
+        return self.scheduler.slot("chat", user) if self.scheduler is not None else None
+
+    @staticmethod
+    def _track_late(late: asyncio.Future):
+        def finished(future: asyncio.Future):
+            failed = future.cancelled() or future.exception() is not None
+            metrics.inc("late_answers", {"result": "failed" if failed else "done"})
+
+        late.add_done_callback(finished)
+
+    async def _run_stage(self, stage: str, fn, *args, gate=None):
+        """Run a blocking stage on the executor under its concurrency cap and timeout
+
+        ``gate`` is an async context manager to hold instead of the stage's
+        semaphore, e.g. an LLMScheduler slot.
+        """
+        limits = self.stage_limits[stage]
+        queued = time.perf_counter()
+        self.in_flight[stage] += 1
+
+        def run():
+            # Time spent waiting for the semaphore and a free executor thread
+            metrics.observe("stage_wait", time.perf_counter() - queued, {"stage": stage})
+            return fn(*args)
+
+        try:
+            async with gate or self._semaphores[stage]:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self._executor, run)
+                try:
+                    return await asyncio.wait_for(future, limits.timeout)
+                except asyncio.TimeoutError:
+                    metrics.inc("timeouts", {"stage": stage})
+                    # The worker thread finishes in the background; only the caller stops waiting
+                    raise StageTimeoutError(stage, limits.timeout)
+        finally:
+            self.in_flight[stage] -= 1
+
+    async def _coalesce(self, key, fn):
+        if self.single_flight is None:
+            return await fn()
+        return await self.single_flight.do(key, fn)
+
+    def answer_key(self, question: str, search_results: List[SearchResult], chat_history=None) -> str:
+        """Requests with the same key get the same prompt, up to case and punctuation"""
+        payload = json.dumps(
+            [normalize_query(question), sorted(context_ids(search_results)), chat_history or []],
+            sort_keys=True,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    async def aretrieve(
+        self, query: str, subject: Optional[str] = None, lexical_query: Optional[str] = None
+    ) -> Tuple[List[float], List[SearchResult]]:
+        """Async embedding plus hybrid search, both off the event loop"""
+
+        async def run():
+            query_embedding = await self._run_stage("embed", self.embed_query, query)
+            search_results = await self._run_stage(
+                "search", self.retrieve, lexical_query or query, query_embedding, subject
+            )
+            return query_embedding, search_results
+
+        key = ("retrieve", normalize_query(query), normalize_query(lexical_query or query), subject)
+        return await self._coalesce(key, run)
+
+    async def asearch(self, query: str, subject: Optional[str] = None) -> List[SearchResult]:
+        """Async search; embedding and vector search run off the event loop"""
+        _, search_results = await self.aretrieve(query, subject)
+        return search_results
+
+    async def aanswer(
+        self,
+        question: str,
+        bypass_cache: bool = False,
+        subject: Optional[str] = None,
+        lexical_query: Optional[str] = None,
+        chat_history=None,
+        user: Optional[str] = None,
+    ) -> Answer:
+        """Answer a question; every blocking stage runs off the event loop
+
+        With answer_deadline set, an LLM answer that isn't ready in time is
+        replaced by an extractive one and handed over in Answer.late when
+        it is. A failed generation falls back the same way. ``user`` is who
+        the scheduler rate-limits; a refused call returns a "busy" Answer.
+        """
+        try:
+            started = time.perf_counter()
+            canned = self.canned_answer(question, chat_history)
+            if canned is not None:
+                metrics.observe("request", time.perf_counter() - started, {"kind": "canned"})
+                return Answer(canned, "canned")
+            query = self.retrieval_query(question, chat_history)
+            query_embedding, search_results = await self.aretrieve(query, subject, lexical_query)
+
+            answer, kind, late = self.cached_answer(query_embedding, search_results, bypass_cache, chat_history), "answer", None
+            if answer is None:
+                # Every caller is charged before joining a shared generation,
+                # so one user's empty bucket can't refuse the others' requests
+                try:
+                    self._admit(user)
+                except LLMBusy as busy:
+                    metrics.observe("request", time.perf_counter() - started, {"kind": "busy"})
+                    return Answer(busy.message, "busy", retry_after=busy.retry_after)
+
+                async def run():
+                    formatted_prompt = self.build_prompt(question, search_results, chat_history)
+                    generated = await self._run_stage(
+                        "generate", self.generate, formatted_prompt, gate=self._llm_slot(user)
+                    )
+                    self.remember_answer(query_embedding, search_results, generated, chat_history)
+                    return generated
 
-            return parsed_response.strip()
+                key = ("answer", self.answer_key(question, search_results, chat_history))
+                # A task rather than a plain await, so it outlives a missed deadline
+                generation = asyncio.ensure_future(self._coalesce(key, run))
+                done, _ = await asyncio.wait({generation}, timeout=self._time_left(started))
+                if not done:
+                    self._track_late(generation)
+                    answer, kind, late = self.fallback_answer(question, search_results, "deadline"), "fallback", generation
+                elif isinstance(generation.exception(), LLMBusy):
+                    busy = generation.exception()
+                    metrics.observe("request", time.perf_counter() - started, {"kind": "busy"})
+                    return Answer(busy.message, "busy", retry_after=busy.retry_after)
+                elif generation.exception() is not None:
+                    metrics.inc("errors", {"where": "generate"})
+                    answer, kind = self.fallback_answer(question, search_results, "error"), "fallback"
+                else:
+                    answer = generation.result()
+            metrics.observe("request", time.perf_counter() - started, {"kind": kind})
+            return Answer(answer, kind, late)
 
         except ValueError as e:
-            return str(e)
+            metrics.inc("errors", {"where": "answer"})
+            return Answer(str(e), "error")
         except Exception as e:
-            return f"Error getting answer: {str(e)}"
\ No newline at end of file
+            metrics.inc("errors", {"where": "answer"})
+            return Answer(f"Error getting answer: {str(e)}", "error")
+
+    async def aget_answer(
+        self,
+        question: str,
+        bypass_cache: bool = False,
+        subject: Optional[str] = None,
+        lexical_query: Optional[str] = None,
+        chat_history=None,
+        user: Optional[str] = None,
+    ) -> str:
+        """Text of aanswer"""
+        result = await self.aanswer(question, bypass_cache, subject, lexical_query, chat_history, user)
+        return result.text
+
+    def _stream_chunks(self, formatted_prompt: str):
+        """Yield text chunks from the LLM, or the whole answer if it can't stream"""
+        if not hasattr(self.llm, "stream"):
+            yield self.generate(formatted_prompt)
+            return
+        for chunk in self.llm.stream(formatted_prompt):
+            # LLMs stream str, chat models stream message chunks
+            yield getattr(chunk, "content", chunk)
+
+    def astream_answer(
+        self,
+        question: str,
+        query_embedding,
+        search_results: List[SearchResult],
+        chat_history=None,
+        user: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """Stream a fresh answer and remember it once complete
+
+        Concurrent identical requests share one LLM stream; each receives
+        every chunk, including those sent before it joined. Raises LLMBusy
+        right away if the scheduler refuses ``user``, or before the first
+        chunk if no slot frees up.
+        """
+        # Charged per caller, outside the shared stream
+        self._admit(user)
+
+        async def produce():
+            chunks = []
+            prompt = self.build_prompt(question, search_results, chat_history)
+            async for chunk in self.astream_generate(prompt, user):
+                chunks.append(chunk)
+                yield chunk
+            # Not reached when the stream fails or is abandoned part way
+            self.remember_answer(query_embedding, search_results, "".join(chunks).strip(), chat_history)
+
+        if self.single_flight is None:
+            return produce()
+        return self.single_flight.stream(("answer", self.answer_key(question, search_results, chat_history)), produce)
+
+    async def astream_by_deadline(
+        self, chunks: AsyncIterator[str], question: str, search_results: List[SearchResult], started: float
+    ) -> Tuple[AsyncIterator[str], bool, Optional[asyncio.Future]]:
+        """Hold an answer stream to answer_deadline for its first chunk
+
+        Returns (chunks, fallback, late): the stream itself when the first
+        chunk is on time. Otherwise an extractive answer to send instead,
+        and a future for the generated answer, which keeps streaming in
+        the background. A stream that fails before its first chunk falls
+        back the same way, without the future; LLMBusy is raised.
+        """
+        chunks = chunks.__aiter__()
+        first = asyncio.ensure_future(_next_chunk(chunks))
+        done, _ = await asyncio.wait({first}, timeout=self._time_left(started))
+        if not done:
+            late = asyncio.ensure_future(_collect(first, chunks))
+            self._track_late(late)
+            return _once(self.fallback_answer(question, search_results, "deadline")), True, late
+        if isinstance(first.exception(), LLMBusy):
+            raise first.exception()
+        if first.exception() is not None:
+            metrics.inc("errors", {"where": "generate"})
+            return _once(self.fallback_answer(question, search_results, "error")), True, None
+        chunk = first.result()
+        return (chunks if chunk is None else _chain(chunk, chunks)), False, None
+
+    async def astream_generate(self, formatted_prompt: str, user: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream generated text as it arrives.
+
+        The blocking LLM stream is consumed on the executor and handed to the
+        event loop chunk by chunk. The "generate" timeout applies to the wait
+        for each chunk, so it bounds time-to-first-token and stalls rather
+        than total generation time. With a scheduler the slot is held
+        until the stream ends.
+        """
+        limits = self.stage_limits["generate"]
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            started = time.perf_counter()
+            first = True
+            try:
+                for text in self._stream_chunks(formatted_prompt):
+                    if stop.is_set():
+                        return
+                    if first:
+                        metrics.observe("stage", time.perf_counter() - started, {"stage": "first_token"})
+                        first = False
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                metrics.observe("stage", time.perf_counter() - started, {"stage": "generate_stream"})
+
+        self.in_flight["generate"] += 1
+        try:
+            async with self._llm_slot(user) or self._semaphores["generate"]:
+                loop.run_in_executor(self._executor, produce)
+                try:
+                    while True:
+                        try:
+                            item = await asyncio.wait_for(queue.get(), limits.timeout)
+                        except asyncio.TimeoutError:
+                            metrics.inc("timeouts", {"stage": "generate"})
+                            raise StageTimeoutError("generate", limits.timeout)
+                        if item is done:
+                            return
+                        if isinstance(item, Exception):
+                            raise item
+                        if item:
+                            yield item
+                finally:
+                    # Lets the producer thread stop early if the consumer goes away
+                    stop.set()
+        finally:
+            self.in_flight["generate"] -= 1
@@ -0,0 +1,98 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List
+
+
+class _SharedStream:
+    """Chunks of one in-flight stream, replayed to every subscriber"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Condition()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def feed(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                await self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            await self._notify()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.chunks) or self.done)
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done and position >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """Coalesces identical concurrent work onto one in-flight computation
+
+    The first caller for a key starts the work as its own task; callers
+    arriving before it finishes wait on the same task instead of starting
+    another. Because the work is a separate task, a caller that goes away
+    (e.g. a closed socket) doesn't cancel it for the others. Keys are
+    forgotten as soon as the work finishes, so this never serves stale
+    results; caching is left to EmbeddingCache and SemanticAnswerCache.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, _SharedStream] = {}
+        self.started = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(self._calls, key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Like do() for async iterators: late joiners get the chunks so far, then live ones"""
+        shared = self._streams.get(key)
+        if shared is None:
+            self.started += 1
+            shared = _SharedStream()
+            self._streams[key] = shared
+            task = asyncio.ensure_future(shared.feed(fn()))
+            task.add_done_callback(lambda t: self._forget(self._streams, key, shared))
+        else:
+            self.shared += 1
+        async for chunk in shared.subscribe():
+            yield chunk
+
+    @staticmethod
+    def _forget(calls: dict, key: Hashable, value):
+        if calls.get(key) is value:
+            del calls[key]
+        # Mark a failure nobody awaited (all callers gone) as retrieved
+        if isinstance(value, asyncio.Task) and not value.cancelled():
+            value.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "started": self.started,
+            "shared": self.shared,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
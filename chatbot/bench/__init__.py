@@ -0,0 +1,10 @@
+# __init__.py
+
+import os
+import tempfile
+
+# Benchmarks run against throwaway backends unless told otherwise: a fresh
+# SQLite RL store per run instead of the shared Mongo database, and the fake
+# embedder/index/LLM for the chat service
+os.environ.setdefault("RL_STORE", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='mdcat-bench-'), 'rl.db')}")
+os.environ.setdefault("CHATBOT_BACKEND", "fake")
@@ -0,0 +1,105 @@
+# common.py
+
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Higher is better for these keys; for every other *_ms / *_us key lower is better
+HIGHER_IS_BETTER = ("throughput_per_s", "ops_per_s")
+
+
+def summarize(latencies: Sequence[float], elapsed: Optional[float] = None, unit: str = "ms") -> Dict[str, float]:
+    """Percentiles of latencies (seconds) and, given the wall time, throughput"""
+    scale = 1000.0 if unit == "ms" else 1_000_000.0
+    samples = np.asarray(latencies, dtype=np.float64) * scale
+    result = {"count": int(len(samples))}
+    if len(samples):
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        result.update({
+            f"mean_{unit}": round(float(samples.mean()), 4),
+            f"p50_{unit}": round(float(p50), 4),
+            f"p95_{unit}": round(float(p95), 4),
+            f"p99_{unit}": round(float(p99), 4),
+            f"max_{unit}": round(float(samples.max()), 4),
+        })
+    if elapsed:
+        result["elapsed_s"] = round(elapsed, 3)
+        result["throughput_per_s"] = round(len(samples) / elapsed, 2)
+    return result
+
+
+def time_calls(fn, repeat: int, inner: int = 100) -> List[float]:
+    """Per-call latency samples, each the mean of `inner` back-to-back calls
+
+    Batching keeps perf_counter overhead out of sub-microsecond timings.
+    """
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(inner):
+            fn()
+        samples.append((time.perf_counter() - started) / inner)
+    return samples
+
+
+def environment() -> Dict[str, str]:
+    """Where the numbers came from; only compare baselines from the same machine"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": str(os.cpu_count()),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_results(path: str, results: Dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2, sort_keys=True)
+
+
+def _flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = 0.2, keys=("p50", "p95", "throughput_per_s", "ops_per_s")) -> List[str]:
+    """Regressions of more than `tolerance` (fractional) against a baseline
+
+    Only median/p95 latencies and throughputs are compared; tails and
+    maxima are too noisy to gate on.
+    """
+    regressions = []
+    now, before = _flatten(current), _flatten(baseline)
+    for name, old in sorted(before.items()):
+        metric = name.rsplit(".", 1)[-1]
+        if name not in now or not old or not any(metric.startswith(key) for key in keys):
+            continue
+        new = now[name]
+        if metric in HIGHER_IS_BETTER:
+            change = (old - new) / old
+        else:
+            change = (new - old) / old
+        if change > tolerance:
+            regressions.append(f"{name}: {old} -> {new} ({change:+.0%} worse)")
+    return regressions
@@ -0,0 +1,80 @@
+# load_rl.py
+
+"""In-process load generator for /rl/next + /rl/update
+
+Simulated students (same response model as qlearning.synthetic) answer
+questions in a loop through the ASGI app, so the numbers cover request
+parsing, the state cache and the Q-learning update but not the network.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+import numpy as np
+
+from qlearning.constants import SUBJECTS, DIFFICULTIES
+from .common import summarize
+
+
+async def run(students: int = 200, questions: int = 20, concurrency: int = 50, seed: int = 0):
+    from qlearning.main import app, user_cache
+
+    np.random.seed(seed)  # choose_action explores with the global RNG
+    rng = np.random.default_rng(seed)
+    skill = rng.normal(0.0, 1.0, size=(students, len(SUBJECTS)))
+    difficulty_offset = np.linspace(-1.0, 1.0, len(DIFFICULTIES))
+    answers = rng.random(size=(students, questions))
+
+    latencies = {"next": [], "update": []}
+    gate = asyncio.Semaphore(concurrency)
+    run_id = int(time.time())
+
+    async def student(client: httpx.AsyncClient, i: int):
+        user_id = f"bench-{run_id}-{i}"
+        for step in range(questions):
+            async with gate:
+                started = time.perf_counter()
+                response = await client.post("/next", json={"user_id": user_id})
+                latencies["next"].append(time.perf_counter() - started)
+                question = response.json()
+
+                logit = skill[i, SUBJECTS.index(question["subject"])] - difficulty_offset[DIFFICULTIES.index(question["difficulty"])]
+                correct = bool(answers[i, step] < 1.0 / (1.0 + np.exp(-logit)))
+
+                started = time.perf_counter()
+                await client.post("/update", json={"user_id": user_id, "correct": correct})
+                latencies["update"].append(time.perf_counter() - started)
+
+    user_cache.start()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(student(client, i) for i in range(students)))
+            elapsed = time.perf_counter() - started
+        flush_started = time.perf_counter()
+        flushed = user_cache.flush()
+        flush_seconds = time.perf_counter() - flush_started
+    finally:
+        user_cache.close()
+
+    return {
+        "next": summarize(latencies["next"], elapsed),
+        "update": summarize(latencies["update"], elapsed),
+        "requests": summarize(latencies["next"] + latencies["update"], elapsed),
+        "flush": {"users": flushed, "elapsed_ms": round(flush_seconds * 1000, 2)},
+        "config": {"students": students, "questions": questions, "concurrency": concurrency, "seed": seed},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive /rl/next and /rl/update for simulated students")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.students, args.questions, args.concurrency, args.seed)), indent=2))
@@ -0,0 +1,132 @@
+# load_ws.py
+
+"""Websocket load generator for /ws/{chat_id}
+
+By default starts the chat service in-process (uvicorn on a free local
+port) with CHATBOT_BACKEND=fake, so the stub embedder, index and LLM stand
+in for Pinecone and Groq and only our own overhead is measured. --url
+points it at an already running server instead. Each question is unique
+unless --distinct limits the pool, which exercises the caches and request
+coalescing.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from .common import summarize
+
+TOPICS = [
+    "osmosis", "the Krebs cycle", "Newton's second law", "covalent bonds", "mitosis",
+    "electromagnetic induction", "enzymes", "the photoelectric effect", "ionic equilibrium", "DNA replication",
+    "projectile motion", "alkenes", "the nephron", "Ohm's law", "chemical kinetics",
+]
+
+
+def question_text(n: int, distinct: int = 0) -> str:
+    n = n % distinct if distinct else n
+    return f"Explain {TOPICS[n % len(TOPICS)]} (question {n})"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class InProcessServer:
+    """main:app served by uvicorn on a background thread"""
+
+    def __init__(self):
+        import uvicorn
+
+        os.environ.setdefault("FAKE_LLM_LATENCY", "0.05")
+        from main import app
+
+        self.port = _free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return f"ws://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+async def run_clients(url: str, chats: int, questions: int, stream: bool, distinct: int = 0):
+    import websockets
+
+    totals, first_tokens, errors, busy = [], [], 0, 0
+    run_id = int(time.time())
+
+    async def chat(i: int):
+        nonlocal errors, busy
+        async with websockets.connect(f"{url}/ws/bench-{run_id}-{i}", max_size=None) as ws:
+            for seq in range(1, questions + 1):
+                started = time.perf_counter()
+                await ws.send(json.dumps({
+                    "question": question_text(i * questions + seq, distinct),
+                    "seq": seq,
+                    "stream": stream,
+                }))
+                first = None
+                while True:
+                    message = json.loads(await ws.recv())
+                    if message["type"] == "answer_delta" and first is None:
+                        first = time.perf_counter() - started
+                    if message["type"] in ("answer", "answer_end", "busy"):
+                        break
+                # Refused by the LLM scheduler; not an answer, so kept out of the latencies
+                if message["type"] == "busy" or message.get("busy"):
+                    busy += 1
+                    continue
+                totals.append(time.perf_counter() - started)
+                if first is not None:
+                    first_tokens.append(first)
+                errors += bool(message.get("error"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(i) for i in range(chats)))
+    elapsed = time.perf_counter() - started
+
+    results = {"answer": summarize(totals, elapsed), "errors": errors, "busy": busy}
+    if first_tokens:
+        results["first_token"] = summarize(first_tokens)
+    return results
+
+
+def run(chats: int = 50, questions: int = 5, stream: bool = True, distinct: int = 0, url: str = None):
+    config = {"chats": chats, "questions": questions, "stream": stream, "distinct": distinct}
+    if url:
+        results = asyncio.run(run_clients(url, chats, questions, stream, distinct))
+    else:
+        # The app logs with print(); keep stdout for the JSON report
+        with contextlib.redirect_stdout(sys.stderr), InProcessServer() as local_url:
+            results = asyncio.run(run_clients(local_url, chats, questions, stream, distinct))
+        # Server-side stage timings from the same process
+        from Metrics import metrics
+        results["server"] = metrics.summary()
+    results["config"] = config
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the chat websocket")
+    parser.add_argument("--chats", type=int, default=50, help="Concurrent chat sockets")
+    parser.add_argument("--questions", type=int, default=5, help="Questions per chat, sent one after another")
+    parser.add_argument("--no-stream", action="store_true", help="Ask for whole answers instead of deltas")
+    parser.add_argument("--distinct", type=int, default=0, help="Size of the question pool (0 = all unique)")
+    parser.add_argument("--url", help="ws://host:port of a running server (default: start one in-process)")
+    args = parser.parse_args()
+    print(json.dumps(run(args.chats, args.questions, not args.no_stream, args.distinct, args.url), indent=2))
@@ -0,0 +1,73 @@
+# micro_rl.py
+
+"""Micro-benchmarks for the per-request Q-learning helpers"""
+
+import argparse
+import json
+
+import numpy as np
+
+from qlearning.constants import SUBJECTS, DIFFICULTIES, ACCURACY_BINS
+from qlearning.models import QuizState, QuizAction
+from qlearning.qlearning_utils import (
+    state_to_2d_index,
+    state_index_from_arrays,
+    calculate_reward,
+    calculate_reward_from_arrays,
+    update_q_table,
+    choose_action,
+    metrics_to_arrays,
+)
+from qlearning.qtable_utils import OverlayQTable
+from .common import summarize, time_calls
+
+STATE_ROWS = ACCURACY_BINS ** len(SUBJECTS)
+STATE_COLS = len(DIFFICULTIES)
+ACTION_SPACE = len(SUBJECTS) * len(DIFFICULTIES)
+
+
+def run(repeat: int = 200, inner: int = 200, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+    shape = (STATE_ROWS, STATE_COLS, ACTION_SPACE)
+
+    keys = [f"{s}_{d}" for s in SUBJECTS for d in DIFFICULTIES]
+    accuracies = {k: float(v) for k, v in zip(keys, rng.random(len(keys)))}
+    attempts = {k: int(v) for k, v in zip(keys, rng.integers(0, 50, len(keys)))}
+    state = QuizState(accuracies=accuracies, current_difficulty="medium", attempts=attempts)
+    action = QuizAction(subject=SUBJECTS[1], difficulty=DIFFICULTIES[2])
+    acc, att = metrics_to_arrays(accuracies, attempts)
+
+    dense = rng.random(shape)
+    prior = rng.random(shape)
+    prior.setflags(write=False)
+    overlay = OverlayQTable(prior, {})
+    indices = state_index_from_arrays(acc, 1)
+    next_indices = state_index_from_arrays(acc, 2)
+
+    cases = {
+        "state_to_2d_index": lambda: state_to_2d_index(state),
+        "state_index_from_arrays": lambda: state_index_from_arrays(acc, 1),
+        "calculate_reward": lambda: calculate_reward(state, action, True),
+        "calculate_reward_from_arrays": lambda: calculate_reward_from_arrays(acc, att, 1, 2, True),
+        "update_q_table_dense": lambda: update_q_table(dense, indices, 5, 1.0, next_indices),
+        "update_q_table_overlay": lambda: update_q_table(overlay, indices, 5, 1.0, next_indices),
+        "choose_action_exploit": lambda: choose_action(dense, indices, acc, att, epsilon=0.0),
+        "choose_action_exploit_subject": lambda: choose_action(dense, indices, acc, att, SUBJECTS[0], epsilon=0.0),
+        "choose_action_explore": lambda: choose_action(dense, indices, acc, att, epsilon=1.0),
+    }
+
+    results = {}
+    for name, fn in cases.items():
+        summary = summarize(time_calls(fn, repeat, inner), unit="us")
+        summary["ops_per_s"] = round(1_000_000 / summary["mean_us"], 1)
+        results[name] = summary
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark qlearning_utils")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--inner", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat, args.inner), indent=2))
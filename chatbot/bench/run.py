@@ -0,0 +1,69 @@
+# run.py
+
+"""Run the benchmark suite and optionally gate on a stored baseline
+
+    python -m bench.run --out bench/results/current.json
+    python -m bench.run --baseline bench/results/baseline.json --tolerance 0.25
+
+Exits with status 1 when a median/p95 latency or a throughput is more than
+--tolerance worse than the baseline. Numbers are only comparable on the
+same hardware, so CI should produce its baseline on the runner that does
+the comparison (e.g. from the target branch) rather than commit one.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+
+from . import micro_rl, load_rl, load_ws
+from .common import compare, write_results
+
+SUITES = ("micro", "rl", "ws")
+
+
+def run(only=SUITES, quick: bool = False) -> dict:
+    results = {}
+    # The services log with print(); keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        if "micro" in only:
+            results["micro_rl"] = micro_rl.run(repeat=30 if quick else 200, inner=50 if quick else 200)
+        if "rl" in only:
+            results["load_rl"] = asyncio.run(load_rl.run(students=40 if quick else 200, questions=5 if quick else 20))
+        if "ws" in only:
+            results["load_ws"] = load_ws.run(chats=10 if quick else 50, questions=2 if quick else 5)
+            # Server-side stage timings are for reading, not for gating
+            results["load_ws"].pop("server", None)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the MDCAT benchmark suite")
+    parser.add_argument("--out", help="Write results (with environment info) to this JSON file")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed fractional regression")
+    parser.add_argument("--quick", action="store_true", help="Smaller runs, for smoke tests")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"Comma-separated subset of {','.join(SUITES)}")
+    args = parser.parse_args()
+
+    only = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(only) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    results = run(only, args.quick)
+    if args.out:
+        write_results(args.out, results)
+    print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against baseline:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against baseline", file=sys.stderr)
@@ -0,0 +1,123 @@
+import json
+import os
+from typing import Dict, Iterator, List
+
+# Curriculum files shipped with the Node backend, keyed by the subject names
+# used in qlearning.constants.SUBJECTS
+CONTENT_FILES = {
+    "biology": "bio_content_data.json",
+    "chemistry": "chem_content_data.json",
+    "physics": "phy_content_data.json",
+    "english": "eng_content_data.json",
+    "logical": "LR_content_data.json",
+}
+
+MCQ_FILES = {
+    "biology": "bio_mcqs_data.json",
+    "physics": "phy_mcqs_data.json",
+}
+
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chatapp", "backend")
+
+
+def iter_subtopics(corpus_dir: str = DEFAULT_CORPUS_DIR) -> Iterator[Dict]:
+    """Yield every subtopic as {"subject", "topic", "subtopic", "content", "path"}
+
+    Files are read one at a time, so only one subject is in memory at once.
+    """
+    for subject, filename in CONTENT_FILES.items():
+        path = os.path.join(corpus_dir, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for t_idx, topic in enumerate(data.get("topics", [])):
+            for s_idx, subtopic in enumerate(topic.get("subtopics", [])):
+                yield {
+                    "subject": subject,
+                    "topic": topic.get("topic_name", ""),
+                    "subtopic": subtopic.get("name", ""),
+                    "content": subtopic.get("content", ""),
+                    "path": f"{subject}/{t_idx}/{s_idx}",
+                }
+
+
+def chunk_text(text: str, max_chars: int = 1000) -> List[str]:
+    """Split text on paragraph boundaries into chunks of at most max_chars
+
+    Paragraphs longer than max_chars are split on whitespace.
+    """
+    chunks, current = [], ""
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        if not paragraph:
+            continue
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def iter_chunks(corpus_dir: str = DEFAULT_CORPUS_DIR, max_chars: int = 1000) -> Iterator[Dict]:
+    """Yield retrievable chunks as {"id", "text", "metadata"}
+
+    Ids are stable for a given file layout: "<subject>/<topic>/<subtopic>#<n>".
+    """
+    for subtopic in iter_subtopics(corpus_dir):
+        for n, text in enumerate(chunk_text(subtopic["content"], max_chars)):
+            yield {
+                "id": f"{subtopic['path']}#{n}",
+                "text": text,
+                "metadata": {
+                    "subject": subtopic["subject"],
+                    "topic": subtopic["topic"],
+                    "subtopic": subtopic["subtopic"],
+                },
+            }
+
+
+def iter_mcqs(corpus_dir: str = DEFAULT_CORPUS_DIR) -> Iterator[Dict]:
+    """Yield every MCQ as {"subject", "index", "question", "options", "correct"}"""
+    for subject, filename in MCQ_FILES.items():
+        path = os.path.join(corpus_dir, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for index, item in enumerate(data):
+            yield {
+                "subject": subject,
+                "index": index,
+                "question": item.get("question", ""),
+                "options": {key: item[key] for key in "ABCD" if key in item},
+                # bio uses "correct", phy uses "Correct"
+                "correct": item.get("correct", item.get("Correct", "")),
+            }
+
+
+def iter_mcq_chunks(corpus_dir: str = DEFAULT_CORPUS_DIR) -> Iterator[Dict]:
+    """Yield one retrievable chunk per MCQ with ids like mcq/<subject>/<index>"""
+    for mcq in iter_mcqs(corpus_dir):
+        options = "\n".join(f"{key}) {value}" for key, value in mcq["options"].items())
+        yield {
+            "id": f"mcq/{mcq['subject']}/{mcq['index']}",
+            "text": f"Question: {mcq['question']}\n{options}\nAnswer: {mcq['correct']}",
+            "metadata": {"subject": mcq["subject"], "topic": "MCQ", "subtopic": ""},
+        }
+
+
+def iter_index_chunks(corpus_dir: str = DEFAULT_CORPUS_DIR, mcqs: bool = True) -> Iterator[Dict]:
+    """Every chunk the local vector store and the BM25 index hold, so their ids match"""
+    yield from iter_chunks(corpus_dir)
+    if mcqs:
+        yield from iter_mcq_chunks(corpus_dir)
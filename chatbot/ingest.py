@@ -0,0 +1,164 @@
+"""Incremental corpus ingestion into the configured vector store.
+
+    python ingest.py --store local --index-dir local_index
+    python ingest.py --store pinecone --pinecone-index mdcat-books
+
+Chunks every subtopic of *_content_data.json (and every MCQ of
+*_mcqs_data.json unless --no-mcqs), hashes each chunk and compares it with
+the manifest from the previous run. Only new or changed chunks are embedded,
+in batches spread over a worker pool; chunks that disappeared are deleted.
+The BM25 index (LexicalIndex) is rebuilt alongside, which needs no embedding.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, Iterable, List
+
+from dotenv import load_dotenv
+
+from corpus import DEFAULT_CORPUS_DIR, iter_index_chunks
+from LexicalIndex import LexicalIndex
+
+
+def chunk_hash(chunk: Dict, embedding_model: str) -> str:
+    """Content hash; changes when the text, metadata or embedding model does"""
+    payload = json.dumps(
+        [embedding_model, chunk["text"], chunk["metadata"]], sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_manifest(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("chunks", {})
+
+
+def save_manifest(path: str, hashes: Dict[str, str], embedding_model: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"embedding_model": embedding_model, "chunks": hashes}, f)
+    os.replace(tmp_path, path)
+
+
+def plan(chunks: Iterable[Dict], manifest: Dict[str, str], embedding_model: str):
+    """Split chunks into (changed chunks, all current hashes, deleted ids)"""
+    changed, hashes = [], {}
+    for chunk in chunks:
+        digest = chunk_hash(chunk, embedding_model)
+        hashes[chunk["id"]] = digest
+        if manifest.get(chunk["id"]) != digest:
+            changed.append(chunk)
+    deleted = [chunk_id for chunk_id in manifest if chunk_id not in hashes]
+    return changed, hashes, deleted
+
+
+def embed_batches(embeddings, chunks: List[Dict], batch_size: int, workers: int) -> List[List[float]]:
+    """Embed chunk texts as documents, batches running concurrently"""
+    batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda batch: embeddings.embed_documents([c["text"] for c in batch]), batches)
+        return list(chain.from_iterable(results))
+
+
+class LocalTarget:
+    def __init__(self, index_dir: str):
+        from LocalVectorStore import LocalVectorStore
+        self.store = LocalVectorStore(index_dir)
+        if self.store.exists():
+            self.store.load()
+
+    def upsert(self, chunks: List[Dict], vectors: List[List[float]]):
+        self.store.upsert(
+            [c["id"] for c in chunks], vectors, [c["text"] for c in chunks], [c["metadata"] for c in chunks]
+        )
+
+    def delete(self, ids: List[str]):
+        self.store.delete(ids)
+
+    def commit(self):
+        self.store.save()
+
+
+class PineconeTarget:
+    def __init__(self, index_name: str, batch_size: int = 100):
+        from pinecone import Pinecone
+        self.index = Pinecone(api_key=os.getenv("PINECONE_API_KEY")).Index(index_name)
+        self.batch_size = batch_size
+
+    def upsert(self, chunks: List[Dict], vectors: List[List[float]]):
+        records = [
+            (c["id"], vector, {**c["metadata"], "text": c["text"]})
+            for c, vector in zip(chunks, vectors)
+        ]
+        for i in range(0, len(records), self.batch_size):
+            self.index.upsert(vectors=records[i:i + self.batch_size])
+
+    def delete(self, ids: List[str]):
+        for i in range(0, len(ids), self.batch_size):
+            self.index.delete(ids=ids[i:i + self.batch_size])
+
+    def commit(self):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incrementally ingest the MDCAT corpus into a vector store")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--store", choices=["local", "pinecone"], default=os.getenv("VECTOR_STORE", "local"))
+    parser.add_argument("--index-dir", default=os.getenv("LOCAL_INDEX_DIR", "local_index"))
+    parser.add_argument("--pinecone-index", default="mdcat-books")
+    parser.add_argument("--lexical-dir", default=os.getenv("LEXICAL_INDEX_DIR"), help="Defaults to --index-dir")
+    parser.add_argument("--manifest", help="Defaults to <index-dir>/manifest.json or manifest-<pinecone-index>.json")
+    parser.add_argument("--embedding-model", default="BAAI/bge-m3")
+    parser.add_argument("--fake", action="store_true", help="Use FakeEmbeddings (no API key needed)")
+    parser.add_argument("--no-mcqs", action="store_true", help="Skip *_mcqs_data.json")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    manifest_path = args.manifest or (
+        os.path.join(args.index_dir, "manifest.json") if args.store == "local"
+        else f"manifest-{args.pinecone_index}.json"
+    )
+    embedding_model = "fake" if args.fake else args.embedding_model
+
+    started = time.perf_counter()
+    chunks = list(iter_index_chunks(args.corpus, mcqs=not args.no_mcqs))
+    manifest = load_manifest(manifest_path)
+    changed, hashes, deleted = plan(chunks, manifest, embedding_model)
+    print(f"{len(hashes)} chunks: {len(changed)} new or changed, {len(deleted)} deleted")
+    if args.dry_run or (not changed and not deleted):
+        return
+
+    if args.fake:
+        from FakeBackends import FakeEmbeddings
+        embeddings = FakeEmbeddings(latency=0.0)
+    else:
+        from langchain_pinecone import PineconeEmbeddings
+        embeddings = PineconeEmbeddings(model=args.embedding_model)
+
+    target = LocalTarget(args.index_dir) if args.store == "local" else PineconeTarget(args.pinecone_index)
+    if changed:
+        target.upsert(changed, embed_batches(embeddings, changed, args.batch_size, args.workers))
+    if deleted:
+        target.delete(deleted)
+    target.commit()
+    LexicalIndex.from_chunks(chunks).save(args.lexical_dir or args.index_dir)
+
+    # Written last so an interrupted run re-embeds instead of skipping chunks
+    save_manifest(manifest_path, hashes, embedding_model)
+    print(f"Ingested in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
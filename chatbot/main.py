@@ -1,55 +1,303 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from langchain_core.prompts import PromptTemplate
-import os, json, uvicorn
+import os, json, time, asyncio, uvicorn
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+
+# Load .env before importing modules that read settings at import time
+load_dotenv()
+
 from groq import Groq
 from GroqLLM import GroqLLM
-from QAChatbot import QAChatbot
+from QAChatbot import QAChatbot, Answer, StageLimits, DEFAULT_STAGE_LIMITS
+from FakeBackends import FakeEmbeddings, FakeIndex, FakeLLM
+from LocalVectorStore import LocalVectorStore, build_from_corpus
+from LexicalIndex import LexicalIndex, build_from_corpus as build_lexical_index
+from EmbeddingCache import EmbeddingCache
+from AnswerCache import SemanticAnswerCache
+from ContextBudget import ContextBudgeter
+from IntentFilter import IntentFilter
 from ConnectionManager import ConnectionManager
-from qlearning.main import app as rl_system
+from ChatSessions import ChatSessionStore
+from Broadcast import broadcast_from_env
+from FeedbackJobs import FeedbackJobs, FeedbackQueueFull
+from LLMScheduler import LLMScheduler, LLMBusy, PriorityClass, DEFAULT_CLASSES
+from Metrics import metrics, MetricsMiddleware
+from qlearning.main import app as rl_system, user_cache as rl_user_cache
 from prompts import QUESTION_ANSWERING_PROMPT, FEEDBACK_PROMPT
 
 
-load_dotenv()
+# "fake" swaps in FakeBackends (no API keys or network) for load testing
+USE_FAKE_BACKENDS = os.getenv("CHATBOT_BACKEND", "pinecone") == "fake"
+
+# "local" retrieves from an in-process index over the shipped curriculum
+# (build it with `python LocalVectorStore.py`); "pinecone" uses mdcat-books
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "local_index")
+LOCAL_INDEX_NPROBE = int(os.getenv("LOCAL_INDEX_NPROBE", "0"))
+
+# Fuse vector search with BM25 over the same chunks (built into
+# LEXICAL_INDEX_DIR on first start, or with `python LexicalIndex.py`).
+# Fusion matches results by chunk id, so it needs the local store; the
+# mdcat-books Pinecone index wasn't built with the corpus chunk ids.
+HYBRID_SEARCH = VECTOR_STORE == "local" and os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", LOCAL_INDEX_DIR)
+
+# Greetings and off-topic messages get canned replies without retrieval or the
+# LLM when the filter is at least INTENT_THRESHOLD sure; INTENT_FILTER=shadow
+# only counts how often that would happen, "off" disables it
+INTENT_FILTER = os.getenv("INTENT_FILTER", "shadow").lower()
+INTENT_THRESHOLD = float(os.getenv("INTENT_THRESHOLD", "0.7"))
+
+# Seconds a chat question waits for the LLM (for streams, its first token)
+# before getting an extractive answer from the retrieved chunks; 0 waits as
+# long as GENERATE_TIMEOUT. With LATE_ANSWERS the generated answer follows
+# as an answer_update message once it is ready.
+ANSWER_DEADLINE = float(os.getenv("ANSWER_DEADLINE", "10"))
+LATE_ANSWERS = os.getenv("LATE_ANSWERS", "true").lower() == "true"
 
 # Set up Groq client
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY is not set in the environment variables")
-if not PINECONE_API_KEY:
-    raise ValueError("PINECONE_API_KEY is not set in the environment variables")
+if USE_FAKE_BACKENDS:
+    llm = FakeLLM(latency=float(os.getenv("FAKE_LLM_LATENCY", "0.5")))
+else:
+    if not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY is not set in the environment variables")
+    if not PINECONE_API_KEY:
+        raise ValueError("PINECONE_API_KEY is not set in the environment variables")
 
-groq_client = Groq(api_key=GROQ_API_KEY)
+    groq_client = Groq(api_key=GROQ_API_KEY)
 
-# Initialize LLM with Groq
-llm = GroqLLM(client=groq_client)
+    # Initialize LLM with Groq
+    llm = GroqLLM(client=groq_client)
 
 QA_PROMPT = PromptTemplate(template=QUESTION_ANSWERING_PROMPT, input_variables=["context", "question"])
 
-qa_chatbot = QAChatbot(llm=llm, prompt=QA_PROMPT)
+# Per-stage concurrency caps and timeouts, e.g. GENERATE_CONCURRENCY=4, EMBED_TIMEOUT=5
+STAGE_LIMITS = {
+    stage: StageLimits(
+        concurrency=int(os.getenv(f"{stage.upper()}_CONCURRENCY", limits.concurrency)),
+        timeout=float(os.getenv(f"{stage.upper()}_TIMEOUT", limits.timeout)),
+    )
+    for stage, limits in DEFAULT_STAGE_LIMITS.items()
+}
+
+# Every LLM call, chat answers and quiz feedback alike, takes one of
+# LLM_CONCURRENCY slots, chat first. Per class ("chat", "feedback"), e.g.
+# CHAT_LLM_RATE / CHAT_LLM_BURST: per-user calls per second and bucket size
+# (rate 0 disables), CHAT_LLM_QUEUE / CHAT_LLM_WAIT: most calls waiting and
+# seconds each may wait, FEEDBACK_LLM_SHARE: fraction of slots it may use.
+# LLM_SCHEDULER=off leaves only GENERATE_CONCURRENCY and FEEDBACK_WORKERS.
+# The websocket has no authenticated user, so the chat "user" is the chat_id
+# and the chat limits apply per chat; feedback is limited per quiz owner.
+llm_scheduler = LLMScheduler(
+    concurrency=int(os.getenv("LLM_CONCURRENCY", "8")),
+    classes={
+        name: PriorityClass(
+            priority=cls.priority,
+            share=float(os.getenv(f"{name.upper()}_LLM_SHARE", cls.share)),
+            max_queue=int(os.getenv(f"{name.upper()}_LLM_QUEUE", cls.max_queue)),
+            max_wait=float(os.getenv(f"{name.upper()}_LLM_WAIT", cls.max_wait)),
+            rate=float(os.getenv(f"{name.upper()}_LLM_RATE", cls.rate)),
+            burst=int(os.getenv(f"{name.upper()}_LLM_BURST", cls.burst)),
+        )
+        for name, cls in DEFAULT_CLASSES.items()
+    },
+) if os.getenv("LLM_SCHEDULER", "on").lower() != "off" else None
+
+# Repeated questions skip the embedding call; set EMBEDDING_CACHE_PATH to
+# keep embeddings across restarts
+embedding_cache = EmbeddingCache(
+    max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+    path=os.getenv("EMBEDDING_CACHE_PATH"),
+)
+
+# Near-duplicate questions answered from the same context reuse the answer
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    max_size=int(os.getenv("ANSWER_CACHE_SIZE", "2000")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    enabled=os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true",
+)
+
+qa_chatbot = QAChatbot(
+    llm=llm,
+    prompt=QA_PROMPT,
+    stage_limits=STAGE_LIMITS,
+    max_workers=int(os.getenv("QA_MAX_WORKERS", "32")),
+    embedding_cache=embedding_cache,
+    answer_cache=answer_cache,
+    candidate_k=int(os.getenv("HYBRID_CANDIDATES", "20")),
+    rrf_k=int(os.getenv("RRF_K", "60")),
+    coalesce=os.getenv("COALESCE_REQUESTS", "true").lower() == "true",
+    # Cache misses arriving within EMBED_BATCH_WAIT_MS share one embedding
+    # call of up to EMBED_BATCH_SIZE queries (1 disables batching). Batches
+    # can't exceed EMBED_CONCURRENCY, which bounds queries in the embed stage.
+    embed_batch_size=int(os.getenv("EMBED_BATCH_SIZE", "16")),
+    embed_batch_wait=float(os.getenv("EMBED_BATCH_WAIT_MS", "5")) / 1000,
+    answer_deadline=ANSWER_DEADLINE or None,
+    scheduler=llm_scheduler,
+    # Prompt size stays bounded however long the conversation gets
+    budgeter=ContextBudgeter(
+        max_prompt_tokens=int(os.getenv("PROMPT_TOKEN_BUDGET", "3000")),
+        max_turns=int(os.getenv("HISTORY_TURNS", "6")),
+    ),
+)
+
+# Set CHAT_SESSION_PATH to keep chat sessions across restarts
+manager = ConnectionManager(
+    ChatSessionStore(
+        max_turns=int(os.getenv("CHAT_SESSION_TURNS", "20")),
+        idle_timeout=float(os.getenv("CHAT_SESSION_IDLE", "1800")),
+        max_sessions=int(os.getenv("CHAT_SESSION_MAX", "10000")),
+        path=os.getenv("CHAT_SESSION_PATH"),
+    ),
+    # With several uvicorn workers use BROADCAST_BACKEND=unix (one machine)
+    # or redis (REDIS_URL), so answers reach sockets held by other workers
+    broadcast=broadcast_from_env(
+        os.getenv("BROADCAST_BACKEND", "memory"),
+        socket_path=os.getenv("BROADCAST_SOCKET", "/tmp/mdcat-broadcast.sock"),
+        redis_url=os.getenv("REDIS_URL", "redis://localhost:6379"),
+    ),
+    max_queue=int(os.getenv("WS_SEND_QUEUE", "256")),
+)
 
-manager = ConnectionManager()
+# Quiz feedback runs on its own small worker pool; identical quizzes share one job
+feedback_jobs = FeedbackJobs(
+    llm,
+    FEEDBACK_PROMPT,
+    workers=int(os.getenv("FEEDBACK_WORKERS", "4")),
+    max_queue=int(os.getenv("FEEDBACK_QUEUE", "500")),
+    timeout=float(os.getenv("FEEDBACK_TIMEOUT", "60")),
+    batch_size=int(os.getenv("FEEDBACK_BATCH", "8")),
+    ttl=float(os.getenv("FEEDBACK_TTL", "86400")),
+    scheduler=llm_scheduler,
+)
+# Seconds POST /llm/feedback waits for a result before answering 202 with a
+# job id; most feedback is ready within this, so clients rarely need to poll
+FEEDBACK_WAIT = float(os.getenv("FEEDBACK_WAIT", "20"))
+FEEDBACK_MAX_WAIT = 30.0
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Starting up...")
-    status = qa_chatbot.setup(
-        pinecone_api_key=PINECONE_API_KEY,
-        index_name="mdcat-books",
-        embedding_model="BAAI/bge-m3"
-    )
+    if HYBRID_SEARCH:
+        qa_chatbot.lexical_index = (
+            LexicalIndex.load(LEXICAL_INDEX_DIR) if LexicalIndex.exists(LEXICAL_INDEX_DIR)
+            else build_lexical_index(LEXICAL_INDEX_DIR)
+        )
+    if INTENT_FILTER != "off":
+        settings = {"threshold": INTENT_THRESHOLD, "shadow": INTENT_FILTER == "shadow"}
+        qa_chatbot.intent_filter = (
+            IntentFilter.from_lexical_index(qa_chatbot.lexical_index, **settings) if qa_chatbot.lexical_index
+            else IntentFilter.from_corpus(**settings)
+        )
+    if USE_FAKE_BACKENDS:
+        index = FakeIndex()
+        if VECTOR_STORE == "local":
+            store = LocalVectorStore(LOCAL_INDEX_DIR)
+            index = store.load(LOCAL_INDEX_NPROBE) if store.exists() else build_from_corpus(
+                LOCAL_INDEX_DIR, FakeEmbeddings(latency=0.0)
+            )
+        status = qa_chatbot.setup_backends(FakeEmbeddings(), index)
+    else:
+        status = qa_chatbot.setup(
+            pinecone_api_key=PINECONE_API_KEY,
+            index_name="mdcat-books",
+            embedding_model="BAAI/bge-m3",
+            local_index_dir=LOCAL_INDEX_DIR if VECTOR_STORE == "local" else None,
+            nprobe=LOCAL_INDEX_NPROBE,
+        )
     print(f"Startup initialization: {status}")
+    lexical_index = qa_chatbot.lexical_index
+    if lexical_index is not None and set(lexical_index.ids) != set(getattr(qa_chatbot.index, "ids", ())):
+        # e.g. a local index built before it included the MCQ chunks
+        print(f"Hybrid search disabled: the BM25 index in {LEXICAL_INDEX_DIR} and the vector store in {LOCAL_INDEX_DIR} hold different chunks; rebuild them")
+        qa_chatbot.lexical_index = None
+    # Mounted apps don't get lifespan events, so drive the RL cache from here
+    rl_user_cache.start()
+    await manager.start()
+    await feedback_jobs.start()
     
     yield
     
     print("Shutting down...")
+    for task in late_answer_tasks:
+        task.cancel()
+    await feedback_jobs.close()
+    await manager.close()
+    qa_chatbot.close()
+    rl_user_cache.close()
 
 app = FastAPI(lifespan=lifespan)
 app.mount("/rl", rl_system)
+# Times every HTTP request, /rl/* included, by route template
+app.add_middleware(MetricsMiddleware, registry=metrics)
+
+metrics.describe("stage", "Time spent in one stage of answering a question")
+metrics.describe("stage_wait", "Time a stage waited for its concurrency slot and an executor thread")
+metrics.describe("request", "End-to-end time to answer a chat question")
+metrics.describe("http_request", "HTTP request handling time")
+metrics.describe("answer_fallbacks", "Extractive answers sent because generation missed its deadline or failed")
+metrics.describe("late_answers", "Generated answers that finished after an extractive fallback was sent")
+metrics.describe("llm_wait", "Time an LLM call waited for a scheduler slot")
+metrics.describe("llm_rejections", "LLM calls refused by the scheduler")
+metrics.gauge("websocket_connections", "Open chat websockets", lambda: [({}, manager.connection_count())])
+metrics.gauge("websocket_send_queue", "Messages queued for websockets", lambda: [
+    ({"agg": "sum"}, sum(c.queue.qsize() for conns in manager.active_connections.values() for c in conns)),
+    ({"agg": "max"}, max((c.queue.qsize() for conns in manager.active_connections.values() for c in conns), default=0)),
+])
+metrics.gauge("websocket_dropped_total", "Websockets closed for falling behind",
+              lambda: [({}, manager.dropped_connections)], kind="counter")
+metrics.gauge("stage_in_flight", "Requests waiting for or running in each stage",
+              lambda: [({"stage": stage}, count) for stage, count in qa_chatbot.in_flight.items()])
+metrics.gauge("chat_sessions", "Chat sessions held in memory", lambda: [({}, manager.sessions.stats()["sessions"])])
+metrics.gauge("cache_lookups_total", "Cache lookups by cache and result", lambda: [
+    ({"cache": "embedding", "result": "hit"}, embedding_cache.hits),
+    ({"cache": "embedding", "result": "miss"}, embedding_cache.misses),
+    ({"cache": "answer", "result": "hit"}, answer_cache.hits),
+    ({"cache": "answer", "result": "miss"}, answer_cache.misses),
+    ({"cache": "rl_state", "result": "hit"}, rl_user_cache.hits),
+    ({"cache": "rl_state", "result": "miss"}, rl_user_cache.misses),
+    ({"cache": "feedback", "result": "hit"}, feedback_jobs.hits),
+    ({"cache": "feedback", "result": "miss"}, feedback_jobs.misses),
+], kind="counter")
+metrics.gauge("cache_hit_ratio", "Share of cache lookups that hit", lambda: [
+    ({"cache": name}, hits / (hits + misses) if hits + misses else 0.0)
+    for name, hits, misses in (
+        ("embedding", embedding_cache.hits, embedding_cache.misses),
+        ("answer", answer_cache.hits, answer_cache.misses),
+        ("rl_state", rl_user_cache.hits, rl_user_cache.misses),
+        ("feedback", feedback_jobs.hits, feedback_jobs.misses),
+    )
+])
+metrics.gauge("cache_entries", "Entries held per cache", lambda: [
+    ({"cache": "embedding"}, embedding_cache.stats()["size"]),
+    ({"cache": "answer"}, answer_cache.stats()["size"]),
+    ({"cache": "rl_state"}, rl_user_cache.stats()["size"]),
+])
+metrics.gauge("rl_dirty_users", "RL users with changes not yet flushed", lambda: [({}, rl_user_cache.stats()["dirty"])])
+metrics.gauge("feedback_jobs", "Quiz feedback jobs by status", lambda: [
+    ({"status": status}, feedback_jobs.stats()[status]) for status in ("queued", "running", "done", "failed")
+])
+metrics.gauge("embedding_batches_total", "Batched embedding calls and the queries they carried", lambda: [
+    ({"count": "batches"}, qa_chatbot.embedding_batcher.batches),
+    ({"count": "queries"}, qa_chatbot.embedding_batcher.texts),
+] if qa_chatbot.embedding_batcher else [], kind="counter")
+metrics.gauge("intent_decisions_total", "Intent filter decisions (shadowed = would have replied in shadow mode)", lambda: [
+    ({"decision": decision}, count) for decision, count in qa_chatbot.intent_filter.stats().items()
+] if qa_chatbot.intent_filter else [], kind="counter")
+metrics.gauge("llm_slots", "LLM calls running and waiting for a slot, by class", lambda: [
+    ({"class": name, "state": state}, stats[state])
+    for name, stats in llm_scheduler.stats().items() for state in ("active", "queued")
+] if llm_scheduler else [])
+metrics.gauge("coalesced_requests_total", "Requests that joined an identical in-flight request", lambda: [
+    ({}, qa_chatbot.single_flight.stats()["shared"] if qa_chatbot.single_flight else 0)
+], kind="counter")
 
 # Configure CORS
 app.add_middleware(
@@ -64,42 +312,237 @@ app.add_middleware(
 async def root():
     return {"message": "MDCAT Assistant API is running"}    
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def busy_response(message: str, retry_after: int, **fields):
+    return JSONResponse(
+        {"status": "busy", "message": message, "retryAfter": retry_after, **fields},
+        status_code=503,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+def feedback_response(job):
+    """200 with the feedback, 202 while it is being generated, 502 if it failed, 503 if the LLM was too busy"""
+    if job.status == "failed" and job.retry_after is not None:
+        return busy_response(job.error, job.retry_after, jobId=job.id)
+    status_code = {"done": 200, "failed": 502}.get(job.status, 202)
+    return JSONResponse(job.to_dict(), status_code=status_code)
+
 @app.post("/llm/feedback")
-async def generateFeedback(quiz: Request):
+async def generateFeedback(quiz: Request, wait: float = FEEDBACK_WAIT):
+    """Start (or join) feedback generation for a quiz
+
+    Posting the same quiz again returns the stored feedback or the job
+    already running, so clients can poll by re-posting or via
+    GET /llm/feedback/{job_id}. ``wait`` holds the request open for up to
+    that many seconds in case the feedback is quick.
+    """
     body = await quiz.json()
-    prompt = FEEDBACK_PROMPT.format(body=body)
-    feedback = llm.invoke(FEEDBACK_PROMPT)
-    print(feedback)
-    return { "feedback": feedback }
+    try:
+        job = feedback_jobs.submit(body)
+    except FeedbackQueueFull:
+        return busy_response("Too many feedback requests, try again shortly", 10)
+    except LLMBusy as e:
+        return busy_response(e.message, e.retry_after)
+    await feedback_jobs.wait(job, min(wait, FEEDBACK_MAX_WAIT))
+    return feedback_response(job)
+
+@app.get("/llm/feedback/{job_id}")
+async def getFeedback(job_id: str, wait: float = 0):
+    job = feedback_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"status": "unknown", "message": "No such feedback job"}, status_code=404)
+    await feedback_jobs.wait(job, min(wait, FEEDBACK_MAX_WAIT))
+    return feedback_response(job)
+
+async def aiter_once(value):
+    yield value
+
+async def stream_answer(
+    chat_id: str, question: str, chat_history: list, bypass_cache: bool = False, subject: str = None, seq: int = None
+) -> Answer:
+    """Send an answer as answer_start, answer_delta chunks and answer_end; returns the answer"""
+    started = time.perf_counter()
+    await manager.send_message_to_chat(chat_id, {
+        "type": "answer_start",
+        "question": question,
+        "seq": seq,
+    })
+
+    chunks, sources, error = [], [], None
+    retrieved_at = first_token_at = canned = late = retry_after = None
+    kind = "stream"
+    try:
+        canned = qa_chatbot.canned_answer(question, chat_history)
+        if canned is not None:
+            kind = "canned"
+            deltas = aiter_once(canned)
+        else:
+            query_embedding, search_results = await qa_chatbot.aretrieve(
+                qa_chatbot.retrieval_query(question, chat_history), subject
+            )
+            sources = [{**result.metadata, "score": result.score} for result in search_results]
+            retrieved_at = time.perf_counter()
+
+            cached = qa_chatbot.cached_answer(query_embedding, search_results, bypass_cache, chat_history)
+            if cached is not None:
+                deltas = aiter_once(cached)
+            else:
+                deltas = qa_chatbot.astream_answer(question, query_embedding, search_results, chat_history, chat_id)
+                deltas, fallback, late = await qa_chatbot.astream_by_deadline(deltas, question, search_results, started)
+                if fallback:
+                    kind = "fallback"
+
+        async for delta in deltas:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks.append(delta)
+            await manager.send_message_to_chat(chat_id, {
+                "type": "answer_delta",
+                "delta": delta,
+                "seq": seq,
+            })
+    except LLMBusy as e:
+        error, kind, retry_after = e.message, "busy", e.retry_after
+    except ValueError as e:
+        error = str(e)
+    except Exception as e:
+        error = f"Error getting answer: {str(e)}"
+
+    finished = time.perf_counter()
+    answer = error or "".join(chunks).strip()
+    metrics.observe("request", finished - started, {"kind": kind})
+    if error and kind != "busy":
+        metrics.inc("errors", {"where": "stream"})
+    await manager.send_message_to_chat(chat_id, {
+        "type": "answer_end",
+        "question": question,
+        "seq": seq,
+        "answer": answer,
+        "error": error is not None,
+        "fallback": kind == "fallback",
+        "pending": late is not None and LATE_ANSWERS,
+        "busy": kind == "busy",
+        "retryAfter": retry_after,
+        "sources": sources,
+        "timing": {
+            "retrieval_ms": round((retrieved_at - started) * 1000, 1) if retrieved_at else None,
+            "first_token_ms": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+            "total_ms": round((finished - started) * 1000, 1),
+        },
+    })
+    if kind == "busy":
+        return Answer(answer, kind, retry_after=retry_after)
+    return Answer(answer, "error" if error else kind, late)
+
+# Pushes of generated answers that missed their deadline, kept referenced until done
+late_answer_tasks = set()
+
+async def push_late_answer(chat_id: str, session, seq: int, question: str, fallback: Answer):
+    """Send the generated answer behind a fallback as answer_update, or the fallback again if generation failed"""
+    try:
+        answer, error = await fallback.late, False
+    except Exception:
+        answer, error = fallback.text, True
+    if not error:
+        manager.sessions.revise(session, seq, answer)
+    await manager.send_message_to_chat(chat_id, {
+        "type": "answer_update",
+        "question": question,
+        "seq": seq,
+        "answer": answer,
+        "error": error,
+    })
 
 @app.websocket("/ws/{chat_id}")
 async def websocket_endpoint(websocket: WebSocket, chat_id: str):
-    await manager.connect(websocket, chat_id)
+    connection = await manager.connect(websocket, chat_id)
     try:
         while True:
             data = await websocket.receive_text()
             message_data = json.loads(data)
             
             question = message_data.get("question", "").strip()
-            chatHistory = message_data.get("chatHistory", [])
-            chatHistory = "\n".join(
-                [f"{msg['sender']}: {msg['content']}" for msg in chatHistory]
-            )
-            chatHistory += f"\nCurrent User Message: {question}"
-            
-            if question:
-                answer = qa_chatbot.get_answer(question=chatHistory)
-                await manager.send_message_to_chat(chat_id, {
-                    "type": "answer",
-                    "question": question,
-                    "answer": answer,
+            if not question:
+                continue
+
+            # The server keeps the chat history; clients send the question and
+            # seq (its number of user messages so far, counting this one).
+            # A client-sent chatHistory is still accepted and reseeds the session.
+            session = manager.session(chat_id)
+            if "chatHistory" in message_data:
+                session.replace(message_data.get("chatHistory") or [])
+            seq = message_data.get("seq")
+            try:
+                seq = session.last_seq + 1 if seq is None else int(seq)
+            except (TypeError, ValueError):
+                seq = 0
+            if seq < 1:
+                connection.offer({"type": "error", "message": "seq must be a positive integer", "question": question})
+                continue
+            # duplicate and session_reset concern only the socket that sent
+            # the message, not the chat's other tabs
+            if seq <= session.last_seq:
+                if question in (session.pending.get(seq), session.last_question()):
+                    # Resent after a reconnect; already answered or being answered
+                    connection.offer({"type": "duplicate", "question": question, "seq": seq})
+                    continue
+                # Another tab of the same chat that hasn't seen the latest turns
+                seq = session.last_seq + 1
+            if seq > session.last_seq + 1 and "chatHistory" not in message_data:
+                # Session was evicted or lost in a restart; the client can
+                # resend chatHistory once to restore context
+                connection.offer({
+                    "type": "session_reset",
+                    "seq": seq,
+                    "expectedSeq": session.last_seq + 1,
                 })
+            # Retrieval uses the question alone; history only shapes the prompt
+            chatHistory = session.history()
+            manager.sessions.reserve(session, seq, question)
+
+            bypass_cache = bool(message_data.get("bypassCache"))
+            # Optional, restricts retrieval to one subject's chunks
+            subject = message_data.get("subject") or None
+            if message_data.get("stream"):
+                result = await stream_answer(chat_id, question, chatHistory, bypass_cache, subject, seq)
+            else:
+                result = await qa_chatbot.aanswer(
+                    question=question, bypass_cache=bypass_cache, subject=subject, chat_history=chatHistory,
+                    user=chat_id,
+                )
+                if result.kind == "busy":
+                    reply = {"type": "busy", "message": result.text, "retryAfter": result.retry_after}
+                else:
+                    reply = {
+                        "type": "answer",
+                        "answer": result.text,
+                        # pending: an answer_update with the generated answer follows
+                        "fallback": result.kind == "fallback",
+                        "pending": result.late is not None and LATE_ANSWERS,
+                    }
+                await manager.send_message_to_chat(chat_id, {**reply, "question": question, "seq": seq})
+            if result.kind == "busy":
+                # Not recorded, so the client can send the same question and seq again
+                manager.sessions.release(session, seq)
+                continue
+            manager.sessions.record(session, seq, question, result.text)
+            if result.late is not None and LATE_ANSWERS:
+                task = asyncio.create_task(push_late_answer(chat_id, session, seq, question, result))
+                late_answer_tasks.add(task)
+                task.add_done_callback(late_answer_tasks.discard)
     except WebSocketDisconnect:
-        manager.disconnect(chat_id)
+        pass
 
     except Exception as e:
+        metrics.inc("errors", {"where": "websocket"})
         print(f"Error: {e}")
 
+    finally:
+        manager.disconnect(chat_id, connection)
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
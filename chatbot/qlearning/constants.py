@@ -1,3 +1,5 @@
+import os
+
 # Subject and difficulty configurations
 SUBJECTS = ["biology", "physics", "chemistry", "logical", "english"]
 DIFFICULTIES = ["easy", "medium", "hard"]
@@ -13,3 +15,12 @@ ACCURACY_DECAY = 0.1
 MASTERY_THRESHOLD = 0.7  # Required accuracy to consider a difficulty level mastered
 STRUGGLE_THRESHOLD = 0.4  # Accuracy below this suggests difficulty should decrease
 MINIMUM_ATTEMPTS = 5  # Minimum attempts before considering difficulty change
+
+# User state storage and caching
+RL_STORE = os.getenv("RL_STORE", "mongo")  # "mongo" or "sqlite:///path/to.db"
+RL_CACHE_SIZE = int(os.getenv("RL_CACHE_SIZE", "10000"))  # Users kept decoded in memory
+RL_FLUSH_INTERVAL = float(os.getenv("RL_FLUSH_INTERVAL", "5.0"))  # Seconds between write-behind flushes
+RL_WRITE_MODE = os.getenv("RL_WRITE_MODE", "write-behind")  # "write-behind" or "write-through"
+RL_PRIOR_PATH = os.getenv("RL_PRIOR_PATH")  # Shared prior Q-table (.npy), e.g. from qlearning.offline
+RL_PRIOR_EPSILON = float(os.getenv("RL_PRIOR_EPSILON", "0.3"))  # Starting epsilon for new users when a prior is loaded
+RL_QUESTION_BANK = os.getenv("RL_QUESTION_BANK", "none")  # mongoexport files of the questions collection (comma-separated); "shipped" = Node MCQ files (no ObjectIds, can't be saved as quizzes); "none" = off
@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional, Any, List
+from .constants import RL_STORE
+
+
+class MongoUserStore:
+    """User progress documents in the MongoDB `user-progress` collection."""
+
+    def __init__(self, uri: str):
+        from pymongo.mongo_client import MongoClient
+        from pymongo.server_api import ServerApi
+        from bson import ObjectId
+
+        self._object_id = ObjectId
+        client = MongoClient(uri, server_api=ServerApi("1"))
+        self.users_collection = client["test"]["user-progress"]
+
+    def load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self.users_collection.find_one({"user_id": self._object_id(user_id)})
+
+    def save(self, user_id: str, fields: Dict[str, Any], unset: List[str] = ()) -> None:
+        """Apply `fields` with $set semantics, creating the document if needed."""
+        update = {"$set": fields}
+        if unset:
+            update["$unset"] = {key: "" for key in unset}
+        self.users_collection.update_one(
+            {"user_id": self._object_id(user_id)}, update, upsert=True
+        )
+
+
+class SQLiteUserStore:
+    """Local stand-in for MongoUserStore, storing each document as JSON."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_progress (user_id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM user_progress WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, user_id: str, fields: Dict[str, Any], unset: List[str] = ()) -> None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM user_progress WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            doc = json.loads(row[0]) if row else {"user_id": user_id}
+            for key, value in fields.items():
+                # Dotted keys update nested fields, as with MongoDB's $set
+                *parents, leaf = key.split(".")
+                target = doc
+                for part in parents:
+                    target = target.setdefault(part, {})
+                target[leaf] = value
+            for key in unset:
+                doc.pop(key, None)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO user_progress (user_id, data) VALUES (?, ?)",
+                (user_id, json.dumps(doc)),
+            )
+            self._conn.commit()
+
+
+_store = None
+
+def get_store():
+    """Resolve the configured store lazily so .env values are honoured.
+
+    RL_STORE is either "mongo" (uses MONGO_URI) or "sqlite:///path/to.db".
+    """
+    global _store
+    if _store is None:
+        if RL_STORE.startswith("sqlite:///"):
+            _store = SQLiteUserStore(RL_STORE[len("sqlite:///"):])
+        else:
+            uri = os.getenv("MONGO_URI")
+            if not uri:
+                raise ValueError("MONGO_URI is not set in the environment variables")
+            _store = MongoUserStore(uri)
+    return _store
+
+def new_user_data() -> Dict[str, Any]:
+    """Default progress document for a user seen for the first time."""
+    return {
+        "accuracies": {},
+        "attempts": {},
+        "q_cells": {},
+        "epsilon": 1.0,
+        "iteration": 1
+    }
@@ -1,162 +1,267 @@
 # main.py
 
 from fastapi import FastAPI, HTTPException
-from .models import FeedbackRequest, QuizState, NextQuestionRequest, QuizAction
-from .db_utils import get_user_data, update_user_data
+from contextlib import asynccontextmanager
+from .models import FeedbackRequest, NextQuestionRequest, NextBatchRequest, BatchFeedbackRequest
+from .state_cache import UserStateCache
+from .question_bank import load_bank
+from .qtable_utils import cell_index, load_prior
 from .qlearning_utils import (
-    state_to_2d_index,
-    action_to_index,
-    calculate_reward,
+    state_index_from_arrays,
+    calculate_reward_from_arrays,
     update_q_table,
-    update_metrics,
-    choose_action
+    update_metrics_arrays,
+    choose_action,
+    decay_epsilon,
+    get_difficulty_level,
+    arrays_to_metrics
 )
 import numpy as np
-from .constants import SUBJECTS, DIFFICULTIES, ACCURACY_BINS
+from .constants import (
+    SUBJECTS,
+    DIFFICULTIES,
+    ACCURACY_BINS,
+    RL_CACHE_SIZE,
+    RL_FLUSH_INTERVAL,
+    RL_WRITE_MODE,
+    RL_PRIOR_PATH,
+    RL_PRIOR_EPSILON,
+    RL_QUESTION_BANK
+)
 from typing import Dict, Any
 
-app = FastAPI(title="Adaptive Quiz System", 
-             description="An intelligent quiz system that adapts to user performance using Q-Learning")
-
 # Calculate state space dimensions
 STATE_ROWS = ACCURACY_BINS ** len(SUBJECTS)  # For all subjects
 STATE_COLS = len(DIFFICULTIES)  # For difficulty levels
 ACTION_SPACE = len(SUBJECTS) * len(DIFFICULTIES)
 
-@app.post("/next")
-async def get_next_question(request: NextQuestionRequest):
-    """Select the next question using 2D state representation."""
-    # Get user data
-    user_data = get_user_data(request.user_id, STATE_ROWS, STATE_COLS, ACTION_SPACE)
-    accuracies = user_data["accuracies"]
-    attempts = user_data.get("attempts", {})
-    q_table = np.array(user_data["q_table"])
-    
-    last_question = user_data.get("last_question", {})
-    current_difficulty = last_question.get("difficulty", "easy")
-    epsilon = user_data.get("epsilon", 1.0)
-    
-    # Create QuizState and get 2D state indices
-    state = QuizState(
-        accuracies=accuracies,
-        attempts=attempts,
-        current_difficulty=current_difficulty
-    )
-    state_indices = state_to_2d_index(state)
+# Largest quiz /next-batch will plan in one call
+MAX_BATCH_SIZE = 100
+
+# MCQs by (subject, difficulty), so /next can hand out a concrete question
+question_bank = load_bank(RL_QUESTION_BANK)
+
+# Decoded user state shared by all handlers; see state_cache.UserStateCache.
+# Every user's Q-table reads through the shared prior, if one is configured.
+user_cache = UserStateCache(
+    shape=(STATE_ROWS, STATE_COLS, ACTION_SPACE),
+    max_size=RL_CACHE_SIZE,
+    flush_interval=RL_FLUSH_INTERVAL,
+    write_mode=RL_WRITE_MODE,
+    prior=load_prior(RL_PRIOR_PATH, (STATE_ROWS, STATE_COLS, ACTION_SPACE)),
+    prior_epsilon=RL_PRIOR_EPSILON if RL_PRIOR_PATH else None,
+    question_bank=question_bank,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mounted sub-apps don't receive lifespan events, so the parent app
+    # must also call user_cache.start()/close() when serving /rl.
+    user_cache.start()
+    yield
+    user_cache.close()
+
+app = FastAPI(title="Adaptive Quiz System", 
+             description="An intelligent quiz system that adapts to user performance using Q-Learning",
+             lifespan=lifespan)
+
+def select_question(user_state, current_subject=None, state_indices=None, exclude=()):
+    """Run choose_action for a user; returns the selection and its metrics.
+
+    ``exclude`` lists action indices exploitation should pass over.
+
+    With a question bank the selection includes an unseen question of the
+    chosen subject and difficulty (marked seen), or None if the bank has
+    none for it and the client has to fetch one itself.
+    """
+    accuracies = user_state.accuracies
+    attempts = user_state.attempts
+
+    if state_indices is None:
+        last_question = user_state.last_question or {}
+        current_difficulty = last_question.get("difficulty", "easy")
+        state_indices = state_index_from_arrays(accuracies, get_difficulty_level(current_difficulty))
 
-    # Choose next question
     subject, difficulty, exploration = choose_action(
-        q_table,
+        user_state.q_table,
         state_indices,
         accuracies,
         attempts,
-        request.current_subject,
-        epsilon
+        current_subject,
+        user_state.epsilon,
+        exclude
     )
 
-    # Save the selected question
-    update_user_data(
-        request.user_id,
-        accuracies=accuracies,
-        attempts=attempts,
-        q_table=q_table,
-        last_question={"subject": subject, "difficulty": difficulty},
-    )
+    question = None
+    if user_state.seen_questions is not None:
+        question = question_bank.pick(user_state.seen_questions, subject, difficulty)
 
+    subject_idx, diff_idx = SUBJECTS.index(subject), get_difficulty_level(difficulty)
     return {
         "subject": subject,
         "difficulty": difficulty,
+        "question": dict(question) if question else None,
         "exploration": exploration,
         "metrics": {
-            "current_accuracy": accuracies.get(f"{subject}_{difficulty}", 0.0),
-            "total_attempts": attempts.get(f"{subject}_{difficulty}", 0)
+            "current_accuracy": float(accuracies[subject_idx, diff_idx]),
+            "total_attempts": int(attempts[subject_idx, diff_idx])
         }
     }
 
-@app.post("/update")
-async def update_state(request: FeedbackRequest):
-    """Update Q-table and metrics using 2D state representation."""
-    user_data = get_user_data(request.user_id, STATE_ROWS, STATE_COLS, ACTION_SPACE)
-    accuracies = user_data["accuracies"]
-    attempts = user_data.get("attempts", {})
-    q_table = np.array(user_data["q_table"])
-    last_question = user_data.get("last_question")
+def planned(selection) -> Dict[str, str]:
+    """What is remembered about a served question until its answer arrives."""
+    question = {"subject": selection["subject"], "difficulty": selection["difficulty"]}
+    if selection["question"]:
+        question["question_id"] = selection["question"]["_id"]
+    return question
 
-    if not last_question:
-        raise HTTPException(
-            status_code=400,
-            detail="No previous question found for this user"
-        )
+def apply_answer(user_state, question: Dict[str, str], correct: bool) -> Dict[str, Any]:
+    """Update metrics and Q-table for an answer to `question`."""
+    accuracies = user_state.accuracies
+    attempts = user_state.attempts
+    q_table = user_state.q_table
 
-    # Create state and action objects
-    state = QuizState(
-        accuracies=accuracies,
-        attempts=attempts,
-        current_difficulty=last_question["difficulty"]
-    )
-    action = QuizAction(
-        subject=last_question["subject"],
-        difficulty=last_question["difficulty"]
-    )
+    subject = question["subject"]
+    difficulty = question["difficulty"]
+    subject_idx = SUBJECTS.index(subject)
+    diff_idx = get_difficulty_level(difficulty)
 
     # Get state indices and action index
-    current_state_indices = state_to_2d_index(state)
-    action_idx = action_to_index(action)
+    current_state_indices = state_index_from_arrays(accuracies, diff_idx)
+    action_idx = subject_idx * len(DIFFICULTIES) + diff_idx
 
     # Calculate reward
-    reward = calculate_reward(state, action, request.correct)
+    reward = calculate_reward_from_arrays(accuracies, attempts, subject_idx, diff_idx, correct)
 
-    # Update metrics
-    accuracies, attempts = update_metrics(accuracies, attempts, action, request.correct)
+    # Update metrics in place and encode the resulting state
+    update_metrics_arrays(accuracies, attempts, subject_idx, diff_idx, correct)
+    new_state_indices = state_index_from_arrays(accuracies, diff_idx)
 
-    # Create new state with updated metrics
-    new_state = QuizState(
-        accuracies=accuracies,
-        attempts=attempts,
-        current_difficulty=last_question["difficulty"]
-    )
-    new_state_indices = state_to_2d_index(new_state)
-
-    # Update Q-table
-    q_table = update_q_table(
+    # Update Q-table, recording the touched cell for write-back
+    update_q_table(
         q_table,
         current_state_indices,
         action_idx,
         reward,
         new_state_indices
     )
+    user_state.dirty_cells.add(cell_index(q_table.shape, current_state_indices, action_idx))
 
-    # Save updated data
-    update_user_data(
-        request.user_id,
-        accuracies=accuracies,
-        attempts=attempts,
-        q_table=q_table,
-        iteration=user_data.get("iteration", 1)
-    )
+    # Never above where the user started, e.g. RL_PRIOR_EPSILON with a prior
+    user_state.epsilon = min(user_state.epsilon, decay_epsilon(user_state.iteration))
+    user_state.iteration += 1
 
-    subject_key = f"{action.subject}_{action.difficulty}"
     performance = {
-        diff: accuracies.get(f"{action.subject}_{diff}", 0.0)
-        for diff in DIFFICULTIES
+        diff: float(accuracies[subject_idx, i])
+        for i, diff in enumerate(DIFFICULTIES)
     }
-    
+    total_attempts = int(attempts[subject_idx, diff_idx])
+
     return {
         "reward": reward,
-        "new_accuracy": accuracies[subject_key],
-        "total_attempts": attempts[subject_key],
-        "current_difficulty": action.difficulty,
+        "new_accuracy": float(accuracies[subject_idx, diff_idx]),
+        "total_attempts": total_attempts,
+        "current_difficulty": difficulty,
         "performance_summary": {
-            "subject": action.subject,
+            "subject": subject,
             "accuracies": performance,
-            "total_attempts": attempts.get(subject_key, 0)
+            "total_attempts": total_attempts
         }
     }
+
+@app.post("/next")
+async def get_next_question(request: NextQuestionRequest):
+    """Select the next question using 2D state representation."""
+    with user_cache.edit(request.user_id) as user_state:
+        selection = select_question(user_state, request.current_subject)
+
+        # Save the selected question; a single pick replaces any planned quiz
+        user_state.last_question = planned(selection)
+        user_state.planned_questions = []
+
+    return selection
+
+@app.post("/next-batch")
+async def get_next_questions(request: NextBatchRequest):
+    """Plan a whole quiz in one call.
+
+    Each pick sees the state a sequence of /next calls would (difficulty
+    of the previous pick), and exploitation skips (subject, difficulty)
+    cells already in the quiz until all allowed cells have been used, so
+    the quiz isn't one argmax cell repeated. /update then consumes the
+    planned questions in order, or all answers can be submitted at once
+    through /update-batch.
+    """
+    if not 1 <= request.count <= MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"count must be between 1 and {MAX_BATCH_SIZE}"
+        )
+
+    with user_cache.edit(request.user_id) as user_state:
+        last_question = user_state.last_question or {}
+        current_difficulty = last_question.get("difficulty", "easy")
+        allowed = len(DIFFICULTIES) if request.current_subject else ACTION_SPACE
+
+        selections, chosen = [], set()
+        for _ in range(request.count):
+            if len(chosen) >= allowed:
+                chosen.clear()
+            state_indices = state_index_from_arrays(
+                user_state.accuracies, get_difficulty_level(current_difficulty)
+            )
+            selection = select_question(user_state, request.current_subject, state_indices, chosen)
+            chosen.add(SUBJECTS.index(selection["subject"]) * len(DIFFICULTIES)
+                       + get_difficulty_level(selection["difficulty"]))
+            current_difficulty = selection["difficulty"]
+            selections.append(selection)
+        user_state.planned_questions = [planned(s) for s in selections]
+
+    return {"questions": selections}
+
+@app.post("/update")
+async def update_state(request: FeedbackRequest):
+    """Update Q-table and metrics using 2D state representation."""
+    with user_cache.edit(request.user_id) as user_state:
+        if user_state.planned_questions:
+            user_state.last_question = user_state.planned_questions.pop(0)
+
+        if not user_state.last_question:
+            raise HTTPException(
+                status_code=400,
+                detail="No previous question found for this user"
+            )
+
+        return apply_answer(user_state, user_state.last_question, request.correct)
+
+@app.post("/update-batch")
+async def update_state_batch(request: BatchFeedbackRequest):
+    """Apply answers for planned questions in order."""
+    with user_cache.edit(request.user_id) as user_state:
+        if len(request.answers) > len(user_state.planned_questions):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Got {len(request.answers)} answers for "
+                       f"{len(user_state.planned_questions)} planned questions"
+            )
+
+        results = []
+        for correct in request.answers:
+            user_state.last_question = user_state.planned_questions.pop(0)
+            results.append(apply_answer(user_state, user_state.last_question, correct))
+
+    return {
+        "results": results,
+        "total_reward": sum(r["reward"] for r in results),
+        "remaining": len(user_state.planned_questions)
+    }
     
 @app.get("/{user_id}/stats")
 async def get_user_statistics(user_id: str) -> Dict[str, Any]:
     """Get detailed statistics for a user."""
-    user_data = get_user_data(user_id, STATE_ROWS, STATE_COLS, ACTION_SPACE)
+    with user_cache.view(user_id) as user_state:
+        accuracies, attempts = arrays_to_metrics(user_state.accuracies, user_state.attempts)
+    user_data = {"accuracies": accuracies, "attempts": attempts}
     
     # Calculate statistics per subject and difficulty
     stats = {}
@@ -178,7 +283,9 @@ async def get_user_statistics(user_id: str) -> Dict[str, Any]:
 @app.get("/{user_id}/progress")
 async def get_user_progress(user_id: str):
     """Get detailed progress report for a user."""
-    user_data = get_user_data(user_id, STATE_ROWS, STATE_COLS, ACTION_SPACE)
+    with user_cache.view(user_id) as user_state:
+        accuracies, attempts = arrays_to_metrics(user_state.accuracies, user_state.attempts)
+    user_data = {"accuracies": accuracies, "attempts": attempts}
     
     progress_report = {}
     for subject in SUBJECTS:
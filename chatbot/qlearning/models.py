@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 class QuizState(BaseModel):
     accuracies: Dict[str, float]
@@ -18,6 +18,15 @@ class NextQuestionRequest(BaseModel):
     user_id: str
     current_subject: Optional[str] = None
 
+class NextBatchRequest(BaseModel):
+    user_id: str
+    count: int = 10
+    current_subject: Optional[str] = None
+
+class BatchFeedbackRequest(BaseModel):
+    user_id: str
+    answers: List[bool]  # Results for the planned questions, in order
+
 class UserPerformance(BaseModel):
     subject: str
     difficulty: str
@@ -0,0 +1,249 @@
+# offline.py
+"""Offline Q-learning: replay logged quiz interactions in bulk.
+
+Usage (from the chatbot/ directory):
+
+    python -m qlearning.offline --events interactions.jsonl --prior prior.npy
+    python -m qlearning.offline --synthetic-users 5000 --questions 40 --prior prior.npy
+
+Events are (user_id, subject, difficulty, correct) records, read from
+JSON lines or CSV with those column names. Each user's events are replayed
+in order with the same reward, metric and Q-update rules as /rl/update,
+vectorized across users.
+"""
+
+import argparse
+import csv
+import json
+import time
+import numpy as np
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+from .constants import (
+    SUBJECTS,
+    DIFFICULTIES,
+    ACCURACY_BINS,
+    LEARNING_RATE,
+    DISCOUNT_FACTOR,
+    ACCURACY_DECAY,
+    MASTERY_THRESHOLD,
+    STRUGGLE_THRESHOLD,
+    MINIMUM_ATTEMPTS,
+    RL_STORE
+)
+from .qlearning_utils import (
+    STATE_POWERS,
+    ACCURACY_BIN_EDGES,
+    DIFFICULTY_MULTIPLIER_VALUES,
+    decay_epsilon,
+    arrays_to_metrics
+)
+from .qtable_utils import encode_q_table
+from .question_bank import OBJECT_ID
+from .synthetic import Event, generate_events
+
+STATE_ROWS = ACCURACY_BINS ** len(SUBJECTS)
+STATE_COLS = len(DIFFICULTIES)
+ACTION_SPACE = len(SUBJECTS) * len(DIFFICULTIES)
+
+
+def load_events(path: str) -> List[Event]:
+    """Read events from a .jsonl or .csv file."""
+    def parse(record) -> Event:
+        correct = record["correct"]
+        if isinstance(correct, str):
+            correct = correct.strip().lower() in ("1", "true", "yes")
+        return str(record["user_id"]), record["subject"], record["difficulty"], bool(correct)
+
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            return [parse(row) for row in csv.DictReader(f)]
+        return [parse(json.loads(line)) for line in f if line.strip()]
+
+
+def group_events(events: Iterable[Event]) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Pack events into per-user padded (users, steps) arrays.
+
+    Returns user ids, subject and difficulty indices, correctness and a
+    validity mask; each user's events keep their original order.
+    """
+    per_user: Dict[str, List[Tuple[int, int, bool]]] = defaultdict(list)
+    subject_index = {s: i for i, s in enumerate(SUBJECTS)}
+    difficulty_index = {d: i for i, d in enumerate(DIFFICULTIES)}
+    for user_id, subject, difficulty, correct in events:
+        per_user[user_id].append((subject_index[subject], difficulty_index[difficulty], correct))
+
+    user_ids = list(per_user)
+    steps = max((len(v) for v in per_user.values()), default=0)
+    subjects = np.zeros((len(user_ids), steps), dtype=np.int64)
+    difficulties = np.zeros((len(user_ids), steps), dtype=np.int64)
+    correct = np.zeros((len(user_ids), steps), dtype=bool)
+    mask = np.zeros((len(user_ids), steps), dtype=bool)
+    for u, user_id in enumerate(user_ids):
+        n = len(per_user[user_id])
+        s, d, c = zip(*per_user[user_id])
+        subjects[u, :n], difficulties[u, :n], correct[u, :n], mask[u, :n] = s, d, c, True
+    return user_ids, subjects, difficulties, correct, mask
+
+
+def batch_state_rows(acc: np.ndarray) -> np.ndarray:
+    """state_index_from_arrays for a (users, subjects, difficulties) stack."""
+    bins = np.searchsorted(ACCURACY_BIN_EDGES, acc.sum(axis=2) / acc.shape[2], side="right")
+    return bins @ STATE_POWERS
+
+
+def batch_rewards(a: np.ndarray, n: np.ndarray, d: np.ndarray, c: np.ndarray) -> np.ndarray:
+    """calculate_reward_from_arrays for vectors of accuracy, attempts, difficulty and correctness."""
+    multiplier = DIFFICULTY_MULTIPLIER_VALUES[d]
+    base_reward = np.where(c, 1.0, -0.5) * multiplier
+    promote = c & (d < len(DIFFICULTIES) - 1) & (a >= MASTERY_THRESHOLD) & (n >= MINIMUM_ATTEMPTS)
+    demote = ~c & (a < STRUGGLE_THRESHOLD) & (d > 0)
+    difficulty_adjustment = np.where(promote, multiplier, 0.0) - np.where(demote, multiplier * 0.5, 0.0)
+    exploration_bonus = np.where(n < MINIMUM_ATTEMPTS, 0.2, 0.0)
+    return base_reward + difficulty_adjustment + exploration_bonus
+
+
+def replay(
+    subjects: np.ndarray,
+    difficulties: np.ndarray,
+    correct: np.ndarray,
+    mask: np.ndarray,
+    learning_rate: float = LEARNING_RATE,
+    discount_factor: float = DISCOUNT_FACTOR
+) -> Dict[str, np.ndarray]:
+    """Replay one chunk of users from a fresh state.
+
+    Applies the /rl/update rules step by step, one event per user per
+    step, and returns the final accuracies, attempts, Q-tables and the
+    total reward per user.
+    """
+    n_users, steps = subjects.shape
+    acc = np.zeros((n_users, len(SUBJECTS), len(DIFFICULTIES)))
+    att = np.zeros((n_users, len(SUBJECTS), len(DIFFICULTIES)), dtype=np.int64)
+    q = np.zeros((n_users, STATE_ROWS, STATE_COLS, ACTION_SPACE))
+    total_reward = np.zeros(n_users)
+
+    for t in range(steps):
+        u = np.flatnonzero(mask[:, t])
+        s, d, c = subjects[u, t], difficulties[u, t], correct[u, t]
+        actions = s * len(DIFFICULTIES) + d
+
+        rows = batch_state_rows(acc[u])
+        rewards = batch_rewards(acc[u, s, d], att[u, s, d], d, c)
+
+        acc[u, s, d] = acc[u, s, d] * (1 - ACCURACY_DECAY) + c * ACCURACY_DECAY
+        att[u, s, d] += 1
+        next_rows = batch_state_rows(acc[u])
+
+        current_q = q[u, rows, d, actions]
+        max_next_q = q[u, next_rows, d].max(axis=1)
+        q[u, rows, d, actions] = current_q + learning_rate * (
+            rewards + discount_factor * max_next_q - current_q
+        )
+        total_reward[u] += rewards
+
+    return {"accuracies": acc, "attempts": att, "q_tables": q, "total_reward": total_reward}
+
+
+def train(
+    events: Iterable[Event],
+    learning_rate: float = LEARNING_RATE,
+    discount_factor: float = DISCOUNT_FACTOR,
+    chunk_size: int = 512,
+    store=None
+) -> Dict[str, object]:
+    """Replay all events and build the population prior Q-table.
+
+    The prior is the mean of each Q-cell over the users who touched it.
+    If a store is given, every user's resulting state is written to it.
+    """
+    user_ids, subjects, difficulties, correct, mask = group_events(events)
+    q_sum = np.zeros((STATE_ROWS, STATE_COLS, ACTION_SPACE))
+    q_count = np.zeros((STATE_ROWS, STATE_COLS, ACTION_SPACE), dtype=np.int64)
+    rewards = np.zeros(len(user_ids))
+
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        result = replay(
+            subjects[chunk], difficulties[chunk], correct[chunk], mask[chunk],
+            learning_rate, discount_factor
+        )
+        touched = result["q_tables"] != 0
+        q_sum += result["q_tables"].sum(axis=0)
+        q_count += touched.sum(axis=0)
+        rewards[chunk] = result["total_reward"]
+
+        if store is not None:
+            n_events = mask[chunk].sum(axis=1)
+            for i, user_id in enumerate(user_ids[chunk]):
+                accuracies, attempts = arrays_to_metrics(result["accuracies"][i], result["attempts"][i])
+                store.save(user_id, {
+                    "accuracies": accuracies,
+                    "attempts": attempts,
+                    "q_cells": encode_q_table(result["q_tables"][i]),
+                    "epsilon": float(decay_epsilon(n_events[i])),
+                    "iteration": int(n_events[i]) + 1
+                })
+
+    prior = np.divide(q_sum, q_count, out=np.zeros_like(q_sum), where=q_count > 0)
+    return {
+        "users": len(user_ids),
+        "events": int(mask.sum()),
+        "prior": prior,
+        "mean_reward_per_event": float(rewards.sum() / max(mask.sum(), 1)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay quiz interactions to train Q-tables offline")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--events", help="Interaction log (.jsonl or .csv)")
+    source.add_argument("--synthetic-users", type=int, help="Generate events for this many simulated students")
+    parser.add_argument("--questions", type=int, default=40, help="Questions per synthetic student")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--learning-rate", type=float, default=LEARNING_RATE)
+    parser.add_argument("--discount-factor", type=float, default=DISCOUNT_FACTOR)
+    parser.add_argument("--chunk-size", type=int, default=512, help="Users replayed together")
+    parser.add_argument("--prior", help="Write the population prior Q-table to this .npy file")
+    parser.add_argument(
+        "--write-store", action="store_true",
+        help="Write per-user state to the configured RL_STORE. MongoDB needs ObjectId user ids, "
+             "so synthetic students (ids like student-<n>) can only be written to RL_STORE=sqlite:///..."
+    )
+    args = parser.parse_args(argv)
+
+    if args.events:
+        events = load_events(args.events)
+    else:
+        events = generate_events(args.synthetic_users, args.questions, seed=args.seed)
+
+    store = None
+    if args.write_store:
+        if not RL_STORE.startswith("sqlite:///"):
+            # MongoUserStore keys documents by ObjectId(user_id); fail before writing anything
+            if args.synthetic_users:
+                parser.error("--write-store with --synthetic-users needs RL_STORE=sqlite:///path/to.db")
+            invalid = sorted({user_id for user_id, *_ in events if not OBJECT_ID.match(user_id)})
+            if invalid:
+                parser.error(
+                    f"--write-store to MongoDB needs ObjectId user ids; {len(invalid)} aren't, e.g. {invalid[0]}"
+                )
+        from .db_utils import get_store
+        store = get_store()
+
+    started = time.perf_counter()
+    result = train(events, args.learning_rate, args.discount_factor, args.chunk_size, store)
+    elapsed = time.perf_counter() - started
+
+    if args.prior:
+        np.save(args.prior, result["prior"].astype(np.float32))
+
+    print(
+        f"Replayed {result['events']} events for {result['users']} users in {elapsed:.2f}s "
+        f"(mean reward per event {result['mean_reward_per_event']:.4f}, "
+        f"{int(np.count_nonzero(result['prior']))} prior cells set)"
+    )
+
+
+if __name__ == "__main__":
+    main()
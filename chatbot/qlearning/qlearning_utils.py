@@ -1,7 +1,7 @@
 # qlearning_utils.py
 
 import numpy as np
-from typing import Dict, Tuple
+from typing import Collection, Dict, Tuple, Union
 from .constants import (
     SUBJECTS, 
     DIFFICULTIES, 
@@ -9,16 +9,36 @@ from .constants import (
     LEARNING_RATE, 
     DISCOUNT_FACTOR, 
     ACCURACY_DECAY,
+    MIN_EPSILON,
     MASTERY_THRESHOLD,
     STRUGGLE_THRESHOLD,
     MINIMUM_ATTEMPTS
 )
 from .models import QuizState, QuizAction, UserPerformance
+from .qtable_utils import OverlayQTable
+
+# Reward multiplier per difficulty level
+DIFFICULTY_MULTIPLIERS = {
+    "easy": 1.0,
+    "medium": 1.5,
+    "hard": 2.0
+}
+
+# Precomputed tables for the array-based state encoding. A user's metrics are
+# held as (len(SUBJECTS), len(DIFFICULTIES)) arrays indexed like METRIC_KEYS.
+METRIC_KEYS = [[f"{subject}_{diff}" for diff in DIFFICULTIES] for subject in SUBJECTS]
+STATE_POWERS = ACCURACY_BINS ** np.arange(len(SUBJECTS) - 1, -1, -1)
+ACCURACY_BIN_EDGES = np.array([STRUGGLE_THRESHOLD, MASTERY_THRESHOLD])
+DIFFICULTY_MULTIPLIER_VALUES = np.array([DIFFICULTY_MULTIPLIERS[diff] for diff in DIFFICULTIES])
 
 def init_q_table(state_rows: int, state_cols: int, action_space: int) -> np.ndarray:
     """Initialize Q-table with zeros using 2D state representation."""
     return np.zeros((state_rows, state_cols, action_space))
 
+def decay_epsilon(iteration: int) -> float:
+    """Exploration rate to use after the given number of updates."""
+    return max(MIN_EPSILON, 1.0 * np.exp(-0.01 * iteration))
+
 def get_difficulty_level(difficulty: str) -> int:
     """Convert difficulty string to numerical level."""
     return DIFFICULTIES.index(difficulty)
@@ -44,26 +64,48 @@ def discretize_accuracy(accuracy: float) -> int:
         return 1
     return 2
 
+def metrics_to_arrays(accuracies: Dict[str, float], attempts: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert keyed accuracy/attempt dicts to (subjects, difficulties) arrays."""
+    acc = np.array([[accuracies.get(key, 0.0) for key in row] for row in METRIC_KEYS], dtype=np.float64)
+    att = np.array([[attempts.get(key, 0) for key in row] for row in METRIC_KEYS], dtype=np.int64)
+    return acc, att
+
+def arrays_to_metrics(acc: np.ndarray, att: np.ndarray) -> Tuple[Dict[str, float], Dict[str, int]]:
+    """Convert metric arrays back to keyed dicts, omitting untouched entries."""
+    accuracies, attempts = {}, {}
+    for s_idx, d_idx in zip(*np.nonzero((att > 0) | (acc != 0.0))):
+        key = METRIC_KEYS[s_idx][d_idx]
+        accuracies[key] = float(acc[s_idx, d_idx])
+        attempts[key] = int(att[s_idx, d_idx])
+    return accuracies, attempts
+
+def discretize_accuracies(acc: np.ndarray) -> np.ndarray:
+    """Vectorized discretize_accuracy."""
+    return np.searchsorted(ACCURACY_BIN_EDGES, acc, side="right")
+
+def state_index_from_arrays(acc: np.ndarray, diff_idx: int) -> Tuple[int, int]:
+    """Map metric arrays to 2D Q-table indices (row, col).
+
+    The row is the base-ACCURACY_BINS number formed by each subject's binned
+    average accuracy, first subject most significant.
+    """
+    bins = discretize_accuracies(acc.sum(axis=1) / acc.shape[1])
+    return int(bins @ STATE_POWERS), diff_idx
+
 def state_to_2d_index(state: QuizState, current_subject: str = None) -> Tuple[int, int]:
     """Map QuizState to 2D Q-table indices (row, col)."""
-    row_index = 0
+    # Column index is the difficulty level
+    col_index = get_difficulty_level(state.current_difficulty)
+
     if current_subject:
         # Only consider the current subject's performance
         key = f"{current_subject}_{state.current_difficulty}"
         accuracy = state.accuracies.get(key, 0.0)
-        row_index = discretize_accuracy(accuracy)
-    else:
-        # Consider all subjects' performance
-        for subject in SUBJECTS:
-            metrics = get_performance_metrics(state.accuracies, state.attempts, subject)
-            avg_accuracy = sum(m.accuracy for m in metrics.values()) / len(metrics)
-            bin_value = discretize_accuracy(avg_accuracy)
-            row_index = row_index * ACCURACY_BINS + bin_value
-    
-    # Column index is the difficulty level
-    col_index = get_difficulty_level(state.current_difficulty)
-    
-    return row_index, col_index
+        return discretize_accuracy(accuracy), col_index
+
+    # Consider all subjects' performance
+    acc, _ = metrics_to_arrays(state.accuracies, state.attempts)
+    return state_index_from_arrays(acc, col_index)
 
 def action_to_index(action: QuizAction) -> int:
     """Map QuizAction to Q-table index."""
@@ -71,41 +113,50 @@ def action_to_index(action: QuizAction) -> int:
     diff_idx = DIFFICULTIES.index(action.difficulty)
     return subject_idx * len(DIFFICULTIES) + diff_idx
 
-def calculate_reward(state: QuizState, action: QuizAction, correct: bool) -> float:
-    # Reward calculation remains the same
-    DIFFICULTY_MULTIPLIERS = {
-        "easy": 1.0,
-        "medium": 1.5,
-        "hard": 2.0
-    }
-    
-    performance = get_performance_metrics(state.accuracies, state.attempts, action.subject)
-    current_diff_level = get_difficulty_level(action.difficulty)
-    current_perf = performance[action.difficulty]
-    
-    base_reward = (1.0 if correct else -0.5) * DIFFICULTY_MULTIPLIERS[action.difficulty]
+def calculate_reward_from_arrays(
+    acc: np.ndarray,
+    att: np.ndarray,
+    subject_idx: int,
+    diff_idx: int,
+    correct: bool
+) -> float:
+    """Array-based calculate_reward for the (subject_idx, diff_idx) action."""
+    multiplier = DIFFICULTY_MULTIPLIER_VALUES[diff_idx]
+    accuracy = acc[subject_idx, diff_idx]
+    attempts = att[subject_idx, diff_idx]
+
+    base_reward = (1.0 if correct else -0.5) * multiplier
     
     difficulty_adjustment = 0.0
-    if correct and current_diff_level < len(DIFFICULTIES) - 1:
-        if (current_perf.accuracy >= MASTERY_THRESHOLD and 
-            current_perf.attempts >= MINIMUM_ATTEMPTS):
-            difficulty_adjustment += DIFFICULTY_MULTIPLIERS[action.difficulty]
+    if correct and diff_idx < len(DIFFICULTIES) - 1:
+        if accuracy >= MASTERY_THRESHOLD and attempts >= MINIMUM_ATTEMPTS:
+            difficulty_adjustment += multiplier
     
-    if not correct and current_perf.accuracy < STRUGGLE_THRESHOLD:
-        if current_diff_level > 0:
-            difficulty_adjustment -= DIFFICULTY_MULTIPLIERS[action.difficulty] * 0.5
+    if not correct and accuracy < STRUGGLE_THRESHOLD:
+        if diff_idx > 0:
+            difficulty_adjustment -= multiplier * 0.5
     
-    exploration_bonus = 0.2 if current_perf.attempts < MINIMUM_ATTEMPTS else 0.0
+    exploration_bonus = 0.2 if attempts < MINIMUM_ATTEMPTS else 0.0
     
-    return base_reward + difficulty_adjustment + exploration_bonus
+    return float(base_reward + difficulty_adjustment + exploration_bonus)
+
+def calculate_reward(state: QuizState, action: QuizAction, correct: bool) -> float:
+    acc, att = metrics_to_arrays(state.accuracies, state.attempts)
+    return calculate_reward_from_arrays(
+        acc,
+        att,
+        SUBJECTS.index(action.subject),
+        get_difficulty_level(action.difficulty),
+        correct
+    )
 
 def update_q_table(
-    q_table: np.ndarray,
+    q_table: Union[np.ndarray, OverlayQTable],
     state_indices: Tuple[int, int],
     action_idx: int,
     reward: float,
     next_state_indices: Tuple[int, int]
-) -> np.ndarray:
+) -> Union[np.ndarray, OverlayQTable]:
     """Update the Q-table using 2D state representation."""
     row_idx, col_idx = state_indices
     next_row_idx, next_col_idx = next_state_indices
@@ -134,15 +185,31 @@ def update_metrics(
     
     return accuracies, attempts
 
+def update_metrics_arrays(
+    acc: np.ndarray,
+    att: np.ndarray,
+    subject_idx: int,
+    diff_idx: int,
+    correct: bool
+) -> None:
+    """Array-based update_metrics; updates acc and att in place."""
+    acc[subject_idx, diff_idx] = acc[subject_idx, diff_idx] * (1 - ACCURACY_DECAY) + (1.0 if correct else 0.0) * ACCURACY_DECAY
+    att[subject_idx, diff_idx] += 1
+
 def choose_action(
-    q_table: np.ndarray,
+    q_table: Union[np.ndarray, OverlayQTable],
     state_indices: Tuple[int, int],
-    accuracies: Dict[str, float],
-    attempts: Dict[str, int],
+    accuracies: np.ndarray,
+    attempts: np.ndarray,
     current_subject: str = None,
-    epsilon: float = 1.0
+    epsilon: float = 1.0,
+    exclude: Collection[int] = ()
 ) -> Tuple[str, str, bool]:
-    """Choose action using epsilon-greedy strategy with 2D state representation."""
+    """Choose action using epsilon-greedy strategy with 2D state representation.
+
+    Exploitation skips the action indices in ``exclude`` unless that would
+    leave none.
+    """
     row_idx, col_idx = state_indices
     
     if np.random.random() < epsilon:  # Exploration
@@ -155,9 +222,14 @@ def choose_action(
             action_values = q_table[row_idx, col_idx]
             valid_actions = [i for i in range(len(action_values)) 
                            if i // len(DIFFICULTIES) == SUBJECTS.index(current_subject)]
+            valid_actions = [i for i in valid_actions if i not in exclude] or valid_actions
             action_idx = valid_actions[np.argmax([action_values[i] for i in valid_actions])]
         else:
-            action_idx = np.argmax(q_table[row_idx, col_idx])
+            action_values = np.asarray(q_table[row_idx, col_idx], dtype=float)
+            if exclude and len(exclude) < len(action_values):
+                action_values = action_values.copy()
+                action_values[list(exclude)] = -np.inf
+            action_idx = np.argmax(action_values)
         
         subject_idx = action_idx // len(DIFFICULTIES)
         diff_idx = action_idx % len(DIFFICULTIES)
@@ -0,0 +1,104 @@
+# qtable_utils.py
+
+import os
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+# Q-tables are persisted as a sparse mapping of flat cell index -> value.
+# Keys are strings so the mapping can live directly in a MongoDB sub-document
+# and a single cell can be updated in place with {"$set": {"q_cells.<idx>": v}}.
+# In memory a user's table is an OverlayQTable: the shared prior plus only
+# the cells that user has updated.
+
+def cell_index(shape: Tuple[int, int, int], state_indices: Tuple[int, int], action_idx: int) -> int:
+    """Flatten (row, col, action) into a single cell index."""
+    row_idx, col_idx = state_indices
+    _, state_cols, action_space = shape
+    return (row_idx * state_cols + col_idx) * action_space + action_idx
+
+def encode_q_table(q_table: np.ndarray) -> Dict[str, float]:
+    """Encode a dense Q-table as a sparse dict of its non-zero cells."""
+    flat = np.asarray(q_table).ravel()
+    nonzero = np.flatnonzero(flat)
+    return {str(idx): float(flat[idx]) for idx in nonzero}
+
+def decode_q_table(q_cells: Dict[str, float], shape: Tuple[int, int, int]) -> np.ndarray:
+    """Rebuild a dense Q-table from its sparse cell mapping."""
+    q_table = np.zeros(shape)
+    if q_cells:
+        flat = q_table.reshape(-1)
+        indices = np.fromiter((int(k) for k in q_cells), dtype=np.int64, count=len(q_cells))
+        flat[indices] = np.fromiter(q_cells.values(), dtype=np.float64, count=len(q_cells))
+    return q_table
+
+def load_prior(path: Optional[str], shape: Tuple[int, int, int]) -> np.ndarray:
+    """Load the shared prior Q-table, memory-mapped read-only.
+
+    Falls back to a read-only table of zeros when no prior is configured.
+    A configured path that doesn't exist is an error: new users would
+    otherwise start with the prior's low epsilon and exploit all-zero rows.
+    """
+    if path:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Prior Q-table {path} (RL_PRIOR_PATH) not found")
+        prior = np.load(path, mmap_mode="r")
+        if prior.shape != tuple(shape):
+            raise ValueError(f"Prior Q-table {path} has shape {prior.shape}, expected {tuple(shape)}")
+        return prior
+    prior = np.zeros(shape)
+    prior.setflags(write=False)
+    return prior
+
+
+class OverlayQTable:
+    """Copy-on-write view of a shared prior Q-table.
+
+    Reads fall through to the prior unless the user has written that cell;
+    writes only ever touch ``cells`` (flat cell index -> value). Supports the
+    indexing used by choose_action and update_q_table: ``q[row, col]`` for a
+    row of action values and ``q[row, col, action]`` for a single cell.
+    """
+
+    def __init__(self, prior: np.ndarray, cells: Optional[Dict[int, float]] = None):
+        self.prior = prior
+        self.cells = cells if cells is not None else {}
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self.prior.shape
+
+    def __getitem__(self, key):
+        if len(key) == 3:
+            idx = cell_index(self.shape, key[:2], key[2])
+            value = self.cells.get(idx)
+            return float(self.prior[key]) if value is None else value
+
+        row_idx, col_idx = key
+        values = np.array(self.prior[row_idx, col_idx], dtype=np.float64)
+        if self.cells:
+            base = cell_index(self.shape, key, 0)
+            for action_idx in range(len(values)):
+                value = self.cells.get(base + action_idx)
+                if value is not None:
+                    values[action_idx] = value
+        return values
+
+    def __setitem__(self, key, value):
+        if len(key) != 3:
+            raise IndexError("OverlayQTable only supports single-cell writes")
+        self.cells[cell_index(self.shape, key[:2], key[2])] = float(value)
+
+    def to_cells(self) -> Dict[str, float]:
+        """Encode the user's own cells for storage."""
+        return {str(idx): value for idx, value in self.cells.items()}
+
+    @classmethod
+    def from_cells(cls, prior: np.ndarray, q_cells: Dict[str, float]) -> "OverlayQTable":
+        return cls(prior, {int(idx): float(value) for idx, value in q_cells.items()})
+
+    def to_dense(self) -> np.ndarray:
+        dense = np.array(self.prior, dtype=np.float64)
+        flat = dense.reshape(-1)
+        for idx, value in self.cells.items():
+            flat[idx] = value
+        return dense
@@ -0,0 +1,281 @@
+# question_bank.py
+"""In-memory MCQ bank partitioned by (subject, difficulty).
+
+Lets /next resolve a chosen action straight to a concrete question the
+student hasn't been served yet, instead of the app sampling Mongo
+afterwards. Questions are stored sorted by action cell (the same
+``subject_idx * len(DIFFICULTIES) + diff_idx`` layout as the Q-table's
+action axis), so every cell is a contiguous range of positions and a
+user's seen set is one packed bitset over positions (a few hundred bytes
+for the shipped bank).
+
+Sources are JSON arrays or JSON lines of questions: a ``mongoexport`` of
+the questions collection (``question``, ``options``, ``correctOption``,
+``difficulty``, ``subject``, ``_id``), or the MCQ files shipped with the
+Node backend. Those carry no difficulty, so one is estimated (see
+``estimate_difficulty``), and no ObjectIds: the app can't save a quiz
+made of them, so they are only for trying the bank out and benchmarks.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+from .constants import SUBJECTS, DIFFICULTIES
+
+DEFAULT_BANK_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "chatapp", "backend"
+)
+
+# Shipped MCQ files, keyed by the subject names in constants.SUBJECTS
+MCQ_FILES = {
+    "biology": "bio_mcqs_data.json",
+    "physics": "phy_mcqs_data.json",
+}
+
+# Subject spellings used in Mongo and the content files
+SUBJECT_ALIASES = {
+    "bio": "biology",
+    "phy": "physics",
+    "chem": "chemistry",
+    "eng": "english",
+    "lr": "logical",
+    "logicalreasoning": "logical",
+}
+
+# Random probes for an unseen question before scanning the cell's bits
+MAX_PROBES = 8
+
+NEGATIVE_PHRASING = re.compile(r"\b(not|except|incorrect|false|wrong)\b", re.IGNORECASE)
+COMBINED_OPTIONS = re.compile(r"^(all|none|both)\b", re.IGNORECASE)
+# Page footers the PDF extraction left in some options, e.g. "Bacteria \n \n Page 16"
+PAGE_FOOTER = re.compile(r"\s*\n\s*Page\s+\d+\s*$")
+# Ids the Node backend can look up with Question.findById
+OBJECT_ID = re.compile(r"^[0-9a-f]{24}$")
+
+
+def normalize_subject(name) -> Optional[str]:
+    key = re.sub(r"[\s_-]", "", str(name or "")).lower()
+    key = SUBJECT_ALIASES.get(key, key)
+    return key if key in SUBJECTS else None
+
+
+def _options(item: Dict) -> List[str]:
+    options = item.get("options")
+    if isinstance(options, list):
+        values = options
+    elif isinstance(options, dict):
+        values = [options[key] for key in sorted(options)]
+    else:
+        values = [item[key] for key in "ABCD" if key in item]
+    return [PAGE_FOOTER.sub("", str(value)).strip() for value in values]
+
+
+def _correct_index(item: Dict, options: List[str]) -> int:
+    """Index of the correct option, or -1 if it can't be matched"""
+    # Mongo stores correctOption as an index; the MCQ files store the
+    # answer text (sometimes a letter) under "correct" or "Correct"
+    if "correctOption" in item:
+        try:
+            index = int(item["correctOption"])
+        except (TypeError, ValueError):
+            return -1
+        return index if 0 <= index < len(options) else -1
+    correct = item.get("correct", item.get("Correct"))
+    correct = str(correct if correct is not None else "").strip()
+    if correct in options:
+        return options.index(correct)
+    if len(correct) == 1 and correct.upper() in "ABCD"[:len(options)]:
+        return "ABCD".index(correct.upper())
+    lowered = [option.strip().lower() for option in options]
+    return lowered.index(correct.lower()) if correct.lower() in lowered else -1
+
+
+def _question_id(item: Dict, fallback: str) -> str:
+    _id = item.get("_id")
+    if isinstance(_id, dict):
+        _id = _id.get("$oid")
+    return str(_id) if _id else fallback
+
+
+def _read_json(path: str) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    # mongoexport without --jsonArray writes one document per line
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def load_questions(paths: Optional[Iterable[str]] = None, bank_dir: str = DEFAULT_BANK_DIR) -> List[Dict]:
+    """Read questions as {"_id", "subject", "difficulty", "question", "options", "correctOption"}
+
+    With no ``paths`` the shipped MCQ files are used, with ids
+    ``mcq/<subject>/<index>`` as in the chatbot's retrieval corpus.
+    Questions with an unknown subject, or whose answer matches none of
+    the options, are skipped; ``difficulty`` is None where the source has
+    none.
+    """
+    if paths:
+        sources = [(path, None) for path in paths]
+    else:
+        sources = [(os.path.join(bank_dir, filename), subject) for subject, filename in MCQ_FILES.items()]
+
+    questions = []
+    for path, default_subject in sources:
+        if not os.path.exists(path):
+            continue
+        for index, item in enumerate(_read_json(path)):
+            subject = normalize_subject(item.get("subject")) or default_subject
+            if subject is None:
+                continue
+            options = _options(item)
+            correct = _correct_index(item, options)
+            if correct < 0:
+                continue
+            difficulty = str(item.get("difficulty") or "").lower()
+            questions.append({
+                "_id": _question_id(item, f"mcq/{subject}/{index}"),
+                "subject": subject,
+                "difficulty": difficulty if difficulty in DIFFICULTIES else None,
+                "question": str(item.get("question", "")),
+                "options": options,
+                "correctOption": correct,
+            })
+    return questions
+
+
+def estimate_difficulty(questions: List[Dict]) -> None:
+    """Fill in missing difficulties by splitting each subject into thirds
+
+    A rough proxy until the bank is labelled: longer stems and options,
+    negative phrasing ("which is NOT ...") and combined options ("both",
+    "all of these") rank as harder. Questions that already have a
+    difficulty are left alone.
+    """
+    by_subject: Dict[str, List[Dict]] = {}
+    for question in questions:
+        if question["difficulty"] is None:
+            by_subject.setdefault(question["subject"], []).append(question)
+
+    for unlabelled in by_subject.values():
+        scores = np.array([
+            len(q["question"].split())
+            + sum(len(option.split()) for option in q["options"])
+            + 10 * bool(NEGATIVE_PHRASING.search(q["question"]))
+            + 5 * sum(bool(COMBINED_OPTIONS.match(option.strip())) for option in q["options"])
+            for q in unlabelled
+        ])
+        ranks = np.argsort(np.argsort(scores, kind="stable"), kind="stable")
+        levels = ranks * len(DIFFICULTIES) // len(unlabelled)
+        for question, level in zip(unlabelled, levels):
+            question["difficulty"] = DIFFICULTIES[int(level)]
+
+
+class QuestionBank:
+    """Questions grouped by action cell, with per-user seen bitsets."""
+
+    def __init__(self, questions: List[Dict]):
+        cells = len(SUBJECTS) * len(DIFFICULTIES)
+        keyed = sorted(
+            (SUBJECTS.index(q["subject"]) * len(DIFFICULTIES) + DIFFICULTIES.index(q["difficulty"]), i)
+            for i, q in enumerate(questions)
+        )
+        self.questions = [questions[i] for _, i in keyed]
+        counts = np.bincount([cell for cell, _ in keyed], minlength=cells)
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.size = len(self.questions)
+        # Seen bitsets are only meaningful for the bank they were built against
+        digest = hashlib.sha1("\n".join(q["_id"] for q in self.questions).encode("utf-8"))
+        self.fingerprint = digest.hexdigest()[:16]
+
+    @classmethod
+    def load(cls, paths: Optional[Iterable[str]] = None, bank_dir: str = DEFAULT_BANK_DIR) -> "QuestionBank":
+        questions = load_questions(paths, bank_dir)
+        estimate_difficulty(questions)
+        return cls(questions)
+
+    def cell_range(self, subject: str, difficulty: str):
+        cell = SUBJECTS.index(subject) * len(DIFFICULTIES) + DIFFICULTIES.index(difficulty)
+        return int(self.offsets[cell]), int(self.offsets[cell + 1])
+
+    def count(self, subject: str, difficulty: str) -> int:
+        start, end = self.cell_range(subject, difficulty)
+        return end - start
+
+    def new_seen(self) -> np.ndarray:
+        return np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def pick(self, seen: np.ndarray, subject: str, difficulty: str, rng=np.random) -> Optional[Dict]:
+        """Mark and return a random unseen question of the cell, or None if it is empty
+
+        Random probes settle it in O(1) while most of the cell is unseen;
+        after that one vectorized scan of the cell's bits finds the rest.
+        Once a student has seen the whole cell it starts over.
+        """
+        start, end = self.cell_range(subject, difficulty)
+        if start == end:
+            return None
+
+        for _ in range(MAX_PROBES):
+            position = start + rng.randint(end - start)
+            if not seen[position >> 3] >> (position & 7) & 1:
+                break
+        else:
+            bits = np.unpackbits(seen, count=self.size, bitorder="little")
+            unseen = np.flatnonzero(bits[start:end] == 0)
+            if not len(unseen):
+                bits[start:end] = 0
+                seen[:] = np.packbits(bits, bitorder="little")
+                unseen = np.arange(end - start)
+            position = start + int(unseen[rng.randint(len(unseen))])
+
+        seen[position >> 3] |= np.uint8(1 << (position & 7))
+        return self.questions[position]
+
+    def seen_count(self, seen: np.ndarray, subject: str, difficulty: str) -> int:
+        start, end = self.cell_range(subject, difficulty)
+        return int(np.unpackbits(seen, count=self.size, bitorder="little")[start:end].sum())
+
+    def encode_seen(self, seen: np.ndarray) -> str:
+        return base64.b64encode(seen.tobytes()).decode("ascii")
+
+    def decode_seen(self, data: Optional[str], fingerprint: Optional[str]) -> np.ndarray:
+        """Seen bitset from a user document; a different bank starts fresh"""
+        if not data or fingerprint != self.fingerprint:
+            return self.new_seen()
+        seen = np.frombuffer(base64.b64decode(data), dtype=np.uint8).copy()
+        return seen if len(seen) == (self.size + 7) // 8 else self.new_seen()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            subject: {difficulty: self.count(subject, difficulty) for difficulty in DIFFICULTIES}
+            for subject in SUBJECTS
+        }
+
+
+def load_bank(spec: str, bank_dir: str = DEFAULT_BANK_DIR) -> Optional[QuestionBank]:
+    """Bank for RL_QUESTION_BANK: comma-separated mongoexport files, "shipped" or "none"
+
+    Questions from exports without an ObjectId are left out, since the app
+    saves quizzes by question id.
+    """
+    spec = spec.strip()
+    if not spec or spec.lower() == "none":
+        return None
+    if spec.lower() == "shipped":
+        print("Question bank uses the shipped MCQ files; their ids are not ObjectIds, so quizzes can't be saved")
+        bank = QuestionBank.load(None, bank_dir)
+    else:
+        questions = load_questions([path.strip() for path in spec.split(",") if path.strip()], bank_dir)
+        kept = [q for q in questions if OBJECT_ID.match(q["_id"])]
+        if len(kept) < len(questions):
+            print(f"Question bank: skipped {len(questions) - len(kept)} questions without an ObjectId")
+        estimate_difficulty(kept)
+        bank = QuestionBank(kept)
+    if not bank.size:
+        print(f"Question bank is empty (RL_QUESTION_BANK={spec!r}); /next returns no question ids")
+    return bank
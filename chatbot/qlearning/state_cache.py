@@ -0,0 +1,287 @@
+# state_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from .db_utils import get_store, new_user_data
+from .qlearning_utils import metrics_to_arrays, arrays_to_metrics
+from .qtable_utils import OverlayQTable, encode_q_table
+
+
+@dataclass
+class UserState:
+    """Decoded RL state for one user, as held in the cache.
+
+    Accuracies and attempts are (len(SUBJECTS), len(DIFFICULTIES)) arrays;
+    see qlearning_utils.metrics_to_arrays.
+    """
+
+    accuracies: np.ndarray
+    attempts: np.ndarray
+    q_table: OverlayQTable
+    epsilon: float = 1.0
+    iteration: int = 1
+    last_question: Optional[Dict[str, str]] = None
+    planned_questions: List[Dict[str, str]] = field(default_factory=list)
+    dirty: bool = False
+    dirty_cells: Set[int] = field(default_factory=set)
+    migrate_q_table: bool = False
+    # Packed bitset over question_bank positions; None without a bank
+    seen_questions: Optional[np.ndarray] = None
+    # Snapshots taken / written, so an older snapshot never overwrites a newer one
+    version: int = 0
+    written_version: int = 0
+
+
+class UserStateCache:
+    """Bounded LRU cache of user RL state with write-behind persistence.
+
+    Handlers read and mutate state through ``view``/``edit``. In
+    "write-behind" mode dirty users are written to the store by a
+    background thread every ``flush_interval`` seconds and on ``close``.
+    Dirty users pushed out of the LRU wait in ``_evicted`` for the next
+    flush (and are picked up from there if they come back first), so an
+    eviction never makes an unrelated request wait on the store. In
+    "write-through" mode every ``edit`` is persisted before it returns, so
+    only the reads are served from memory.
+
+    All writes take their snapshots and reach the store one at a time
+    under ``_write_lock``, in snapshot order; a failed write leaves the
+    user dirty for the next flush.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, int, int],
+        max_size: int = 10000,
+        flush_interval: float = 5.0,
+        write_mode: str = "write-behind",
+        store=None,
+        prior: Optional[np.ndarray] = None,
+        prior_epsilon: Optional[float] = None,
+        question_bank=None,
+    ):
+        if write_mode not in ("write-behind", "write-through"):
+            raise ValueError(f"Unknown write mode: {write_mode}")
+        self.shape = shape
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.write_mode = write_mode
+        self._store = store
+        if prior is None:
+            prior = np.zeros(shape)
+            prior.setflags(write=False)
+        self.prior = prior
+        # Starting exploration rate for new users; with a trained prior they
+        # can exploit it straight away instead of starting at epsilon = 1.0
+        self.prior_epsilon = prior_epsilon
+        self.question_bank = question_bank
+        self._entries: "OrderedDict[str, UserState]" = OrderedDict()
+        self._evicted: Dict[str, UserState] = {}
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = get_store()
+        return self._store
+
+    def _load(self, user_id: str) -> UserState:
+        user_data = self.store.load(user_id)
+        is_new = not user_data
+        if is_new:
+            user_data = new_user_data()
+            if self.prior_epsilon is not None:
+                user_data["epsilon"] = self.prior_epsilon
+
+        migrate = "q_table" in user_data
+        if migrate:
+            q_cells = encode_q_table(np.array(user_data["q_table"], dtype=np.float64))
+        else:
+            q_cells = user_data.get("q_cells", {})
+        q_table = OverlayQTable.from_cells(self.prior, q_cells)
+
+        accuracies, attempts = metrics_to_arrays(
+            user_data.get("accuracies", {}), user_data.get("attempts", {})
+        )
+        return UserState(
+            accuracies=accuracies,
+            attempts=attempts,
+            q_table=q_table,
+            epsilon=user_data.get("epsilon", 1.0),
+            iteration=user_data.get("iteration", 1),
+            last_question=user_data.get("last_question"),
+            planned_questions=list(user_data.get("planned_questions", [])),
+            dirty=is_new or migrate,
+            migrate_q_table=is_new or migrate,
+            seen_questions=self.question_bank.decode_seen(
+                user_data.get("seen_questions"), user_data.get("question_bank")
+            ) if self.question_bank is not None else None,
+        )
+
+    def _get(self, user_id: str) -> UserState:
+        state = self._entries.get(user_id)
+        if state is not None:
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return state
+
+        state = self._evicted.pop(user_id, None)
+        if state is None:
+            self.misses += 1
+            state = self._load(user_id)
+        else:
+            # Evicted before its changes were flushed; the store is behind
+            self.hits += 1
+        self._entries[user_id] = state
+        while len(self._entries) > self.max_size:
+            evicted_id, evicted = self._entries.popitem(last=False)
+            if evicted.dirty:
+                self._evicted[evicted_id] = evicted
+        return state
+
+    @contextmanager
+    def view(self, user_id: str):
+        """Read-only access to a user's state."""
+        with self._lock:
+            yield self._get(user_id)
+
+    @contextmanager
+    def edit(self, user_id: str):
+        """Mutable access to a user's state; marks it dirty on exit.
+
+        Callers that change Q-values should add the flat cell indices to
+        ``state.dirty_cells`` so only those cells are written back.
+        """
+        with self._lock:
+            state = self._get(user_id)
+            yield state
+            state.dirty = True
+        if self.write_mode == "write-through":
+            _, errors = self._write_states([(user_id, state)])
+            if errors:
+                raise errors[0]
+
+    def _snapshot(self, state: UserState) -> Optional[Tuple[Dict, list]]:
+        """Collect pending fields for a dirty state and reset its dirty flags."""
+        if not state.dirty:
+            return None
+
+        accuracies, attempts = arrays_to_metrics(state.accuracies, state.attempts)
+        fields = {
+            "accuracies": accuracies,
+            "attempts": attempts,
+            "epsilon": float(state.epsilon),
+            "iteration": int(state.iteration),
+            "planned_questions": [dict(q) for q in state.planned_questions],
+        }
+        if state.last_question:
+            fields["last_question"] = dict(state.last_question)
+        if state.seen_questions is not None:
+            fields["seen_questions"] = self.question_bank.encode_seen(state.seen_questions)
+            fields["question_bank"] = self.question_bank.fingerprint
+
+        unset = []
+        if state.migrate_q_table:
+            fields["q_cells"] = state.q_table.to_cells()
+            unset.append("q_table")
+        else:
+            for idx in state.dirty_cells:
+                fields[f"q_cells.{idx}"] = state.q_table.cells[idx]
+
+        state.dirty = False
+        state.dirty_cells = set()
+        state.migrate_q_table = False
+        state.version += 1
+        return fields, unset
+
+    def _write_states(self, states: List[Tuple[str, UserState]]) -> Tuple[int, List[Exception]]:
+        """Snapshot and write dirty states; returns the number written and the errors
+
+        The store is only ever written here, under ``_write_lock``, so a
+        user's snapshots are written in the order they were taken.
+        """
+        written, errors = 0, []
+        with self._write_lock:
+            with self._lock:
+                pending = [
+                    (user_id, state, self._snapshot(state), state.version)
+                    for user_id, state in states if state.dirty
+                ]
+            for user_id, state, (fields, unset), version in pending:
+                if version <= state.written_version:
+                    continue
+                try:
+                    self.store.save(user_id, fields, unset=unset)
+                except Exception as e:
+                    print(f"Failed to write RL state for {user_id}: {e}")
+                    errors.append(e)
+                    # Keep the user dirty so the next flush retries
+                    with self._lock:
+                        state.dirty = True
+                        state.dirty_cells.update(
+                            int(key.split(".", 1)[1])
+                            for key in fields if key.startswith("q_cells.")
+                        )
+                        state.migrate_q_table |= "q_cells" in fields
+                    continue
+                state.written_version = version
+                written += 1
+                with self._lock:
+                    if self._evicted.get(user_id) is state and not state.dirty:
+                        del self._evicted[user_id]
+        return written, errors
+
+    def flush(self) -> int:
+        """Write every dirty user, cached or evicted, to the store. Returns the number written."""
+        started = time.perf_counter()
+        with self._lock:
+            states = [(user_id, state) for user_id, state in self._entries.items() if state.dirty]
+            states.extend(self._evicted.items())
+        written, _ = self._write_states(states)
+        self.last_flush_seconds = time.perf_counter() - started
+        return written
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "dirty": sum(1 for state in self._entries.values() if state.dirty) + len(self._evicted),
+                "evicted_unflushed": len(self._evicted),
+                "last_flush_seconds": self.last_flush_seconds,
+            }
+
+    def _run_flusher(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def start(self) -> None:
+        """Start the background write-behind flusher."""
+        if self.write_mode != "write-behind" or self.flush_interval <= 0:
+            return
+        if self._flusher is None or not self._flusher.is_alive():
+            self._stop.clear()
+            self._flusher = threading.Thread(
+                target=self._run_flusher, name="rl-state-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def close(self) -> None:
+        """Stop the flusher and persist everything still pending."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
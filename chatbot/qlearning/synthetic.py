@@ -0,0 +1,43 @@
+# synthetic.py
+
+import numpy as np
+from typing import List, Tuple
+from .constants import SUBJECTS, DIFFICULTIES
+
+# (user_id, subject, difficulty, correct)
+Event = Tuple[str, str, str, bool]
+
+def generate_events(
+    n_users: int,
+    questions_per_user: int,
+    seed: int = 0,
+    learning_gain: float = 0.02
+) -> List[Event]:
+    """Generate quiz interactions for simulated students.
+
+    Each student has a latent skill per subject. The chance of answering
+    correctly falls with difficulty and rises slowly with practice, so
+    replayed Q-tables see the same kind of progression as real users.
+    Questions are picked uniformly at random, like an epsilon=1 policy.
+    """
+    rng = np.random.default_rng(seed)
+    n_subjects, n_difficulties = len(SUBJECTS), len(DIFFICULTIES)
+
+    skill = rng.normal(0.0, 1.0, size=(n_users, n_subjects))
+    difficulty_offset = np.linspace(-1.0, 1.0, n_difficulties)
+    subjects = rng.integers(0, n_subjects, size=(n_users, questions_per_user))
+    difficulties = rng.integers(0, n_difficulties, size=(n_users, questions_per_user))
+    noise = rng.random(size=(n_users, questions_per_user))
+
+    events = []
+    users = np.arange(n_users)
+    for step in range(questions_per_user):
+        s, d = subjects[:, step], difficulties[:, step]
+        logits = skill[users, s] - difficulty_offset[d]
+        correct = noise[:, step] < 1.0 / (1.0 + np.exp(-logits))
+        skill[users, s] += learning_gain
+        events.extend(
+            (f"student-{u}", SUBJECTS[s[u]], DIFFICULTIES[d[u]], bool(correct[u]))
+            for u in users
+        )
+    return events